@@ -14,6 +14,11 @@ from routes.usage import usage_bp
 from routes.settings import settings_bp
 from routes.audit import audit_bp
 from automation import AutomationTasks
+from utils.audit import get_audit_writer
+from utils.health import get_health_probe
+from utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, get_metrics_text
+from utils.request_timing import RequestTimer
+from utils.wireguard import flush_all_configs
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -52,6 +57,9 @@ except Exception as e:
     app.config['SESSION_TYPE'] = 'filesystem'
     Session(app)
 
+# Time requests by category for Server-Timing and /settings/performance
+RequestTimer(app)
+
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/auth')
 app.register_blueprint(dashboard_bp, url_prefix='/')
@@ -78,6 +86,10 @@ def before_request():
     if request.endpoint and ('auth.setup' in request.endpoint or 'auth.setup_2fa' in request.endpoint):
         return
     
+    # Scrapers and load balancer probes never log in
+    if request.endpoint in ('metrics', 'health_check', 'health_live', 'health_ready'):
+        return
+    
     store = DataStore()
     settings = store.get_settings()
     
@@ -90,41 +102,70 @@ def index():
     """Root route"""
     return redirect(url_for('dashboard.index'))
 
+def monitoring_denied():
+    """Error response unless the request carries METRICS_TOKEN as a bearer token
+    
+    Without a configured token the monitoring endpoints stay closed.
+    """
+    from flask import Response, request
+    import hmac
+    
+    if not Config.METRICS_TOKEN:
+        return Response('Set METRICS_TOKEN to enable this endpoint\n', status=403)
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {Config.METRICS_TOKEN}'.encode()):
+        return Response('Unauthorized\n', status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return None
+
 @app.route('/health')
 def health_check():
-    """Health check endpoint for monitoring"""
-    from flask import jsonify
-    from utils.wireguard import WireGuardManager
+    """Health check endpoint for monitoring, with the last probe and worker internals
+    
+    Open to a logged-in admin or the METRICS_TOKEN bearer token; the
+    public probes are /health/live and /health/ready.
+    """
+    from flask import jsonify, session
     from utils.storage import DataStore
     
-    try:
-        wg = WireGuardManager()
-        store = DataStore()
-        
-        # Get WireGuard service status
-        wg_status = wg.get_service_status()
-        
-        # Check if data storage is accessible
-        try:
-            store.get_settings()
-            storage_ok = True
-        except:
-            storage_ok = False
-        
-        # Overall health status
-        overall_status = 'healthy' if (wg_status['status'] == 'healthy' and storage_ok) else 'unhealthy'
-        
-        return jsonify({
-            'status': overall_status,
-            'wireguard': wg_status,
-            'storage': 'ok' if storage_ok else 'error',
-            'version': '1.0.0'
-        }), 200 if overall_status == 'healthy' else 503
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'error': str(e)
-        }), 500
+    if not session.get('logged_in'):
+        denied = monitoring_denied()
+        if denied:
+            return denied
+    
+    report = get_health_probe().report()
+    return jsonify({
+        **report,
+        'cache': DataStore().cache_stats(),
+        'audit_queue': get_audit_writer().metrics(),
+        'automation': automation.status(),
+        'version': '1.0.0'
+    }), 200 if report['ready'] else 503
+
+@app.route('/health/live')
+def health_live():
+    """Liveness probe: the worker answers requests, no checks and no I/O"""
+    from flask import jsonify
+    
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness probe served from the background health probe"""
+    from flask import jsonify
+    
+    report = get_health_probe().report()
+    return jsonify(report), 200 if report['ready'] else 503
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics, for requests with the METRICS_TOKEN bearer token"""
+    from flask import Response
+    
+    denied = monitoring_denied()
+    if denied:
+        return denied
+    
+    return Response(get_metrics_text(), content_type=METRICS_CONTENT_TYPE)
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -142,12 +183,15 @@ def forbidden_error(error):
     """403 error handler"""
     return render_template('errors/403.html'), 403
 
-# Start automation tasks
-try:
-    automation.start()
-    app.logger.info('Automation tasks started')
-except Exception as e:
-    app.logger.error(f'Failed to start automation tasks: {e}')
+# Probe readiness in the background so /health/ready never waits on checks
+get_health_probe().start()
+
+# Start automation tasks in whichever worker wins the leader lock
+if Config.AUTOMATION_MODE == 'embedded':
+    try:
+        automation.start_when_leader()
+    except Exception as e:
+        app.logger.error(f'Failed to start automation tasks: {e}')
 
 # Cleanup on shutdown
 import atexit
@@ -156,6 +200,8 @@ import atexit
 def cleanup():
     """Cleanup on application shutdown"""
     automation.stop()
+    flush_all_configs()
+    get_audit_writer().stop()
     app.logger.info('WireGuard Manager shutdown')
 
 from flask import render_template
@@ -1,10 +1,16 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta
+from utils.expiry import ExpiryScheduler
+from utils.leader import LeaderLock
+from utils.metrics import timed
+from utils.quota import QuotaEnforcer
 from utils.storage import DataStore
+from utils.usage import UsageCollector
 from utils.wireguard import WireGuardManager
 from config import Config
 import os
 import tarfile
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,18 +22,70 @@ class AutomationTasks:
         self.store = DataStore()
         self.wg = WireGuardManager()
         self.scheduler = BackgroundScheduler()
+        # Only the process holding this lock runs the scheduler
+        self.leader = LeaderLock(os.path.join(Config.CACHE_DIR, 'automation.lock'))
+        self._elector = None
+        self._stopping = threading.Event()
+        self.expiry = ExpiryScheduler(self.disable_expired_clients, self.store)
+        self.usage = UsageCollector(self.store, self.wg)
+        self.quotas = QuotaEnforcer(self.store, self.wg, self.usage.series)
+    
+    def start_when_leader(self, retry_interval: float = None):
+        """Start the scheduler once this process wins the leader lock
+        
+        Every worker calls this; one gets the lock and runs the jobs while
+        the others retry in the background and take over if it exits.
+        """
+        retry_interval = Config.AUTOMATION_LEADER_RETRY if retry_interval is None else retry_interval
+        
+        def elect():
+            while not self._stopping.is_set():
+                if self.leader.acquire():
+                    logger.info(f"Process {os.getpid()} elected to run automation tasks")
+                    self.start()
+                    return
+                self._stopping.wait(retry_interval)
+        
+        self._stopping.clear()
+        self._elector = threading.Thread(target=elect, name='automation-elector', daemon=True)
+        self._elector.start()
+    
+    def run_forever(self, retry_interval: float = None):
+        """Run the scheduler in the foreground until stop() is called"""
+        self.start_when_leader(retry_interval)
+        while not self._stopping.wait(1):
+            pass
+    
+    def status(self) -> dict:
+        """Leadership and scheduler state"""
+        return {
+            'mode': Config.AUTOMATION_MODE,
+            'leader': self.leader.is_leader,
+            'running': self.scheduler.running,
+            'expiry': self.expiry.stats() if self.scheduler.running else None,
+            'leader_pid': (self.leader.holder() or {}).get('pid')
+        }
     
     def start(self):
         """Start all scheduled tasks"""
-        # Check expired clients every hour
+        # Disable clients as they expire, with a daily full scan as a safety net
+        self.expiry.start()
         self.scheduler.add_job(
             self.check_expired_clients,
             'interval',
-            hours=1,
+            days=1,
             id='check_expired'
         )
         
-        # Record usage stats daily at 00:00
+        # Sample peer counters into the usage time series
+        self.scheduler.add_job(
+            self.sample_usage,
+            'interval',
+            seconds=Config.USAGE_SAMPLE_INTERVAL,
+            id='usage_sample'
+        )
+        
+        # Close the daily usage snapshot at 00:00
         self.scheduler.add_job(
             self.record_daily_usage,
             'cron',
@@ -60,94 +118,108 @@ class AutomationTasks:
     
     def stop(self):
         """Stop scheduler"""
+        self._stopping.set()
+        self.expiry.stop()
         if self.scheduler.running:
             self.scheduler.shutdown()
             logger.info("Automation tasks stopped")
+        self.leader.release()
     
+    @timed('wgm_job_duration_seconds', job='check_expired_clients')
     def check_expired_clients(self):
-        """Disable expired clients"""
+        """Disable expired clients the expiry scheduler missed"""
         logger.info("Checking for expired clients...")
         
-        clients = self.store.get_all_clients()
-        disabled_count = 0
+        now = datetime.now()
+        expired = [
+            client for client in self.store.get_all_clients()
+            if client.get('enabled', True)
+            and client.get('expiry_date')
+            and now > datetime.fromisoformat(client['expiry_date'])
+        ]
         
-        for client in clients:
-            if not client.get('enabled', True):
-                continue
-            
-            if not client.get('expiry_date'):
-                continue
-            
-            expiry = datetime.fromisoformat(client['expiry_date'])
-            if datetime.now() > expiry:
-                try:
-                    # Disable client
-                    self.wg.remove_peer(client['public_key'])
-                    client['enabled'] = False
-                    self.store.save_client(client)
-                    
-                    self.store.log_audit(
-                        'CLIENT_AUTO_DISABLED',
-                        'system',
-                        {'client_id': client['id'], 'name': client['name'], 'reason': 'expired'}
-                    )
-                    
-                    disabled_count += 1
-                    logger.info(f"Disabled expired client: {client['name']}")
-                except Exception as e:
-                    logger.error(f"Failed to disable client {client['name']}: {e}")
-        
-        if disabled_count > 0:
-            logger.info(f"Disabled {disabled_count} expired client(s)")
-        else:
+        if not expired:
             logger.info("No expired clients found")
+            return
+        
+        self.disable_expired_clients(expired)
     
+    def disable_expired_clients(self, expired: list) -> list:
+        """Remove expired clients' peers and mark them disabled, returns the ids that failed
+        
+        The peers are removed in one batch, falling back to one removal per
+        peer when the batch fails, so a bad key only affects its own client.
+        """
+        batch = self.wg.batch()
+        for client in expired:
+            batch.remove(client['public_key'])
+        failed_keys = batch.apply_each_on_failure()
+        
+        disabled = [client for client in expired if client['public_key'] not in failed_keys]
+        failed = [client['id'] for client in expired if client['public_key'] in failed_keys]
+        if failed:
+            logger.error(f"Failed to disable {len(failed)} expired client(s): {', '.join(failed)}")
+        if not disabled:
+            return failed
+        
+        for client in disabled:
+            client['enabled'] = False
+            client['disabled_reason'] = 'expired'
+        self.store.save_clients(disabled)
+        
+        for client in disabled:
+            self.store.log_audit(
+                'CLIENT_AUTO_DISABLED',
+                'system',
+                {'client_id': client['id'], 'name': client['name'], 'reason': 'expired'}
+            )
+            logger.info(f"Disabled expired client: {client['name']}")
+        
+        logger.info(f"Disabled {len(disabled)} expired client(s)")
+        return failed
+    
+    @timed('wgm_job_duration_seconds', job='sample_usage')
+    def sample_usage(self):
+        """Record traffic since the last sample"""
+        try:
+            self.enforce_quotas(self.usage.sample())
+        except Exception as e:
+            logger.error(f"Failed to sample usage: {e}")
+    
+    def enforce_quotas(self, deltas: dict):
+        """Disable clients that crossed their quota with the latest sample"""
+        if not Config.QUOTA_ENFORCEMENT_ENABLED:
+            return
+        try:
+            self.quotas.check(deltas)
+        except Exception as e:
+            logger.error(f"Failed to enforce quotas: {e}")
+    
+    @timed('wgm_job_duration_seconds', job='record_daily_usage')
     def record_daily_usage(self):
         """Record daily usage statistics"""
         logger.info("Recording daily usage statistics...")
         
         try:
-            stats = self.wg.get_interface_stats()
-            clients = self.store.get_all_clients()
-            
-            # Build usage snapshot
-            snapshot = {
-                'date': datetime.now().strftime('%Y-%m-%d'),
-                'timestamp': datetime.now().isoformat(),
-                'total_rx': 0,
-                'total_tx': 0,
-                'clients': []
-            }
-            
-            peer_stats = {p['public_key']: p for p in stats.get('peers', [])}
-            
-            for client in clients:
-                peer = peer_stats.get(client.get('public_key'))
-                if peer:
-                    client_data = {
-                        'id': client['id'],
-                        'name': client['name'],
-                        'transfer_rx': peer['transfer_rx'],
-                        'transfer_tx': peer['transfer_tx'],
-                        'transfer_total': peer['transfer_rx'] + peer['transfer_tx']
-                    }
-                    
-                    snapshot['total_rx'] += peer['transfer_rx']
-                    snapshot['total_tx'] += peer['transfer_tx']
-                    snapshot['clients'].append(client_data)
+            # Sampling after midnight rolls yesterday's last hour into its snapshot
+            self.enforce_quotas(self.usage.sample())
+            self.usage.prune_minutes()
+            self.usage.series.prune_hours()
             
-            self.store.save_usage_snapshot(snapshot['date'], snapshot)
+            date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+            snapshot = self.store.get_usage_snapshot(date) or {'clients': []}
             
             self.store.log_audit(
                 'USAGE_RECORDED',
                 'system',
-                {'date': snapshot['date'], 'total_clients': len(snapshot['clients'])}
+                {'date': date, 'total_clients': len(snapshot['clients'])}
             )
             
             logger.info(f"Recorded usage for {len(snapshot['clients'])} client(s)")
         except Exception as e:
             logger.error(f"Failed to record daily usage: {e}")
     
+    @timed('wgm_job_duration_seconds', job='create_auto_backup')
     def create_auto_backup(self):
         """Create automatic backup"""
         logger.info("Creating automatic backup...")
@@ -171,6 +243,7 @@ class AutomationTasks:
         except Exception as e:
             logger.error(f"Failed to create auto backup: {e}")
     
+    @timed('wgm_job_duration_seconds', job='clean_old_backups')
     def clean_old_backups(self):
         """Remove old backups"""
         logger.info("Cleaning old backups...")
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""Benchmark storage, peer stats and page rendering on synthetic datasets
+
+    python benchmarks/bench_app.py --clients 1000,10000,50000 --output bench.json
+
+Every dataset size runs in its own process with a fresh data tree: the
+clients, a year of daily usage snapshots and usage history, a large audit
+day, and a stub `wg` binary whose `wg show dump` lists a peer per enabled
+client. DataStore, WireGuardManager and usage store calls are timed
+directly; pages are timed through the Flask test client with a logged-in
+session. The JSON report has latency percentiles and throughput per case
+plus the commit it ran on, so two runs can be diffed:
+
+    python benchmarks/bench_app.py --clients 1000 --output before.json
+    git checkout my-branch
+    python benchmarks/bench_app.py --clients 1000 --output after.json
+"""
+import argparse
+import base64
+import json
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = 5
+# Usage history is written for this many clients at most, a year of it for
+# 50k clients would take longer to generate than the benchmark itself
+MAX_USAGE_CLIENTS = 2000
+
+STUB_WG = '''#!{python}
+import sys
+args = sys.argv[1:]
+if len(args) >= 3 and args[0] == 'show' and args[2] == 'dump':
+    with open({dump!r}) as f:
+        sys.stdout.write(f.read())
+elif args[:1] == ['showconf']:
+    print('[Interface]\\nListenPort = 51820\\n')
+elif args[:1] == ['show']:
+    print('interface: wg0')
+elif args[:1] in (['set'], ['addconf'], ['syncconf']):
+    if args[:1] != ['set']:
+        sys.stdin.read()
+else:
+    sys.exit(1)
+'''
+
+STUB_SUDO = '''#!/bin/sh
+exec "$@"
+'''
+
+def wg_key(i: int) -> str:
+    return base64.b64encode(i.to_bytes(32, 'big')).decode()
+
+def write_stubs(bin_dir: str, dump_path: str):
+    """`wg` answering from a dump file and a pass-through `sudo`"""
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, script in (('wg', STUB_WG.format(python=sys.executable, dump=dump_path)), ('sudo', STUB_SUDO)):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+
+def synthetic_clients(count: int):
+    now = datetime.now()
+    for i in range(count):
+        yield {
+            'id': str(uuid.UUID(int=i + 1)),
+            'name': f'bench-{i}',
+            'ip_address': f'10.{(i + 2) >> 16 & 255}.{(i + 2) >> 8 & 255}.{(i + 2) & 255}',
+            'ipv6_address': f'fd00::{i + 2:x}',
+            'public_key': wg_key(i + 2),
+            'private_key': wg_key(i + 1000003),
+            'preshared_key': wg_key(i + 2000003),
+            'profile_id': f'p{i % PROFILES}',
+            'profile_name': f'Profile {i % PROFILES}',
+            'created_at': (now - timedelta(days=i % 365)).isoformat(),
+            # A tenth expired, a tenth expiring within a month, the rest without expiry
+            'expiry_date': (now + timedelta(days=(i % 60) - 30)).isoformat() if i % 5 == 0 else None,
+            'enabled': i % 10 != 0,
+            'notes': ''
+        }
+
+def synthetic_dump(clients) -> str:
+    now = int(time.time())
+    lines = [f"{wg_key(0)}\t{wg_key(1)}\t51820\toff"]
+    for i, client in enumerate(clients):
+        if not client['enabled']:
+            continue
+        handshake = now - (i % 600) if i % 4 else 0
+        lines.append('\t'.join([
+            client['public_key'],
+            client['preshared_key'],
+            f"198.51.{(i >> 8) & 255}.{i & 255}:{1024 + i % 50000}",
+            f"{client['ip_address']}/32,{client['ipv6_address']}/128",
+            str(handshake),
+            str(i * 7919),
+            str(i * 104729),
+            'off'
+        ]))
+    return '\n'.join(lines) + '\n'
+
+def build_dataset(args, clients_count: int, work: str) -> dict:
+    """Write the synthetic data tree and the stub dump, returns what was generated"""
+    from utils.storage import DataStore
+    from utils.usage_store import UsageStore
+
+    store = DataStore()
+    store.save_settings({**store.get_settings(), 'initialized': True})
+    for index in range(PROFILES):
+        store.save_profile({
+            'id': f'p{index}', 'name': f'Profile {index}', 'dns': '1.1.1.1',
+            'allowed_ips': '0.0.0.0/0', 'created_at': datetime.now().isoformat()
+        })
+
+    clients = list(synthetic_clients(clients_count))
+    store.save_clients(clients)
+
+    dump_path = os.path.join(work, 'dump')
+    with open(dump_path, 'w') as f:
+        f.write(synthetic_dump(clients))
+    write_stubs(os.path.join(work, 'bin'), dump_path)
+
+    # A year of daily history in the columnar store and as legacy snapshots
+    usage_clients = clients[:min(clients_count, args.usage_clients)]
+    series = UsageStore(writable=True)
+    today = date.today()
+    for offset in range(args.days, 0, -1):
+        day = today - timedelta(days=offset)
+        values = {
+            client['id']: ((i + 1) * (offset % 7 + 1) * 1048576, (i + 1) * (offset % 5 + 1) * 262144)
+            for i, client in enumerate(usage_clients)
+        }
+        series.set_day(day, values)
+        store.save_usage_snapshot(day.strftime('%Y-%m-%d'), {
+            'date': day.strftime('%Y-%m-%d'),
+            'timestamp': datetime.combine(day, datetime.max.time()).isoformat(),
+            'mode': 'delta',
+            'total_rx': sum(rx for rx, _ in values.values()),
+            'total_tx': sum(tx for _, tx in values.values()),
+            'clients': [
+                {
+                    'id': client['id'],
+                    'name': client['name'],
+                    'transfer_rx': values[client['id']][0],
+                    'transfer_tx': values[client['id']][1],
+                    'transfer_total': sum(values[client['id']])
+                }
+                for client in usage_clients
+            ]
+        })
+    series.close()
+
+    # One busy audit day plus a quiet week before it
+    now = datetime.now()
+    store.append_audit_lines(now.strftime('%Y-%m-%d'), [
+        json.dumps(store.build_audit_entry('CLIENT_VIEWED', 'admin', {'client_id': clients[i % clients_count]['id']})) + '\n'
+        for i in range(args.audit_entries)
+    ])
+    for offset in range(1, 8):
+        day = (now - timedelta(days=offset)).strftime('%Y-%m-%d')
+        store.append_audit_lines(day, [
+            json.dumps(store.build_audit_entry('LOGIN', 'admin', {})) + '\n' for _ in range(100)
+        ])
+
+    return {
+        'clients': clients_count,
+        'peers': sum(1 for client in clients if client['enabled']),
+        'usage_clients': len(usage_clients),
+        'usage_days': args.days,
+        'audit_entries': args.audit_entries,
+        'first_client': clients[0]['id']
+    }
+
+def summarize(timings: list) -> dict:
+    ordered = sorted(timings)
+    pct = lambda p: ordered[min(max(math.ceil(p / 100 * len(ordered)), 1), len(ordered)) - 1] * 1000
+    total = sum(ordered)
+    return {
+        'runs': len(ordered),
+        'mean_ms': round(total / len(ordered) * 1000, 3),
+        'p50_ms': round(pct(50), 3),
+        'p90_ms': round(pct(90), 3),
+        'p99_ms': round(pct(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'ops_per_sec': round(len(ordered) / total, 1) if total else None
+    }
+
+def measure(func, repeat: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+def run_dataset(args, clients_count: int, results):
+    """Child process: build one dataset and time every case against it"""
+    work = tempfile.mkdtemp(prefix=f'wgm-bench-{clients_count}-')
+    os.chdir(work)
+    os.environ.update(
+        DATA_DIR=os.path.join(work, 'data'),
+        BACKUP_DIR=os.path.join(work, 'backups'),
+        CACHE_DIR=os.path.join(work, 'cache'),
+        STORAGE_BACKEND=args.backend,
+        WG_SUBNET='10.0.0.0/16',
+        WG_SERVER_PUBLIC_KEY=wg_key(1),
+        SERVER_PUBLIC_IP='203.0.113.1',
+        WG_KEYGEN_BACKEND='native',
+        WG_STATS_BACKEND='wg',
+        WG_STATS_CACHE_TTL=str(args.wg_cache_ttl),
+        METRICS_CACHE_TTL='0',
+        AUTOMATION_MODE='external',
+        ENABLE_2FA='False',
+        REDIS_URL='redis://127.0.0.1:1/0'
+    )
+    os.environ['PATH'] = os.path.join(work, 'bin') + os.pathsep + os.environ['PATH']
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from config import Config
+    Config.init_app()
+    started = time.perf_counter()
+    dataset = build_dataset(args, clients_count, work)
+    dataset['build_seconds'] = round(time.perf_counter() - started, 2)
+    print(f"{clients_count} clients: dataset built in {dataset['build_seconds']}s in {work}", flush=True)
+
+    from app import app
+    from utils.storage import DataStore
+    from utils.usage_store import UsageStore
+    from utils.wireguard import WireGuardManager
+
+    store = DataStore()
+    wg = WireGuardManager()
+    series = UsageStore()
+    client_id = dataset['first_client']
+    today = date.today()
+    year_ago = (today - timedelta(days=365)).strftime('%Y-%m-%d')
+    month_ago = (today - timedelta(days=30)).strftime('%Y-%m-%d')
+
+    web = app.test_client()
+    with web.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = 'admin'
+
+    def page(url):
+        def get():
+            response = web.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {url} answered {response.status_code}')
+        return get
+
+    cases = [
+        ('store.get_all_clients', store.get_all_clients),
+        ('store.get_client', lambda: store.get_client(client_id)),
+        ('store.count_clients_by_profile', store.count_clients_by_profile),
+        ('store.get_usage_range 30d', lambda: store.get_usage_range(month_ago, today.strftime('%Y-%m-%d'))),
+        ('store.get_usage_range 365d', lambda: store.get_usage_range(year_ago, today.strftime('%Y-%m-%d'))),
+        ('store.get_audit_logs today', lambda: store.get_audit_logs(today.strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d'))),
+        ('store.get_recent_audit_entries', store.get_recent_audit_entries),
+        ('wg.get_peer_stats', wg.get_peer_stats),
+        ('wg.get_peer_columns', lambda: wg.get_peer_columns(('latest_handshake', 'transfer_rx', 'transfer_tx'))),
+        ('usage.daily_series 365d', lambda: series.daily_series(today - timedelta(days=365), today)),
+        ('usage.top_clients', lambda: series.top_clients(10)),
+        ('GET /', page('/')),
+        ('GET /clients/', page('/clients/')),
+        ('GET /clients/<id>', page(f'/clients/{client_id}')),
+        ('GET /profiles/', page('/profiles/')),
+        ('GET /usage/', page('/usage/')),
+        ('GET /usage/api/chart-data 365d', page('/usage/api/chart-data?days=365')),
+        ('GET /usage/api/client/<id>', page(f'/usage/api/client/{client_id}?days=365')),
+        ('GET /audit/', page('/audit/')),
+        ('GET /api/stats', page('/api/stats')),
+        ('GET /metrics', page('/metrics')),
+        ('GET /health/ready', lambda: web.get('/health/ready'))
+    ]
+
+    measured = {}
+    for name, func in cases:
+        if args.only and not any(part in name for part in args.only):
+            continue
+        try:
+            measured[name] = measure(func, args.repeat, args.warmup)
+        except Exception as e:
+            measured[name] = {'error': str(e)}
+        stats = measured[name]
+        if 'error' in stats:
+            print(f"  {name:<36} ERROR {stats['error']}", flush=True)
+        else:
+            print(f"  {name:<36} p50 {stats['p50_ms']:9.2f} ms   p99 {stats['p99_ms']:9.2f} ms   "
+                  f"{stats['ops_per_sec']:9.1f}/s", flush=True)
+
+    series.close()
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    results.put({'dataset': dataset, 'results': measured})
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL) != 0
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WireGuard Manager on synthetic datasets')
+    parser.add_argument('--clients', default='1000,10000', help='Comma-separated dataset sizes')
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json', help='Client storage backend')
+    parser.add_argument('--days', type=int, default=365, help='Days of usage history')
+    parser.add_argument('--usage-clients', type=int, default=MAX_USAGE_CLIENTS, help='Clients with usage history')
+    parser.add_argument('--audit-entries', type=int, default=20000, help="Entries in today's audit file")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--wg-cache-ttl', type=float, default=0,
+                        help='WG_STATS_CACHE_TTL during the run (0 runs the stub dump on every call)')
+    parser.add_argument('--only', action='append', help='Only cases whose name contains this (repeatable)')
+    parser.add_argument('--output', '-o', help='Write the JSON report here (default: stdout)')
+    parser.add_argument('--keep', action='store_true', help='Keep the generated data trees')
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'args': vars(args),
+        'datasets': []
+    }
+
+    # Config is read at import time, so every dataset gets a fresh interpreter
+    context = multiprocessing.get_context('spawn')
+    for size in [int(value) for value in args.clients.split(',') if value.strip()]:
+        results = context.Queue()
+        process = context.Process(target=run_dataset, args=(args, size, results))
+        process.start()
+        while True:
+            try:
+                report['datasets'].append(results.get(timeout=1))
+                break
+            except queue.Empty:
+                if not process.is_alive():
+                    raise SystemExit(f'Benchmark of {size} clients failed')
+        process.join()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
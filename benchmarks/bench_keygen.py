@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Compare native key generation with the `wg` subprocess path
+
+    python benchmarks/bench_keygen.py --count 200
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import wgkeys
+
+def wg_keys(command: list) -> tuple:
+    """One client's keys through `wg`, as the subprocess backend does"""
+    private_key = subprocess.check_output(command + ['wg', 'genkey']).decode().strip()
+    public_key = subprocess.check_output(command + ['wg', 'pubkey'], input=private_key.encode()).decode().strip()
+    preshared_key = subprocess.check_output(command + ['wg', 'genpsk']).decode().strip()
+    return private_key, public_key, preshared_key
+
+def native_keys() -> tuple:
+    private_key, public_key = wgkeys.generate_keypair()
+    return private_key, public_key, wgkeys.generate_preshared_key()
+
+def measure(name: str, func, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {elapsed * 1000 / count:8.3f} ms/client   {count / elapsed:10.0f} clients/s")
+    return elapsed
+
+def check_compatible(command: list, count: int = 20):
+    """Native public keys must match `wg pubkey` for the same private key"""
+    for _ in range(count):
+        private_key = wgkeys.generate_private_key()
+        expected = subprocess.check_output(command + ['wg', 'pubkey'], input=private_key.encode()).decode().strip()
+        if wgkeys.public_key(private_key) != expected:
+            raise SystemExit(f"Public key mismatch for {private_key}")
+    print(f"native public keys match `wg pubkey` ({count} checked)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark WireGuard key generation')
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--sudo', action='store_true', help='Run wg through sudo like the service does')
+    args = parser.parse_args()
+
+    command = ['sudo'] if args.sudo else []
+    native = measure('native (cryptography)', native_keys, args.count)
+    try:
+        subprocess_time = measure('wg subprocess', lambda: wg_keys(command), args.count)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"wg subprocess            skipped: {e}")
+        return
+    print(f"speedup {subprocess_time / native:.0f}x")
+    check_compatible(command)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Micro-benchmark for parsing large `wg show dump` output
+
+    python benchmarks/bench_wgdump.py --peers 50000
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.wgdump import iter_peers, parse_peer_columns, parse_peer_stats
+
+def synthetic_dump(peers: int) -> str:
+    """Build dump output for a number of fake peers"""
+    key = lambda i: base64.b64encode(i.to_bytes(32, 'big')).decode()
+    now = int(time.time())
+    lines = [f"{key(0)}\t{key(1)}\t51820\toff"]
+    for i in range(peers):
+        handshake = now - (i % 600) if i % 4 else 0
+        lines.append('\t'.join([
+            key(i + 2),
+            key(i + 3),
+            f"198.51.{(i >> 8) & 255}.{i & 255}:{1024 + i % 50000}",
+            f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}/32,fd00::{i:x}/128",
+            str(handshake),
+            str(i * 7919),
+            str(i * 104729),
+            'off' if i % 2 else '25'
+        ]))
+    return '\n'.join(lines) + '\n'
+
+def legacy_parse(dump: str) -> dict:
+    """The previous get_interface_stats parser, for comparison"""
+    peers = []
+    for line in dump.strip().split('\n')[1:]:
+        parts = line.split('\t')
+        if len(parts) >= 8:
+            peers.append({
+                'public_key': parts[0],
+                'preshared_key': parts[1] if parts[1] != '(none)' else None,
+                'endpoint': parts[2] if parts[2] != '(none)' else None,
+                'allowed_ips': parts[3],
+                'latest_handshake': int(parts[4]),
+                'transfer_rx': int(parts[5]),
+                'transfer_tx': int(parts[6]),
+                'persistent_keepalive': parts[7] if parts[7] != 'off' else None
+            })
+    return {p['public_key']: p for p in peers}
+
+def measure(name: str, func, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<36} best {min(timings) * 1000:8.1f} ms   peak {peak / 1024 / 1024:7.1f} MiB")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark wg dump parsing')
+    parser.add_argument('--peers', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    dump = synthetic_dump(args.peers)
+    print(f"{args.peers} peers, {len(dump) / 1024 / 1024:.1f} MiB of dump output")
+
+    usage = ('transfer_rx', 'transfer_tx')
+    totals = ('latest_handshake', 'transfer_rx', 'transfer_tx')
+    measure('legacy dict per peer', lambda: legacy_parse(dump), args.repeat)
+    measure('records, all columns', lambda: parse_peer_stats(dump), args.repeat)
+    measure('records, rx/tx only', lambda: parse_peer_stats(dump, usage), args.repeat)
+    measure('stream rx/tx totals', lambda: sum(p.transfer_rx for p in iter_peers(dump, usage)), args.repeat)
+    measure('column arrays, handshake/rx/tx', lambda: parse_peer_columns(dump, totals), args.repeat)
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,13 @@ class Config:
     WG_MTU = int(os.getenv('WG_MTU', 1420))
     WG_PERSISTENT_KEEPALIVE = int(os.getenv('WG_PERSISTENT_KEEPALIVE', 25))
     
+    WG_STATS_BACKEND = os.getenv('WG_STATS_BACKEND', 'wg')  # wg, netlink or helper
+    WG_HELPER_SOCKET = os.getenv('WG_HELPER_SOCKET', '/run/wireguard-manager/wg-helper.sock')
+    WG_STATS_CACHE_TTL = float(os.getenv('WG_STATS_CACHE_TTL', 2))
+    WG_STATUS_CACHE_TTL = float(os.getenv('WG_STATUS_CACHE_TTL', 10))
+    WG_CONFIG_SAVE_INTERVAL = float(os.getenv('WG_CONFIG_SAVE_INTERVAL', 5))
+    WG_KEYGEN_BACKEND = os.getenv('WG_KEYGEN_BACKEND', 'native').lower()  # native or wg
+    
     # Server
     SERVER_PUBLIC_IP = os.getenv('SERVER_PUBLIC_IP', '')
     SERVER_PUBLIC_IPV6 = os.getenv('SERVER_PUBLIC_IPV6', '')
@@ -52,6 +59,52 @@ class Config:
     # Directories
     DATA_DIR = os.getenv('DATA_DIR', './data')
     BACKUP_DIR = os.getenv('BACKUP_DIR', './backups')
+    CACHE_DIR = os.getenv('CACHE_DIR', './cache')
+    
+    # Storage
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')  # json or sqlite
+    SQLITE_PATH = os.getenv('SQLITE_PATH', os.path.join(DATA_DIR, 'clients.db'))
+    STORAGE_CACHE_ENABLED = os.getenv('STORAGE_CACHE_ENABLED', 'True').lower() == 'true'
+    
+    # Audit
+    AUDIT_ASYNC = os.getenv('AUDIT_ASYNC', 'True').lower() == 'true'
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))
+    AUDIT_FSYNC = os.getenv('AUDIT_FSYNC', 'none')  # none or batch
+    
+    # Automation
+    AUTOMATION_MODE = os.getenv('AUTOMATION_MODE', 'embedded')  # embedded or external
+    AUTOMATION_LEADER_RETRY = float(os.getenv('AUTOMATION_LEADER_RETRY', 30))
+    
+    # Usage
+    USAGE_SAMPLE_INTERVAL = int(os.getenv('USAGE_SAMPLE_INTERVAL', 60))
+    USAGE_MINUTE_RETENTION_DAYS = int(os.getenv('USAGE_MINUTE_RETENTION_DAYS', 7))
+    USAGE_HOUR_RETENTION_DAYS = int(os.getenv('USAGE_HOUR_RETENTION_DAYS', 35))
+    QUOTA_ENFORCEMENT_ENABLED = os.getenv('QUOTA_ENFORCEMENT_ENABLED', 'True').lower() == 'true'
+    
+    # Live dashboard
+    LIVE_STATS_INTERVAL = float(os.getenv('LIVE_STATS_INTERVAL', 5))
+    LIVE_STATS_STREAM_SECONDS = int(os.getenv('LIVE_STATS_STREAM_SECONDS', 300))
+    LIVE_STATS_MAX_STREAMS = int(os.getenv('LIVE_STATS_MAX_STREAMS', 8))
+    
+    # Request timing and profiling
+    REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', 'True').lower() == 'true'
+    REQUEST_TIMING_WINDOW = int(os.getenv('REQUEST_TIMING_WINDOW', 200))
+    PROFILE_EVERY_N = int(os.getenv('PROFILE_EVERY_N', 0))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'logs/profiles')
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 100))
+    
+    # Health probes
+    HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', 5))
+    HEALTH_STALE_AFTER = float(os.getenv('HEALTH_STALE_AFTER', 30))
+    
+    # Metrics
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    METRICS_CACHE_TTL = float(os.getenv('METRICS_CACHE_TTL', 10))
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+    METRICS_PEER_DETAIL = os.getenv('METRICS_PEER_DETAIL', 'True').lower() == 'true'
+    METRICS_MAX_PEERS = int(os.getenv('METRICS_MAX_PEERS', 500))
     
     # Backup
     BACKUP_RETENTION_DAYS = int(os.getenv('BACKUP_RETENTION_DAYS', 30))
@@ -63,6 +116,7 @@ class Config:
         """Initialize application directories"""
         os.makedirs(Config.DATA_DIR, exist_ok=True)
         os.makedirs(Config.BACKUP_DIR, exist_ok=True)
+        os.makedirs(Config.CACHE_DIR, mode=0o700, exist_ok=True)
         os.makedirs(os.path.join(Config.DATA_DIR, 'clients'), exist_ok=True)
         os.makedirs(os.path.join(Config.DATA_DIR, 'profiles'), exist_ok=True)
         os.makedirs(os.path.join(Config.DATA_DIR, 'usage'), exist_ok=True)
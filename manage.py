@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Command line maintenance tasks for WireGuard Manager"""
+import argparse
+import json
+import os
+import sys
+
+from config import Config
+
+def migrate_storage(args):
+    """Import the JSON client tree into the SQLite client store"""
+    from utils.client_store import SQLiteClientStore
+
+    clients_dir = args.source or os.path.join(Config.DATA_DIR, 'clients')
+    db_path = args.database or Config.SQLITE_PATH
+
+    if not os.path.isdir(clients_dir):
+        print(f"Client directory not found: {clients_dir}")
+        return 1
+
+    clients = []
+    skipped = 0
+    for filename in sorted(os.listdir(clients_dir)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(clients_dir, filename), 'r') as f:
+                client = json.load(f)
+            if not client.get('id'):
+                raise ValueError('missing id')
+            clients.append(client)
+        except Exception as e:
+            print(f"Skipping {filename}: {e}")
+            skipped += 1
+
+    SQLiteClientStore(db_path).save_many(clients)
+
+    print(f"Imported {len(clients)} client(s) into {db_path} ({skipped} skipped)")
+    print("Set STORAGE_BACKEND=sqlite in .env and restart the service to use it.")
+    return 0
+
+def convert_audit(args):
+    """Convert legacy per-day audit JSON files to the append-only JSONL format"""
+    from datetime import datetime
+    from utils.storage import DataStore
+
+    store = DataStore()
+    if not os.path.isdir(store.audit_dir):
+        print(f"Audit directory not found: {store.audit_dir}")
+        return 1
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    converted = 0
+    for filename in sorted(os.listdir(store.audit_dir)):
+        if not filename.endswith('.json'):
+            continue
+        date = filename[:-len('.json')]
+        # Today's file may still receive entries from running workers
+        if date == today and not args.include_today:
+            print(f"Skipping {filename} (today, use --include-today while the service is stopped)")
+            continue
+        count = store.convert_audit_file(date)
+        print(f"Converted {filename}: {count} entries")
+        converted += 1
+
+    print(f"Converted {converted} audit file(s)")
+    return 0
+
+def wg_helper(args):
+    """Serve interface dumps read over netlink to the unprivileged web workers"""
+    import grp
+    import socket
+    from utils.netlink import NetlinkError, WireGuardNetlink
+
+    socket_path = args.socket or Config.WG_HELPER_SOCKET
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    netlink = WireGuardNetlink()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o660)
+    if args.group:
+        os.chown(socket_path, -1, grp.getgrnam(args.group).gr_gid)
+    server.listen(16)
+    print(f"Serving {Config.WG_INTERFACE} stats on {socket_path}")
+
+    while True:
+        conn, _ = server.accept()
+        with conn:
+            try:
+                conn.settimeout(5)
+                interface = conn.makefile('rb').readline().decode().strip()
+                # Only the managed interface is exposed
+                if interface != Config.WG_INTERFACE:
+                    conn.sendall(f"ERROR unknown interface {interface}\n".encode())
+                    continue
+                conn.sendall(netlink.dump(interface).encode())
+            except (NetlinkError, OSError) as e:
+                netlink.close()
+                try:
+                    conn.sendall(f"ERROR {e}\n".encode())
+                except OSError:
+                    pass
+
+def import_clients(args):
+    """Provision clients from a CSV/JSON file and write their configs to a zip archive"""
+    from utils.storage import DataStore
+    from utils.provisioning import ProvisioningError, archive_name, build_config_archive, parse_rows, provision_clients
+    from utils.wireguard import flush_all_configs
+
+    try:
+        if args.file == '-':
+            data = sys.stdin.read()
+        else:
+            with open(args.file, 'r', encoding='utf-8') as f:
+                data = f.read()
+        clients = provision_clients(parse_rows(data, args.format))
+    except ProvisioningError as e:
+        for error in e.errors:
+            print(error)
+        return 1
+    except Exception as e:
+        print(f"Failed to add clients: {e}")
+        return 1
+    finally:
+        # Peers added before a failure are live too; save them before exiting
+        flush_all_configs()
+
+    output = args.output or archive_name()
+    with open(output, 'wb') as f:
+        f.write(build_config_archive(clients).getvalue())
+    os.chmod(output, 0o600)
+
+    DataStore().log_audit('CLIENTS_BULK_ADDED', 'cli', {'count': len(clients), 'client_ids': [c['id'] for c in clients]})
+    print(f"Added {len(clients)} client(s), configs written to {output}")
+    return 0
+
+def automation(args):
+    """Run the scheduled jobs in the foreground, for AUTOMATION_MODE=external"""
+    import logging
+    import signal
+    from automation import AutomationTasks
+    from utils.audit import get_audit_writer
+    from utils.wireguard import flush_all_configs
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    Config.init_app()
+
+    tasks = AutomationTasks()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: tasks._stopping.set())
+
+    if Config.AUTOMATION_MODE != 'external':
+        print("Warning: AUTOMATION_MODE is not 'external', web workers compete for the same leader lock")
+    print(f"Waiting for the automation lock in {Config.CACHE_DIR}")
+    try:
+        tasks.run_forever()
+    finally:
+        tasks.stop()
+        flush_all_configs()
+        get_audit_writer().stop()
+    return 0
+
+def import_usage(args):
+    """Load legacy daily usage snapshots into the columnar usage store"""
+    from utils.usage import import_legacy_snapshots
+    from utils.usage_store import UsageStore
+
+    series = UsageStore(writable=True)
+    imported = 0
+    for date, clients in import_legacy_snapshots(series=series):
+        print(f"Imported {date}: {clients} client(s)")
+        imported += 1
+    print(f"Imported {imported} day(s) of usage history")
+
+    # Day files recorded before the week and month rollups and the active counts existed
+    years = series.rebuild_rollups()
+    series.close()
+    print(f"Rebuilt weekly and monthly rollups and daily active counts for {len(years)} year(s)")
+    return 0
+
+def rebuild_ipam(args):
+    """Recompute the free address list from the client records"""
+    from utils.ipam import AddressPool
+
+    pool = AddressPool()
+    pool.rebuild()
+    stats = pool.stats()
+    print(f"{stats['used']} of {stats['size']} addresses in use, {stats['free']} free ({stats['intervals']} free range(s))")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='WireGuard Manager maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate = subparsers.add_parser('migrate-storage', help='Import JSON client files into SQLite')
+    migrate.add_argument('--source', help='Client JSON directory (default: DATA_DIR/clients)')
+    migrate.add_argument('--database', help='SQLite database path (default: SQLITE_PATH)')
+    migrate.set_defaults(func=migrate_storage)
+
+    audit = subparsers.add_parser('convert-audit', help='Convert legacy audit day files to JSONL')
+    audit.add_argument('--include-today', action='store_true', help="Also convert today's file")
+    audit.set_defaults(func=convert_audit)
+
+    helper = subparsers.add_parser('wg-helper', help='Run the privileged netlink stats helper (as root)')
+    helper.add_argument('--socket', help='Unix socket path (default: WG_HELPER_SOCKET)')
+    helper.add_argument('--group', default='www-data', help='Group allowed to connect')
+    helper.set_defaults(func=wg_helper)
+
+    bulk = subparsers.add_parser('import-clients', help='Provision clients from a CSV or JSON file')
+    bulk.add_argument('file', help="CSV/JSON file with name, profile, expiry_days and notes ('-' for stdin)")
+    bulk.add_argument('--format', choices=['csv', 'json'], help='Input format (default: detect)')
+    bulk.add_argument('--output', '-o', help='Zip archive for the client configs (default: clients_<timestamp>.zip)')
+    bulk.set_defaults(func=import_clients)
+
+    scheduler = subparsers.add_parser('automation', help='Run the scheduled jobs (AUTOMATION_MODE=external)')
+    scheduler.set_defaults(func=automation)
+
+    usage = subparsers.add_parser('import-usage', help='Import daily usage snapshots into the columnar store (stop the service first)')
+    usage.set_defaults(func=import_usage)
+
+    ipam = subparsers.add_parser('rebuild-ipam', help='Rebuild the free address list from client records (stop the service first)')
+    ipam.set_defaults(func=rebuild_ipam)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
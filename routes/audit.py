@@ -18,17 +18,11 @@ def index():
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
     
-    logs = store.get_audit_logs(
+    # Stream entries from the day files
+    all_entries = list(store.iter_audit_entries(
         start_date.strftime('%Y-%m-%d'),
         end_date.strftime('%Y-%m-%d')
-    )
-    
-    # Flatten entries
-    all_entries = []
-    for log in logs:
-        for entry in log.get('entries', []):
-            entry['date'] = log.get('date')
-            all_entries.append(entry)
+    ))
     
     # Sort by timestamp descending
     all_entries.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
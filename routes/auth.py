@@ -88,9 +88,10 @@ def setup():
             return render_template('setup.html')
         
         # Save password hash
-        settings['admin_password_hash'] = hash_password(password)
-        settings['initialized'] = True
-        store.save_settings(settings)
+        store.update_settings({
+            'admin_password_hash': hash_password(password),
+            'initialized': True
+        })
         
         log_action('INITIAL_SETUP', {'ip': request.remote_addr})
         
@@ -121,8 +122,7 @@ def setup_2fa():
             return redirect(url_for('auth.setup_2fa'))
         
         if verify_2fa_token(secret, token):
-            settings['admin_2fa_secret'] = secret
-            store.save_settings(settings)
+            store.update_setting('admin_2fa_secret', secret)
             session.pop('2fa_secret', None)
             
             log_action('2FA_SETUP', {'ip': request.remote_addr})
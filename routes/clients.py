@@ -2,7 +2,12 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from utils.auth import login_required, log_action
 from utils.storage import DataStore
 from utils.wireguard import WireGuardManager
+from utils.ipam import AddressPool, AddressPoolExhausted
+from utils.expiry import notify_expiry_change
 from utils.helpers import generate_qr_code, format_bytes, format_timestamp
+from utils.quota import effective_quota, period_key, period_start, period_usage, quota_fields
+from utils.usage_store import UsageStore
+from utils.provisioning import MAX_BULK_CLIENTS, ProvisioningError, archive_name, build_config_archive, parse_rows, provision_clients
 from config import Config
 from datetime import datetime, timedelta
 import uuid
@@ -11,6 +16,8 @@ import io
 clients_bp = Blueprint('clients', __name__)
 store = DataStore()
 wg = WireGuardManager()
+ip_pool = AddressPool(store)
+usage_history = UsageStore()
 
 @clients_bp.route('/')
 @login_required
@@ -25,8 +32,7 @@ def index():
         # Get stats with error handling
         peer_stats = {}
         try:
-            stats = wg.get_interface_stats()
-            peer_stats = {p['public_key']: p for p in stats.get('peers', [])}
+            peer_stats = wg.get_peer_stats(('latest_handshake', 'transfer_rx', 'transfer_tx'))
         except Exception as e:
             print(f"Warning: Could not get WireGuard stats: {e}")
         
@@ -86,6 +92,12 @@ def add():
             flash('Client name is required', 'error')
             return render_template('clients/add.html', profiles=profiles)
         
+        try:
+            quota = quota_fields(request.form)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return render_template('clients/add.html', profiles=profiles)
+        
         # Get profile
         profile = store.get_profile(profile_id) if profile_id else None
         if not profile and profiles:
@@ -99,15 +111,13 @@ def add():
         private_key, public_key = wg.generate_keypair()
         preshared_key = wg.generate_preshared_key()
         
-        # Get next IP
-        settings = store.get_settings()
-        last_ip = settings.get('last_client_ip', 2)
-        ip_address = wg.get_next_ip(last_ip)
-        
-        # Get next IPv6 if enabled
-        ipv6_address = ''
-        if Config.WG_IPV6_ENABLED:
-            ipv6_address = wg.get_next_ipv6(last_ip)
+        # Get next free IPv4/IPv6 address
+        try:
+            slot = ip_pool.allocate()[0]
+        except AddressPoolExhausted as e:
+            flash(str(e), 'error')
+            return render_template('clients/add.html', profiles=profiles)
+        ip_address, ipv6_address = ip_pool.addresses(slot)
         
         # Calculate expiry
         expiry_date = None
@@ -129,34 +139,76 @@ def add():
             'created_at': datetime.now().isoformat(),
             'expiry_date': expiry_date,
             'enabled': True,
-            'notes': notes
+            'notes': notes,
+            **quota
         }
         
         # Save client
         store.save_client(client)
         
-        # Update last IP
-        settings['last_client_ip'] = last_ip + 1
-        store.save_settings(settings)
-        
         # Add peer to WireGuard
         try:
-            allowed_ips = f"{ip_address}/32"
-            if ipv6_address:
-                allowed_ips += f",{ipv6_address}/128"
-            
-            wg.add_peer(public_key, preshared_key, allowed_ips)
+            wg.add_peer(public_key, preshared_key, wg.client_allowed_ips(client))
+            if expiry_date:
+                notify_expiry_change([client_id])
             log_action('CLIENT_ADDED', {'client_id': client_id, 'name': name})
             flash(f'Client "{name}" added successfully!', 'success')
             return redirect(url_for('clients.view', client_id=client_id))
         except Exception as e:
             # Rollback
             store.delete_client(client_id)
+            ip_pool.release([slot])
             flash(f'Failed to add client: {str(e)}', 'error')
             return render_template('clients/add.html', profiles=profiles)
     
     return render_template('clients/add.html', profiles=profiles)
 
+@clients_bp.route('/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk():
+    """Provision many clients from CSV/JSON and download their configs"""
+    profiles = store.get_all_profiles()
+    
+    if request.method == 'POST':
+        try:
+            if request.is_json:
+                rows = request.get_json(silent=True)
+                if isinstance(rows, dict):
+                    rows = rows.get('clients', [])
+                if not isinstance(rows, list):
+                    raise ProvisioningError(['JSON body must be a list of clients'])
+            else:
+                upload = request.files.get('file')
+                if upload and upload.filename:
+                    data = upload.read().decode('utf-8', errors='replace')
+                else:
+                    data = request.form.get('data', '')
+                rows = parse_rows(data, request.form.get('format') or None)
+            
+            clients = provision_clients(rows, store, wg)
+        except ProvisioningError as e:
+            if request.is_json:
+                return jsonify({'success': False, 'errors': e.errors}), 400
+            for error in e.errors[:10]:
+                flash(error, 'error')
+            return render_template('clients/bulk.html', profiles=profiles, max_clients=MAX_BULK_CLIENTS)
+        except Exception as e:
+            if request.is_json:
+                return jsonify({'success': False, 'errors': [str(e)]}), 500
+            flash(f'Failed to add clients: {str(e)}', 'error')
+            return render_template('clients/bulk.html', profiles=profiles, max_clients=MAX_BULK_CLIENTS)
+        
+        log_action('CLIENTS_BULK_ADDED', {'count': len(clients), 'client_ids': [c['id'] for c in clients]})
+        
+        return send_file(
+            build_config_archive(clients, store, wg),
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=archive_name()
+        )
+    
+    return render_template('clients/bulk.html', profiles=profiles, max_clients=MAX_BULK_CLIENTS)
+
 @clients_bp.route('/<client_id>')
 @login_required
 def view(client_id):
@@ -180,8 +232,7 @@ def view(client_id):
     qr_code = generate_qr_code(config_content)
     
     # Get stats
-    stats = wg.get_interface_stats()
-    peer_stats = next((p for p in stats.get('peers', []) if p['public_key'] == client.get('public_key')), None)
+    peer_stats = wg.get_peer_stats().get(client.get('public_key'))
     
     if peer_stats:
         client['stats'] = {
@@ -202,6 +253,20 @@ def view(client_id):
             'endpoint': 'N/A'
         }
     
+    # Traffic in the current quota period
+    quota = effective_quota(client, profile)
+    if quota:
+        today = datetime.now().date()
+        used = period_usage(usage_history, client_id, quota, today)
+        client['quota'] = {
+            'own': bool(client.get('quota_gb')),
+            'limit': format_bytes(quota.limit),
+            'used': format_bytes(used),
+            'percent': min(round(used * 100 / quota.limit), 100),
+            'period': f'{quota.window_days} days' if quota.period == 'rolling' else 'month',
+            'since': period_start(quota, today).strftime('%Y-%m-%d')
+        }
+    
     return render_template('clients/view.html', client=client, config=config_content, qr_code=qr_code, profile=profile)
 
 @clients_bp.route('/<client_id>/download')
@@ -246,6 +311,7 @@ def delete(client_id):
     
     # Delete from storage
     store.delete_client(client_id)
+    ip_pool.release_clients([client])
     
     log_action('CLIENT_DELETED', {'client_id': client_id, 'name': client.get('name')})
     flash(f'Client "{client["name"]}" deleted successfully', 'success')
@@ -262,16 +328,21 @@ def toggle(client_id):
     
     new_state = not client.get('enabled', True)
     client['enabled'] = new_state
+    client.pop('disabled_reason', None)
+    client.pop('quota_override', None)
     
     if new_state:
+        # Keep the quota enforcer off a client enabled over its quota until the period rolls over
+        quota = effective_quota(client, store.get_profile(client.get('profile_id', '')))
+        today = datetime.now().date()
+        if quota and period_usage(usage_history, client_id, quota, today) >= quota.limit:
+            client['quota_override'] = period_key(quota, today)
+
         # Enable - add peer
         try:
-            allowed_ips = f"{client['ip_address']}/32"
-            if client.get('ipv6_address'):
-                allowed_ips += f",{client['ipv6_address']}/128"
-            
-            wg.add_peer(client['public_key'], client['preshared_key'], allowed_ips)
+            wg.add_peer(client['public_key'], client['preshared_key'], wg.client_allowed_ips(client))
             store.save_client(client)
+            notify_expiry_change([client_id])
             log_action('CLIENT_ENABLED', {'client_id': client_id, 'name': client.get('name')})
             return jsonify({'success': True, 'enabled': True})
         except Exception as e:
@@ -307,9 +378,33 @@ def extend(client_id):
     client['expiry_date'] = new_expiry.isoformat()
     
     store.save_client(client)
+    notify_expiry_change([client_id])
     log_action('CLIENT_EXTENDED', {'client_id': client_id, 'name': client.get('name'), 'days': days})
     
     return jsonify({
         'success': True,
         'expiry_date': new_expiry.strftime('%Y-%m-%d %H:%M')
     })
+
+@clients_bp.route('/<client_id>/quota', methods=['POST'])
+@login_required
+def set_quota(client_id):
+    """Set or clear the client's own traffic quota"""
+    client = store.get_client(client_id)
+    if not client:
+        return jsonify({'success': False, 'error': 'Client not found'}), 404
+    
+    try:
+        client.update(quota_fields(request.get_json(silent=True) or {}))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    store.save_client(client)
+    log_action('CLIENT_QUOTA_UPDATED', {
+        'client_id': client_id,
+        'name': client.get('name'),
+        'quota_gb': client['quota_gb'],
+        'quota_period': client['quota_period']
+    })
+    
+    return jsonify({'success': True, 'quota_gb': client['quota_gb']})
@@ -1,9 +1,10 @@
-from flask import Blueprint, render_template, jsonify
+from flask import Blueprint, Response, render_template, jsonify
 from utils.auth import login_required, log_action
 from utils.storage import DataStore
 from utils.wireguard import WireGuardManager
 from utils.helpers import format_bytes, format_timestamp
-from datetime import datetime, timedelta
+from utils.live import StreamLimitReached, get_stats_broadcaster
+from datetime import datetime
 
 dashboard_bp = Blueprint('dashboard', __name__)
 store = DataStore()
@@ -16,12 +17,10 @@ def index():
     try:
         log_action('VIEW_DASHBOARD', {})
         
-        clients = store.get_all_clients()
-        
         # Calculate statistics
-        total_clients = len(clients)
-        active_clients = len([c for c in clients if c.get('enabled', True)])
-        expired_clients = len([c for c in clients if is_expired(c)])
+        total_clients = store.count_clients()
+        active_clients = store.count_clients(enabled=True)
+        expired_clients = store.count_expired_clients()
         
         # Get WireGuard service status
         wg_service_status = {}
@@ -42,32 +41,18 @@ def index():
         total_tx = 0
         
         try:
-            stats = wg.get_interface_stats()
-            for peer in stats.get('peers', []):
-                if peer['latest_handshake'] > 0:
-                    last_handshake = datetime.now().timestamp() - peer['latest_handshake']
-                    if last_handshake < 180:  # 3 minutes
-                        connected += 1
-                
-                total_rx += peer.get('transfer_rx', 0)
-                total_tx += peer.get('transfer_tx', 0)
+            columns = wg.get_peer_columns(('latest_handshake', 'transfer_rx', 'transfer_tx'))
+            connected = count_connected(columns['latest_handshake'])
+            total_rx = sum(columns['transfer_rx'])
+            total_tx = sum(columns['transfer_tx'])
         except Exception as e:
             # WireGuard interface might not be ready yet
             print(f"Warning: Could not get WireGuard stats: {e}")
         
         # Get recent activity
-        today = datetime.now().strftime('%Y-%m-%d')
-        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-        
         recent_activity = []
         try:
-            for date in [today, yesterday]:
-                logs = store.get_audit_logs(date, date)
-                for log in logs:
-                    recent_activity.extend(log.get('entries', [])[:10])
-            
-            recent_activity.sort(key=lambda x: x['timestamp'], reverse=True)
-            recent_activity = recent_activity[:10]
+            recent_activity = store.get_recent_audit_entries(limit=10)
         except Exception as e:
             print(f"Warning: Could not get recent activity: {e}")
         
@@ -101,35 +86,26 @@ def index():
 @dashboard_bp.route('/api/stats')
 @login_required
 def api_stats():
-    """API endpoint for dashboard statistics"""
-    clients = store.get_all_clients()
-    stats = wg.get_interface_stats()
-    
-    connected = 0
-    total_rx = 0
-    total_tx = 0
-    
-    for peer in stats.get('peers', []):
-        if peer['latest_handshake'] > 0:
-            last_handshake = datetime.now().timestamp() - peer['latest_handshake']
-            if last_handshake < 180:
-                connected += 1
-        
-        total_rx += peer.get('transfer_rx', 0)
-        total_tx += peer.get('transfer_tx', 0)
-    
-    return jsonify({
-        'total_clients': len(clients),
-        'connected_clients': connected,
-        'total_rx': total_rx,
-        'total_tx': total_tx,
-        'total_data': total_rx + total_tx
-    })
+    """API endpoint for dashboard statistics, the latest live stats payload"""
+    return jsonify(get_stats_broadcaster().latest())
 
-def is_expired(client: dict) -> bool:
-    """Check if client is expired"""
-    if not client.get('expiry_date'):
-        return False
+@dashboard_bp.route('/api/stats/stream')
+@login_required
+def api_stats_stream():
+    """Live dashboard statistics as server-sent events"""
+    try:
+        events = get_stats_broadcaster().stream()
+    except StreamLimitReached:
+        # EventSource gives up on a 503 and the dashboard polls /api/stats instead
+        return Response('Too many live streams\n', status=503, headers={'Retry-After': '60'})
     
-    expiry = datetime.fromisoformat(client['expiry_date'])
-    return datetime.now() > expiry
+    response = Response(events, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def count_connected(handshakes) -> int:
+    """Count peers with a handshake in the last 3 minutes"""
+    cutoff = datetime.now().timestamp() - 180
+    return sum(1 for handshake in handshakes if handshake > cutoff)
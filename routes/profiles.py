@@ -3,6 +3,7 @@ from utils.auth import login_required, log_action
 from utils.storage import DataStore
 from utils.wireguard import WireGuardManager
 from utils.helpers import generate_qr_code, generate_qr_code_buffer
+from utils.quota import quota_fields
 from config import Config
 import uuid
 import io
@@ -20,9 +21,9 @@ def index():
     profiles = store.get_all_profiles()
     
     # Count clients per profile
-    clients = store.get_all_clients()
+    counts = store.count_clients_by_profile()
     for profile in profiles:
-        profile['client_count'] = len([c for c in clients if c.get('profile_id') == profile['id']])
+        profile['client_count'] = counts.get(profile['id'], 0)
     
     return render_template('profiles/list.html', profiles=profiles)
 
@@ -36,8 +37,7 @@ def view(profile_id):
         return redirect(url_for('profiles.index'))
     
     # Count clients using this profile
-    clients = store.get_all_clients()
-    profile['client_count'] = len([c for c in clients if c.get('profile_id') == profile_id])
+    profile['client_count'] = store.count_clients(profile_id=profile_id)
     
     log_action('VIEW_PROFILE', {'profile_id': profile_id, 'name': profile.get('name')})
     
@@ -63,6 +63,14 @@ def add():
             flash('Profile name is required', 'error')
             return render_template('profiles/add.html')
         
+        try:
+            quota = quota_fields(request.form)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return render_template('profiles/add.html',
+                                 default_allowed_ips=Config.WG_ALLOWED_IPS,
+                                 default_dns=Config.WG_DNS)
+        
         # Create profile
         profile_id = str(uuid.uuid4())
         profile = {
@@ -73,6 +81,7 @@ def add():
             'dns': dns,
             'persistent_keepalive': persistent_keepalive,
             'mtu': mtu,
+            **quota,
             'created_at': datetime.now().isoformat()
         }
         
@@ -105,6 +114,12 @@ def edit(profile_id):
             flash('Profile name is required', 'error')
             return render_template('profiles/edit.html', profile=profile)
         
+        try:
+            profile.update(quota_fields(request.form))
+        except ValueError as e:
+            flash(str(e), 'error')
+            return render_template('profiles/edit.html', profile=profile)
+        
         store.save_profile(profile)
         log_action('PROFILE_UPDATED', {'profile_id': profile_id, 'name': profile['name']})
         
@@ -123,11 +138,10 @@ def delete(profile_id):
         return redirect(url_for('profiles.index'))
     
     # Check if any clients use this profile
-    clients = store.get_all_clients()
-    using_clients = [c for c in clients if c.get('profile_id') == profile_id]
+    using_clients = store.count_clients(profile_id=profile_id)
     
     if using_clients:
-        flash(f'Cannot delete profile: {len(using_clients)} client(s) are using it', 'error')
+        flash(f'Cannot delete profile: {using_clients} client(s) are using it', 'error')
         return redirect(url_for('profiles.index'))
     
     store.delete_profile(profile_id)
@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify, current_app
 from utils.auth import login_required, log_action, hash_password
 from utils.storage import DataStore
 from utils.wireguard import WireGuardManager
+from utils.request_timing import CATEGORIES, CATEGORY_NAMES, PERCENTILES, get_request_timer
 from config import Config
 import os
 import shutil
@@ -51,6 +52,19 @@ def index():
                          backups=backups,
                          config=Config)
 
+@settings_bp.route('/performance')
+@login_required
+def performance():
+    """Response time percentiles per endpoint over the recent requests of all workers"""
+    timer = get_request_timer(current_app)
+    
+    return render_template('settings/performance.html',
+                         enabled=timer is not None,
+                         endpoints=timer.table() if timer else [],
+                         categories=[(category, CATEGORY_NAMES[category]) for category in CATEGORIES],
+                         percentiles=PERCENTILES,
+                         config=Config)
+
 @settings_bp.route('/change-password', methods=['POST'])
 @login_required
 def change_password():
@@ -77,8 +91,7 @@ def change_password():
         return redirect(url_for('settings.index'))
     
     # Update password
-    settings['admin_password_hash'] = hash_password(new_password)
-    store.save_settings(settings)
+    store.update_setting('admin_password_hash', hash_password(new_password))
     
     log_action('PASSWORD_CHANGED', {})
     flash('Password changed successfully', 'success')
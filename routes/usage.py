@@ -3,11 +3,26 @@ from utils.auth import login_required, log_action
 from utils.storage import DataStore
 from utils.wireguard import WireGuardManager
 from utils.helpers import format_bytes
+from utils.usage import UsageCollector
+from utils.usage_store import UsageStore
 from datetime import datetime, timedelta
 
 usage_bp = Blueprint('usage', __name__)
 store = DataStore()
 wg = WireGuardManager()
+collector = UsageCollector(store, wg)
+usage_history = UsageStore()
+
+# Longest windows served at hour and minute resolution
+MAX_CHART_HOURS = 24 * 31
+MAX_CHART_MINUTES = 24 * 60
+# Longest range in days, and the longest served per day and per week
+MAX_CHART_DAYS = 5 * 366
+MAX_DAILY_POINTS = 62
+MAX_WEEKLY_POINTS = 53
+# Longest per-client history in days
+MAX_CLIENT_DAYS = 366
+TOP_CLIENTS = 10
 
 @usage_bp.route('/')
 @login_required
@@ -21,8 +36,7 @@ def index():
         # Get stats with error handling
         peer_stats = {}
         try:
-            stats = wg.get_interface_stats()
-            peer_stats = {p['public_key']: p for p in stats.get('peers', [])}
+            peer_stats = wg.get_peer_stats(('transfer_rx', 'transfer_tx'))
         except Exception as e:
             print(f"Warning: Could not get WireGuard stats: {e}")
         
@@ -60,56 +74,108 @@ def index():
         # Get historical data
         historical_data = []
         try:
-            today = datetime.now()
-            dates = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(30, -1, -1)]
+            end = datetime.now().date()
+            start = end - timedelta(days=30)
+            active = usage_history.active_counts(start, end)
             
-            for date in dates:
-                snapshot = store.get_usage_snapshot(date)
-                if snapshot:
-                    historical_data.append(snapshot)
+            for (day, rx, tx), active_clients in zip(usage_history.daily_series(start, end), active):
+                # Skip the days before any usage was recorded
+                if not historical_data and not (rx or tx):
+                    continue
+                historical_data.append({
+                    'date': day.strftime('%Y-%m-%d'),
+                    'total_rx': rx,
+                    'total_tx': tx,
+                    'active_clients': active_clients
+                })
         except Exception as e:
             print(f"Warning: Could not get historical data: {e}")
         
+        top_clients = []
+        try:
+            for client_id, rx, tx in usage_history.top_clients(TOP_CLIENTS):
+                client = store.get_client(client_id) or {}
+                top_clients.append({
+                    'name': client.get('name', client_id),
+                    'ip_address': client.get('ip_address', ''),
+                    'transfer_rx_formatted': format_bytes(rx),
+                    'transfer_tx_formatted': format_bytes(tx),
+                    'transfer_total_formatted': format_bytes(rx + tx)
+                })
+        except Exception as e:
+            print(f"Warning: Could not get top clients: {e}")
+        
         return render_template('usage/index.html', 
                              client_usage=client_usage,
-                             historical_data=historical_data)
+                             historical_data=historical_data,
+                             top_clients=top_clients)
     except Exception as e:
         print(f"Error in usage page: {e}")
         import traceback
         traceback.print_exc()
         return render_template('usage/index.html', 
                              client_usage=[],
-                             historical_data=[])
+                             historical_data=[],
+                             top_clients=[])
 
 @usage_bp.route('/api/chart-data')
 @login_required
 def chart_data():
-    """Get chart data for usage over time"""
-    days = request.args.get('days', 30, type=int)
-    
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=days)
+    """Get chart data for usage over time
     
-    snapshots = store.get_usage_range(
-        start_date.strftime('%Y-%m-%d'),
-        end_date.strftime('%Y-%m-%d')
-    )
+    resolution=day (default) covers `days` days, resolution=hour the last
+    `hours` hours and resolution=minute the last `minutes` minutes of samples.
+    Day ranges come from the week or month rollups once they would need
+    more than MAX_DAILY_POINTS or MAX_WEEKLY_POINTS points, or when
+    resolution=week or month is asked for; the resolution used is returned.
+    """
+    resolution = request.args.get('resolution', 'day')
     
     # Format for chart
     labels = []
     rx_data = []
     tx_data = []
     
-    for snapshot in snapshots:
-        labels.append(snapshot.get('date', ''))
+    if resolution in ('hour', 'minute'):
+        if resolution == 'hour':
+            hours = min(max(request.args.get('hours', 48, type=int), 1), MAX_CHART_HOURS)
+            start = datetime.now() - timedelta(hours=hours - 1)
+            series = [
+                {'label': moment.strftime('%Y-%m-%d %H:00'), 'rx': rx, 'tx': tx}
+                for moment, rx, tx in usage_history.hourly_series(start, hours)
+            ]
+        else:
+            minutes = min(max(request.args.get('minutes', 120, type=int), 1), MAX_CHART_MINUTES)
+            series = collector.minute_totals(minutes)
+        
+        for point in series:
+            labels.append(point['label'])
+            rx_data.append(point['rx'] / (1024 ** 3))  # Convert to GB
+            tx_data.append(point['tx'] / (1024 ** 3))
+    else:
+        days = min(max(request.args.get('days', 30, type=int), 0), MAX_CHART_DAYS)
         
-        total_rx = snapshot.get('total_rx', 0)
-        total_tx = snapshot.get('total_tx', 0)
+        end_date = datetime.now().date()
+        start_date = end_date - timedelta(days=days)
         
-        rx_data.append(total_rx / (1024 ** 3))  # Convert to GB
-        tx_data.append(total_tx / (1024 ** 3))
+        if resolution == 'month' or days >= MAX_WEEKLY_POINTS * 7:
+            resolution = 'month'
+            series, label = usage_history.monthly_series(start_date, end_date), '%Y-%m'
+        elif resolution == 'week' or days >= MAX_DAILY_POINTS:
+            resolution = 'week'
+            series, label = usage_history.weekly_series(start_date, end_date), '%G-W%V'
+        else:
+            resolution = 'day'
+            series, label = usage_history.daily_series(start_date, end_date), '%Y-%m-%d'
+        
+        for period, total_rx, total_tx in series:
+            labels.append(period.strftime(label))
+            
+            rx_data.append(total_rx / (1024 ** 3))  # Convert to GB
+            tx_data.append(total_tx / (1024 ** 3))
     
     return jsonify({
+        'resolution': resolution,
         'labels': labels,
         'datasets': [
             {
@@ -127,4 +193,44 @@ def chart_data():
         ]
     })
 
+@usage_bp.route('/api/client/<client_id>')
+@login_required
+def client_series(client_id):
+    """Usage history of one client
+    
+    resolution=day (default) covers the last `days` days, resolution=hour
+    the last `hours` hours. Only the client's own slot is read from the
+    usage files, whatever the number of clients.
+    """
+    if not store.get_client(client_id):
+        return jsonify({'success': False, 'error': 'Client not found'}), 404
+    
+    resolution = request.args.get('resolution', 'day')
+    if resolution == 'hour':
+        hours = min(max(request.args.get('hours', 48, type=int), 1), MAX_CHART_HOURS)
+        start = datetime.now() - timedelta(hours=hours - 1)
+        series = [
+            (moment.strftime('%Y-%m-%d %H:00'), rx, tx)
+            for moment, rx, tx in usage_history.hourly_series(start, hours, client_id)
+        ]
+    else:
+        resolution = 'day'
+        days = min(max(request.args.get('days', 30, type=int), 1), MAX_CLIENT_DAYS)
+        end_date = datetime.now().date()
+        series = [
+            (day.strftime('%Y-%m-%d'), rx, tx)
+            for day, rx, tx in usage_history.daily_series(end_date - timedelta(days=days - 1), end_date, client_id)
+        ]
+    
+    return jsonify({
+        'client_id': client_id,
+        'resolution': resolution,
+        'labels': [label for label, _, _ in series],
+        'rx': [rx for _, rx, _ in series],
+        'tx': [tx for _, _, tx in series],
+        'total': [rx + tx for _, rx, tx in series],
+        'total_rx': sum(rx for _, rx, _ in series),
+        'total_tx': sum(tx for _, _, tx in series)
+    })
+
 from flask import request
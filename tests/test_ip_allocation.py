@@ -0,0 +1,52 @@
+"""Concurrent client adds from several worker processes never share an address"""
+import multiprocessing
+import os
+import unittest
+
+import support
+
+from app import app
+from utils.storage import DataStore
+
+PROCESSES = 6
+CLIENTS_PER_PROCESS = 15
+
+def add_clients(prefix: str, count: int, start):
+    """Add clients through the real view, like one gunicorn worker would"""
+    http = support.logged_in_client(app)
+    start.wait()
+    for number in range(count):
+        response = http.post('/clients/add', data={'name': f'{prefix}-{os.getpid()}-{number}', 'profile_id': 'alloc'})
+        if response.status_code != 302 or '/clients/add' in response.headers.get('Location', ''):
+            raise SystemExit(f'Add {number} failed with {response.status_code}')
+
+class ConcurrentAddTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = DataStore()
+        self.store.save_settings({**self.store.get_settings(), 'initialized': True})
+        self.store.save_profile({'id': 'alloc', 'name': 'Alloc', 'dns': '1.1.1.1', 'allowed_ips': '0.0.0.0/0'})
+
+    def test_parallel_adds_get_unique_addresses(self):
+        # Forked like prefork workers, inheriting the test environment
+        context = multiprocessing.get_context('fork')
+        start = context.Event()
+        processes = [
+            context.Process(target=add_clients, args=('alloc', CLIENTS_PER_PROCESS, start))
+            for _ in range(PROCESSES)
+        ]
+        for process in processes:
+            process.start()
+        start.set()
+        for process in processes:
+            process.join(timeout=120)
+        self.assertEqual([process.exitcode for process in processes], [0] * PROCESSES)
+
+        clients = [client for client in self.store.get_all_clients() if client['name'].startswith('alloc-')]
+        self.assertEqual(len(clients), PROCESSES * CLIENTS_PER_PROCESS)
+        for field in ('ip_address', 'ipv6_address'):
+            addresses = [client[field] for client in clients]
+            self.assertEqual(len(set(addresses)), len(addresses), f'duplicate {field}')
+
+if __name__ == '__main__':
+    unittest.main()
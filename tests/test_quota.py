@@ -0,0 +1,85 @@
+"""Tests for quota enforcement against manual enables and period rollover"""
+import unittest
+import uuid
+from datetime import date, datetime, timedelta
+
+import support
+
+from app import app
+from utils.quota import GB, QuotaEnforcer
+from utils.storage import DataStore
+from utils.usage_store import UsageStore
+
+def next_month(day: date) -> datetime:
+    return datetime.combine((day.replace(day=1) + timedelta(days=32)).replace(day=1), datetime.min.time())
+
+class QuotaEnforcerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = DataStore()
+        self.store.save_settings({**self.store.get_settings(), 'initialized': True})
+        self.store.save_profile({
+            'id': 'quota', 'name': 'Quota', 'dns': '1.1.1.1', 'allowed_ips': '0.0.0.0/0',
+            'quota_gb': 1, 'quota_period': 'monthly'
+        })
+        self.http = support.logged_in_client(app)
+        name = f'quota-{uuid.uuid4().hex[:8]}'
+        self.http.post('/clients/add', data={'name': name, 'profile_id': 'quota'})
+        self.client_id = next(c['id'] for c in self.store.get_all_clients() if c['name'] == name)
+        self.series = UsageStore(writable=True)
+        self.enforcer = QuotaEnforcer(self.store, series=self.series)
+        self.now = datetime.now().replace(microsecond=0)
+
+    def tearDown(self):
+        self.series.close()
+
+    def sample(self, moment: datetime, transferred: int) -> dict:
+        deltas = {self.client_id: (transferred, 0)}
+        self.series.record(moment, deltas)
+        self.series.flush()
+        return self.enforcer.check(deltas, moment)
+
+    def client(self) -> dict:
+        return self.store.get_client(self.client_id)
+
+    def test_disables_over_quota_and_releases_next_period(self):
+        self.assertEqual(self.sample(self.now, GB)['disabled'], 1)
+        self.assertEqual(self.client()['disabled_reason'], 'quota')
+
+        # Same period: stays disabled
+        self.assertEqual(self.enforcer.check({}, self.now)['enabled'], 0)
+        self.assertEqual(self.enforcer.check({}, next_month(self.now.date()))['enabled'], 1)
+        self.assertTrue(self.client()['enabled'])
+
+    def test_manual_enable_holds_until_period_rolls_over(self):
+        self.sample(self.now, GB)
+        response = self.http.post(f'/clients/{self.client_id}/toggle')
+        self.assertEqual(response.json, {'success': True, 'enabled': True})
+        self.assertIn('quota_override', self.client())
+
+        # More traffic in the same period leaves the admin's choice alone
+        self.assertEqual(self.sample(self.now + timedelta(seconds=1), 1000)['disabled'], 0)
+        self.assertTrue(self.client()['enabled'])
+
+        # A new period over quota is enforced again
+        self.assertEqual(self.sample(next_month(self.now.date()), 2 * GB)['disabled'], 1)
+        self.assertEqual(self.client()['disabled_reason'], 'quota')
+        self.assertNotIn('quota_override', self.client())
+
+    def test_manual_enable_under_quota_keeps_enforcement(self):
+        self.sample(self.now, GB)
+        self.http.post(f'/clients/{self.client_id}/toggle')
+        self.http.post(f'/clients/{self.client_id}/toggle')
+        self.http.post(f'/clients/{self.client_id}/quota', json={'quota_gb': 5, 'quota_period': 'monthly'})
+        self.http.post(f'/clients/{self.client_id}/toggle')
+        self.assertNotIn('quota_override', self.client())
+
+        self.assertEqual(self.sample(self.now + timedelta(seconds=1), 4 * GB)['disabled'], 1)
+
+    def test_set_quota_without_json_body(self):
+        response = self.http.post(f'/clients/{self.client_id}/quota')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.client()['quota_gb'])
+
+if __name__ == '__main__':
+    unittest.main()
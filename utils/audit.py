@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict
+from config import Config
+from utils.storage import DataStore
+
+logger = logging.getLogger(__name__)
+
+class AuditWriter:
+    """Queue audit entries in memory and write them in batches from a background thread
+
+    The thread moves entries from the queue into a pending batch under a
+    lock, so stop() can take over a batch the thread has not written yet.
+    """
+
+    def __init__(self, store: DataStore = None):
+        self.store = store or DataStore()
+        self.enabled = Config.AUDIT_ASYNC
+        self.batch_size = Config.AUDIT_BATCH_SIZE
+        self.flush_interval = Config.AUDIT_FLUSH_INTERVAL
+        self.fsync = Config.AUDIT_FSYNC.lower() == 'batch'
+        self.queue = queue.Queue(maxsize=Config.AUDIT_QUEUE_SIZE)
+
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._write_lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._counters = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'overflow': 0,
+            'errors': 0,
+            'last_batch_size': 0,
+            'last_flush_seconds': 0.0
+        }
+
+    def _ensure_started(self):
+        """Start the flush thread, also after a fork into a new worker"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counters_lock:
+            self._counters[name] += amount
+
+    def write(self, action: str, user: str, details: Dict = None):
+        """Record an audit entry without blocking on disk I/O"""
+        entry = self.store.build_audit_entry(action, user, details)
+        if not self.enabled:
+            self._write_batch([entry])
+            return
+
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(entry)
+            self._count('enqueued')
+        except queue.Full:
+            # Never drop audit entries, fall back to a synchronous write
+            self._count('overflow')
+            self._write_batch([entry])
+
+    def _take(self, timeout: float) -> bool:
+        """Move one queued entry to the pending batch, False if none came in time"""
+        with self._pending_lock:
+            try:
+                self._pending.append(self.queue.get(timeout=timeout))
+                return True
+            except queue.Empty:
+                return False
+
+    def _write_pending(self):
+        with self._pending_lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._write_batch(batch)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self._take(self.flush_interval):
+                continue
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._pending) < self.batch_size and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._take(remaining):
+                    break
+
+            self._write_pending()
+
+    def _drain(self) -> list:
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write_batch(self, entries: list):
+        """Append entries grouped by day, one write per day file"""
+        by_date = {}
+        for entry in entries:
+            line = json.dumps(entry, default=str) + '\n'
+            by_date.setdefault(entry['timestamp'][:10], []).append(line)
+
+        started = time.monotonic()
+        with self._write_lock:
+            for date, lines in by_date.items():
+                try:
+                    self.store.append_audit_lines(date, lines, fsync=self.fsync)
+                    self._count('written', len(lines))
+                except Exception as e:
+                    self._count('errors')
+                    logger.error(f"Failed to write {len(lines)} audit entries: {e}")
+
+        with self._counters_lock:
+            self._counters['batches'] += 1
+            self._counters['last_batch_size'] = len(entries)
+            self._counters['last_flush_seconds'] = round(time.monotonic() - started, 6)
+
+    def flush(self):
+        """Write everything queued so far"""
+        batch = self._drain()
+        if batch:
+            self._write_batch(batch)
+
+    def stop(self):
+        """Stop the flush thread and write remaining entries"""
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 1)
+            if self._thread.is_alive():
+                logger.warning("Audit writer did not stop in time, writing its entries here")
+        # A batch the thread collected but did not get to write
+        self._write_pending()
+        self.flush()
+
+    def metrics(self) -> Dict:
+        """Queue depth and write counters"""
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return {
+            'async': self.enabled,
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            **counters
+        }
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_audit_writer() -> AuditWriter:
+    """Get the process-wide audit writer"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = AuditWriter()
+        return _writer
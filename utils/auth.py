@@ -7,7 +7,7 @@ from functools import wraps
 from flask import session, redirect, url_for, request, abort
 from datetime import datetime
 from config import Config
-from utils.storage import DataStore
+from utils.audit import get_audit_writer
 
 def generate_2fa_secret() -> str:
     """Generate a new 2FA secret"""
@@ -85,6 +85,5 @@ def ip_whitelist_required(f):
 
 def log_action(action: str, details: dict = None):
     """Log action to audit trail"""
-    store = DataStore()
     user = session.get('username', 'unknown')
-    store.log_audit(action, user, details)
+    get_audit_writer().write(action, user, details)
@@ -0,0 +1,245 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from utils.locking import file_lock
+
+def write_json_atomic(filepath: str, data: dict):
+    """Write JSON through a temp file and rename so readers never see partial files"""
+    directory = os.path.dirname(filepath)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2, default=str)
+        os.replace(tmp_path, filepath)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class JSONDirectoryCache:
+    """Read-through cache of parsed JSON records stored one per file in a directory
+
+    Entries are validated against the file's inode, mtime and size. Writes
+    go through write_json_atomic, so every change from any process replaces
+    the file and bumps the directory mtime; an unchanged directory means
+    every cached entry is still current and no file needs to be opened.
+    """
+
+    # Directory mtimes this close to the last scan may hide a concurrent write
+    RACY_WINDOW = 2.0
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.version = 0
+        self._entries = {}  # filename -> (stat key, record)
+        self._dir_key = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def _stat_key(self, st: os.stat_result) -> tuple:
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load(self, filename: str, st: os.stat_result) -> Optional[Dict]:
+        """Parse a file and cache it, returns None if it vanished"""
+        try:
+            with open(os.path.join(self.directory, filename), 'r') as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        self._entries[filename] = (self._stat_key(st), record)
+        self.misses += 1
+        self.version += 1
+        return record
+
+    def get(self, filename: str) -> Optional[Dict]:
+        """Get a copy of one record, or None if the file does not exist"""
+        with self._lock:
+            try:
+                st = os.stat(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                if self._entries.pop(filename, None) is not None:
+                    self.version += 1
+                return None
+
+            cached = self._entries.get(filename)
+            if cached and cached[0] == self._stat_key(st):
+                self.hits += 1
+                record = cached[1]
+            else:
+                record = self._load(filename, st)
+            return dict(record) if record is not None else None
+
+    def list(self) -> List[Dict]:
+        """Get copies of all records in the directory"""
+        with self._lock:
+            try:
+                st = os.stat(self.directory)
+            except FileNotFoundError:
+                self._entries.clear()
+                return []
+
+            dir_key = (st.st_ino, st.st_mtime_ns)
+            if dir_key != self._dir_key or self._scanned_at - st.st_mtime < self.RACY_WINDOW:
+                self._rescan()
+                self._dir_key = dir_key
+            else:
+                self.hits += len(self._entries)
+
+            return [dict(record) for _, record in self._entries.values()]
+
+    def _rescan(self):
+        """Stat every file, re-parsing only those that changed"""
+        self._scanned_at = time.time()
+        seen = set()
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.json') or entry.name.startswith('.'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                seen.add(entry.name)
+                cached = self._entries.get(entry.name)
+                if cached and cached[0] == self._stat_key(st):
+                    self.hits += 1
+                elif self._load(entry.name, st) is None:
+                    seen.discard(entry.name)
+
+        for filename in [f for f in self._entries if f not in seen]:
+            del self._entries[filename]
+            self.version += 1
+
+    def put(self, filename: str, record: Dict):
+        """Write a record and update the cache in place"""
+        filepath = os.path.join(self.directory, filename)
+        write_json_atomic(filepath, record)
+        with self._lock:
+            self._entries[filename] = (self._stat_key(os.stat(filepath)), dict(record))
+            self.version += 1
+
+    def remove(self, filename: str):
+        """Delete a record and drop it from the cache"""
+        filepath = os.path.join(self.directory, filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        with self._lock:
+            if self._entries.pop(filename, None) is not None:
+                self.version += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries)
+        }
+
+class SharedFileCache:
+    """Short-lived JSON values shared between worker processes through files
+
+    The first process to find a value stale computes it while holding a
+    per-key lock; concurrent callers wait on the lock and then reuse the
+    freshly written value instead of computing it again. The in-process
+    memo and the counters are shared by the worker's threads.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memo = {}  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _read_fresh(self, key: str, ttl: float):
+        """Return (value, age) if the shared file is younger than ttl, else None"""
+        try:
+            with open(self._path(key), 'r') as f:
+                data = json.load(f)
+            age = time.time() - data['created']
+            return (data['value'], age) if 0 <= age < ttl else None
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def get_or_compute(self, key: str, ttl: float, compute: Callable[[], Any]) -> Any:
+        """Get a cached value or compute it once for all workers"""
+        if ttl <= 0:
+            return compute()
+
+        with self._lock:
+            memo = self._memo.get(key)
+            if memo and memo[0] > time.monotonic():
+                self.hits += 1
+                return memo[1]
+
+        cached = self._read_fresh(key, ttl)
+        if cached is None:
+            with file_lock(self._path(key) + '.lock'):
+                # Another worker may have refreshed it while we waited
+                cached = self._read_fresh(key, ttl)
+                if cached is None:
+                    self._count(hit=False)
+                    cached = (compute(), 0.0)
+                    write_json_atomic(self._path(key), {'value': cached[0], 'created': time.time()})
+                else:
+                    self._count(hit=True)
+        else:
+            self._count(hit=True)
+
+        value, age = cached
+        with self._lock:
+            self._memo[key] = (time.monotonic() + ttl - age, value)
+        return value
+
+    def invalidate(self, key: str):
+        """Drop a value so the next reader recomputes it"""
+        with self._lock:
+            self._memo.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache() -> SharedFileCache:
+    """Get the process-wide cache in Config.CACHE_DIR"""
+    global _shared_cache
+    from config import Config
+    with _shared_cache_lock:
+        if _shared_cache is None or _shared_cache.directory != Config.CACHE_DIR:
+            _shared_cache = SharedFileCache(Config.CACHE_DIR)
+        return _shared_cache
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_directory_cache(directory: str) -> JSONDirectoryCache:
+    """Get the process-wide cache for a directory"""
+    directory = os.path.abspath(directory)
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = JSONDirectoryCache(directory)
+        return _caches[directory]
@@ -0,0 +1,223 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+from config import Config
+from utils.cache import get_directory_cache, write_json_atomic
+
+class JSONClientStore:
+    """Client storage backend using one JSON file per client"""
+
+    def __init__(self, clients_dir: str, cached: bool = True):
+        self.clients_dir = clients_dir
+        self.cache = get_directory_cache(clients_dir) if cached else None
+        self._sorted = (None, [])
+
+    def _path(self, client_id: str) -> str:
+        return os.path.join(self.clients_dir, f'{client_id}.json')
+
+    def _read(self, filepath: str) -> dict:
+        with open(filepath, 'r') as f:
+            return json.load(f)
+
+    def get(self, client_id: str) -> Optional[Dict]:
+        """Get client by ID"""
+        if self.cache:
+            return self.cache.get(f'{client_id}.json')
+        filepath = self._path(client_id)
+        return self._read(filepath) if os.path.exists(filepath) else None
+
+    def get_by_public_key(self, public_key: str) -> Optional[Dict]:
+        """Get client by WireGuard public key"""
+        return next((c for c in self.list() if c.get('public_key') == public_key), None)
+
+    def list(self) -> List[Dict]:
+        """Get all clients, newest first"""
+        if self.cache:
+            records = self.cache.list()
+            # Reuse the previous ordering while nothing has changed
+            version, order = self._sorted
+            if version != self.cache.version:
+                records.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+                self._sorted = (self.cache.version, [c['id'] for c in records])
+                return records
+            by_id = {c['id']: c for c in records}
+            return [by_id[client_id] for client_id in order if client_id in by_id]
+
+        clients = []
+        if not os.path.exists(self.clients_dir):
+            return clients
+
+        for filename in os.listdir(self.clients_dir):
+            if filename.endswith('.json'):
+                clients.append(self._read(os.path.join(self.clients_dir, filename)))
+
+        return sorted(clients, key=lambda x: x.get('created_at', ''), reverse=True)
+
+    def save(self, client: Dict):
+        """Save client data"""
+        if self.cache:
+            self.cache.put(f"{client['id']}.json", client)
+        else:
+            write_json_atomic(self._path(client['id']), client)
+
+    def save_many(self, clients: List[Dict]):
+        """Save several clients"""
+        for client in clients:
+            self.save(client)
+
+    def delete(self, client_id: str):
+        """Delete client"""
+        if self.cache:
+            self.cache.remove(f'{client_id}.json')
+            return
+        filepath = self._path(client_id)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+    def count(self, profile_id: str = None, enabled: bool = None) -> int:
+        """Count clients, optionally filtered by profile and state"""
+        clients = self.list()
+        if profile_id is not None:
+            clients = [c for c in clients if c.get('profile_id') == profile_id]
+        if enabled is not None:
+            clients = [c for c in clients if c.get('enabled', True) == enabled]
+        return len(clients)
+
+    def count_by_profile(self) -> Dict[str, int]:
+        """Count clients per profile ID"""
+        counts = {}
+        for client in self.list():
+            profile_id = client.get('profile_id')
+            counts[profile_id] = counts.get(profile_id, 0) + 1
+        return counts
+
+    def count_expired(self, now: str) -> int:
+        """Count clients whose expiry date is before the given ISO timestamp"""
+        return len([c for c in self.list() if c.get('expiry_date') and c['expiry_date'] < now])
+
+class SQLiteClientStore:
+    """Client storage backend using an indexed SQLite database"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS clients (
+            id TEXT PRIMARY KEY,
+            public_key TEXT,
+            profile_id TEXT,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            expiry_date TEXT,
+            created_at TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_clients_public_key ON clients(public_key);
+        CREATE INDEX IF NOT EXISTS idx_clients_profile_id ON clients(profile_id);
+        CREATE INDEX IF NOT EXISTS idx_clients_enabled ON clients(enabled);
+        CREATE INDEX IF NOT EXISTS idx_clients_expiry_date ON clients(expiry_date);
+        CREATE INDEX IF NOT EXISTS idx_clients_created_at ON clients(created_at);
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get a connection for the current thread and process"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _row(self, client: Dict) -> tuple:
+        return (
+            client['id'],
+            client.get('public_key'),
+            client.get('profile_id'),
+            1 if client.get('enabled', True) else 0,
+            client.get('expiry_date'),
+            client.get('created_at'),
+            json.dumps(client, default=str)
+        )
+
+    def get(self, client_id: str) -> Optional[Dict]:
+        """Get client by ID"""
+        row = self._conn().execute('SELECT data FROM clients WHERE id = ?', (client_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_public_key(self, public_key: str) -> Optional[Dict]:
+        """Get client by WireGuard public key"""
+        row = self._conn().execute('SELECT data FROM clients WHERE public_key = ?', (public_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list(self) -> List[Dict]:
+        """Get all clients, newest first"""
+        rows = self._conn().execute('SELECT data FROM clients ORDER BY created_at DESC')
+        return [json.loads(row[0]) for row in rows]
+
+    def save(self, client: Dict):
+        """Save client data"""
+        self.save_many([client])
+
+    def save_many(self, clients: List[Dict]):
+        """Save several clients in a single transaction"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO clients '
+                '(id, public_key, profile_id, enabled, expiry_date, created_at, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [self._row(c) for c in clients]
+            )
+
+    def delete(self, client_id: str):
+        """Delete client"""
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM clients WHERE id = ?', (client_id,))
+
+    def count(self, profile_id: str = None, enabled: bool = None) -> int:
+        """Count clients, optionally filtered by profile and state"""
+        query = 'SELECT COUNT(*) FROM clients WHERE 1 = 1'
+        params = []
+        if profile_id is not None:
+            query += ' AND profile_id = ?'
+            params.append(profile_id)
+        if enabled is not None:
+            query += ' AND enabled = ?'
+            params.append(1 if enabled else 0)
+        return self._conn().execute(query, params).fetchone()[0]
+
+    def count_by_profile(self) -> Dict[str, int]:
+        """Count clients per profile ID"""
+        rows = self._conn().execute('SELECT profile_id, COUNT(*) FROM clients GROUP BY profile_id')
+        return {profile_id: count for profile_id, count in rows}
+
+    def count_expired(self, now: str) -> int:
+        """Count clients whose expiry date is before the given ISO timestamp"""
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM clients WHERE expiry_date IS NOT NULL AND expiry_date < ?', (now,)
+        ).fetchone()[0]
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_client_store(clients_dir: str):
+    """Get the configured client storage backend (shared per process)"""
+    backend = Config.STORAGE_BACKEND.lower()
+    key = (backend, clients_dir, Config.SQLITE_PATH, Config.STORAGE_CACHE_ENABLED)
+
+    with _stores_lock:
+        if key not in _stores:
+            if backend == 'sqlite':
+                _stores[key] = SQLiteClientStore(Config.SQLITE_PATH)
+            elif backend == 'json':
+                _stores[key] = JSONClientStore(clients_dir, cached=Config.STORAGE_CACHE_ENABLED)
+            else:
+                raise Exception(f"Unknown storage backend: {Config.STORAGE_BACKEND}")
+        return _stores[key]
@@ -0,0 +1,235 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+from config import Config
+from utils.metrics import timed
+from utils.storage import DataStore
+
+logger = logging.getLogger(__name__)
+
+# How often the scheduler looks for change notices between expiries
+JOURNAL_POLL_INTERVAL = 5.0
+# Compact the journal once it grows past this many bytes
+JOURNAL_MAX_SIZE = 1024 * 1024
+# Delay before the first retry of a client whose disabling failed, doubled
+# on every further failure up to MAX_RETRY_DELAY
+RETRY_DELAY = 60.0
+MAX_RETRY_DELAY = 3600.0
+# Failed attempts after which a client is reported as stuck, and again every
+# this many attempts after that
+RETRY_REPORT_AFTER = 5
+
+def _journal_path() -> str:
+    return os.path.join(Config.CACHE_DIR, 'expiry-journal.jsonl')
+
+def notify_expiry_change(client_ids: Iterable[str]):
+    """Tell the expiry scheduler that clients' expiry or enabled state changed
+
+    Any worker may call this after saving the clients; the process running
+    the scheduler picks the notices up from an append-only journal.
+    """
+    lines = ''.join(json.dumps({'id': client_id}) + '\n' for client_id in client_ids)
+    if not lines:
+        return
+    try:
+        fd = os.open(_journal_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, lines.encode())
+        finally:
+            os.close(fd)
+    except OSError as e:
+        # The daily reconcile still catches the change
+        logger.warning(f"Could not write expiry notice: {e}")
+
+def expiry_timestamp(client: Dict) -> Optional[float]:
+    """Expiry of an enabled client as a Unix timestamp, None if it never expires"""
+    if not client.get('enabled', True) or not client.get('expiry_date'):
+        return None
+    try:
+        return datetime.fromisoformat(client['expiry_date']).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+class ExpiryScheduler:
+    """Disable clients exactly when they expire
+
+    Upcoming expiries sit in a min-heap of (timestamp, client id). The
+    thread sleeps until the earliest one, or until the next journal poll,
+    then hands every client that is due to on_due in one call, which returns
+    the ids of the clients it could not disable. Heap entries
+    are never updated in place: a changed client gets a new entry and the
+    old one is dropped when popped because the record is no longer due.
+    A client backing off after failed attempts is never queued before its
+    next attempt, however often it changes meanwhile.
+    """
+
+    def __init__(self, on_due: Callable[[List[Dict]], List[str]], store: DataStore = None):
+        self.on_due = on_due
+        self.store = store or DataStore()
+        self.journal_path = _journal_path()
+        self._heap = []
+        self._retries = {}  # client id -> (failed disabling attempts in a row, next attempt at)
+        self._journal_offset = 0
+        self._thread = None
+        self._stopping = threading.Event()
+        # The heap is read by stats() from request threads
+        self._lock = threading.Lock()
+
+    def _due_at(self, client: Dict) -> Optional[float]:
+        """When a client should be handed to on_due, honouring its retry backoff"""
+        timestamp = expiry_timestamp(client)
+        if timestamp is not None and client['id'] in self._retries:
+            timestamp = max(timestamp, self._retries[client['id']][1])
+        return timestamp
+
+    def _push(self, client: Dict):
+        timestamp = self._due_at(client)
+        if timestamp is not None:
+            heapq.heappush(self._heap, (timestamp, client['id']))
+
+    def rebuild(self):
+        """Reload every upcoming expiry, resetting the journal first
+
+        Notices appended after the truncation are read on the next poll;
+        everything before it is already reflected in the client records.
+        """
+        try:
+            with open(self.journal_path, 'w'):
+                pass
+        except OSError as e:
+            logger.warning(f"Could not reset expiry journal: {e}")
+        self._journal_offset = 0
+
+        heap = [
+            (timestamp, client['id'])
+            for client in self.store.get_all_clients()
+            for timestamp in [self._due_at(client)] if timestamp is not None
+        ]
+        heapq.heapify(heap)
+        with self._lock:
+            self._heap = heap
+
+    def _poll_journal(self):
+        """Queue clients named in new journal lines"""
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return
+        if size < self._journal_offset:
+            # Truncated by another scheduler instance
+            self._journal_offset = 0
+        if size == self._journal_offset:
+            return
+        if size > JOURNAL_MAX_SIZE:
+            self.rebuild()
+            return
+
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_offset)
+            data = f.read(size - self._journal_offset)
+        # Leave a partially written last line for the next poll
+        complete = data.rfind(b'\n') + 1
+        self._journal_offset += complete
+
+        client_ids = set()
+        for line in data[:complete].splitlines():
+            try:
+                client_ids.add(json.loads(line)['id'])
+            except (ValueError, KeyError, TypeError):
+                continue
+        for client_id in client_ids:
+            client = self.store.get_client(client_id)
+            if client:
+                with self._lock:
+                    self._push(client)
+
+    def _pop_due(self, now: float) -> List[Dict]:
+        """Clients whose current expiry has passed"""
+        due = {}
+        while True:
+            with self._lock:
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                timestamp, client_id = heapq.heappop(self._heap)
+            client = self.store.get_client(client_id)
+            # Stale entry: deleted, disabled or extended since it was queued
+            current = expiry_timestamp(client) if client else None
+            if current is None or current > now:
+                self._retries.pop(client_id, None)
+                continue
+            # Queued again by a change notice while backing off
+            if client_id in self._retries and self._retries[client_id][1] > now:
+                continue
+            due[client_id] = client
+        return list(due.values())
+
+    def next_expiry(self) -> Optional[float]:
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def run_once(self, now: float = None):
+        """Poll the journal and disable every client that is due"""
+        now = time.time() if now is None else now
+        self._poll_journal()
+        due = self._pop_due(now)
+        if not due:
+            return
+        with timed('wgm_job_duration_seconds', job='disable_expired_clients'):
+            failed = set(self.on_due(due))
+        for client in due:
+            if client['id'] not in failed:
+                self._retries.pop(client['id'], None)
+        for client_id in failed:
+            self._retry(client_id, now)
+
+    def _retry(self, client_id: str, now: float):
+        """Queue a client again after a failed attempt, backing off exponentially"""
+        attempts = self._retries.get(client_id, (0, 0.0))[0] + 1
+        delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        self._retries[client_id] = (attempts, now + delay)
+        if attempts % RETRY_REPORT_AFTER == 0:
+            logger.error(f"Could not disable expired client {client_id} after {attempts} attempts, retrying in {delay:.0f}s")
+        with self._lock:
+            heapq.heappush(self._heap, (now + delay, client_id))
+
+    def _run(self):
+        self.rebuild()
+        while not self._stopping.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Expiry scheduler error: {e}")
+
+            wait = JOURNAL_POLL_INTERVAL
+            next_expiry = self.next_expiry()
+            if next_expiry is not None:
+                wait = min(wait, max(next_expiry - time.time(), 0))
+            self._stopping.wait(wait)
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            queued = len(self._heap)
+            next_expiry = self._heap[0][0] if self._heap else None
+        return {
+            'queued': queued,
+            'retrying': len(self._retries),
+            'next_expiry': datetime.fromtimestamp(next_expiry).isoformat() if next_expiry else None
+        }
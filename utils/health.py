@@ -0,0 +1,115 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict
+from config import Config
+from utils.storage import DataStore
+from utils.wireguard import WireGuardManager
+
+logger = logging.getLogger(__name__)
+
+class HealthProbe:
+    """Readiness checks run by a background thread, served from memory
+
+    The thread checks the WireGuard service and the data directory every
+    HEALTH_PROBE_INTERVAL seconds. The service status goes through the
+    shared status cache, so all workers together run the systemctl and wg
+    commands once per WG_STATUS_CACHE_TTL. Requests only read the last
+    report and never run a check themselves. A report older than
+    HEALTH_STALE_AFTER seconds, for example because a check hangs, counts
+    as not ready.
+    """
+
+    def __init__(self, store: DataStore = None, wg: WireGuardManager = None,
+                 interval: float = None, stale_after: float = None):
+        self.store = store or DataStore()
+        self.wg = wg or WireGuardManager()
+        self.interval = Config.HEALTH_PROBE_INTERVAL if interval is None else interval
+        self.stale_after = Config.HEALTH_STALE_AFTER if stale_after is None else stale_after
+        self.probes = 0
+        self._report = None
+        self._checked_at = 0.0
+        self._thread = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _check_storage(self) -> bool:
+        try:
+            self.store.get_settings()
+            return os.access(self.store.data_dir, os.W_OK)
+        except Exception as e:
+            logger.warning(f"Storage check failed: {e}")
+            return False
+
+    def check(self) -> Dict:
+        """Run every check once and keep the result as the current report"""
+        try:
+            wg_status = self.wg.get_service_status()
+        except Exception as e:
+            wg_status = {'status': 'error', 'error': str(e)}
+        storage_ok = self._check_storage()
+
+        report = {
+            'status': 'healthy' if wg_status.get('status') == 'healthy' and storage_ok else 'unhealthy',
+            'wireguard': wg_status,
+            'storage': 'ok' if storage_ok else 'error'
+        }
+        with self._lock:
+            self._report = report
+            self._checked_at = time.time()
+            self.probes += 1
+        return report
+
+    def _run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"Health probe failed: {e}")
+            time.sleep(self.interval)
+
+    def start(self):
+        """Start the probe thread of this process unless it runs already"""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Threads don't survive a fork into a new worker
+                self._pid = os.getpid()
+                self._thread = None
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='health-probe', daemon=True)
+                self._thread.start()
+
+    def report(self) -> Dict:
+        """The last report with its age; 'ready' is False when it is missing or stale"""
+        self.start()
+        with self._lock:
+            report, checked_at = self._report, self._checked_at
+
+        if report is None:
+            return {'status': 'starting', 'ready': False, 'stale': False, 'checked_at': None, 'age': None}
+
+        age = time.time() - checked_at
+        stale = age > self.stale_after
+        return {
+            **report,
+            'ready': report['status'] == 'healthy' and not stale,
+            'stale': stale,
+            'checked_at': datetime.fromtimestamp(checked_at).isoformat(),
+            'age': round(age, 3)
+        }
+
+    def stats(self) -> Dict:
+        return {'probes': self.probes, 'running': self._thread is not None}
+
+_probe = None
+_probe_lock = threading.Lock()
+
+def get_health_probe() -> HealthProbe:
+    """Get the process-wide health probe"""
+    global _probe
+    with _probe_lock:
+        if _probe is None:
+            _probe = HealthProbe()
+        return _probe
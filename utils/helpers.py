@@ -1,7 +1,9 @@
 import qrcode
 from io import BytesIO
 import base64
+from utils.metrics import timed
 
+@timed('wgm_qr_duration_seconds', output='data_uri')
 def generate_qr_code(data: str) -> str:
     """Generate QR code from data and return as base64 image"""
     qr = qrcode.QRCode(
@@ -22,6 +24,7 @@ def generate_qr_code(data: str) -> str:
     img_str = base64.b64encode(buffer.getvalue()).decode()
     return f"data:image/png;base64,{img_str}"
 
+@timed('wgm_qr_duration_seconds', output='png')
 def generate_qr_code_buffer(data: str) -> BytesIO:
     """Generate QR code from data and return as BytesIO buffer for file download"""
     qr = qrcode.QRCode(
@@ -0,0 +1,167 @@
+import ipaddress
+import json
+import os
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import Config
+from utils.cache import write_json_atomic
+from utils.locking import file_lock
+
+class AddressPoolExhausted(Exception):
+    """No free client address left in the subnet"""
+
+class AddressPool:
+    """Client address allocator over WG_SUBNET and WG_IPV6_SUBNET
+
+    A client gets one slot index N and uses network + N in both subnets,
+    as clients always have. Free slots are kept as a sorted list of
+    disjoint [first, last] intervals, so allocating the lowest free slot is
+    O(1), freeing one is a binary search plus merge, and a pool with few
+    holes stays a handful of pairs whatever the subnet size. Slot 0 is the
+    network address, slot 1 the server and the IPv4 broadcast address is
+    never handed out.
+
+    The free list is persisted to DATA_DIR/ipam.json and rebuilt from the
+    client records when that file is missing or the subnets changed. Every
+    change happens under an flock on ipam.json.lock, so concurrent workers
+    can never hand out the same slot.
+    """
+
+    FIRST_SLOT = 2
+
+    def __init__(self, store=None, path: str = None):
+        if store is None:
+            from utils.storage import DataStore
+            store = DataStore()
+        self.store = store
+        self.path = path or os.path.join(Config.DATA_DIR, 'ipam.json')
+        self.network = ipaddress.ip_network(Config.WG_SUBNET)
+        self.network6 = None
+        if Config.WG_IPV6_ENABLED and Config.WG_IPV6_SUBNET:
+            self.network6 = ipaddress.ip_network(Config.WG_IPV6_SUBNET)
+
+    def _last_slot(self) -> int:
+        last = self.network.num_addresses - 2
+        if self.network6 is not None:
+            last = min(last, self.network6.num_addresses - 1)
+        return last
+
+    def _subnets(self) -> Dict:
+        return {
+            'subnet': str(self.network),
+            'subnet6': str(self.network6) if self.network6 is not None else ''
+        }
+
+    def slot_of(self, ip_address: str) -> Optional[int]:
+        """Slot index of a client IPv4 address, None if it is outside the pool"""
+        try:
+            slot = int(ipaddress.ip_address(ip_address)) - int(self.network.network_address)
+        except ValueError:
+            return None
+        return slot if self.FIRST_SLOT <= slot <= self._last_slot() else None
+
+    def addresses(self, slot: int) -> Tuple[str, str]:
+        """(IPv4, IPv6) addresses of a slot, IPv6 is empty when disabled"""
+        ipv4 = str(self.network.network_address + slot)
+        ipv6 = str(self.network6.network_address + slot) if self.network6 is not None else ''
+        return ipv4, ipv6
+
+    def _build(self, used: Iterable[int]) -> List[List[int]]:
+        """Free intervals between the used slots"""
+        free = []
+        start = self.FIRST_SLOT
+        for slot in sorted(set(used)):
+            if slot > start:
+                free.append([start, slot - 1])
+            start = slot + 1
+        if start <= self._last_slot():
+            free.append([start, self._last_slot()])
+        return free
+
+    def _lock(self):
+        """Exclusive lock making each read-modify-write of the pool atomic across processes"""
+        return file_lock(self.path + '.lock')
+
+    def rebuild(self) -> List[List[int]]:
+        """Recompute the free list from the client records and persist it"""
+        with self._lock():
+            return self._rebuild()
+
+    def _rebuild(self) -> List[List[int]]:
+        used = (self.slot_of(client.get('ip_address', '')) for client in self.store.get_all_clients())
+        free = self._build(slot for slot in used if slot is not None)
+        self._save(free)
+        return free
+
+    def _load(self) -> List[List[int]]:
+        """Current free list, callers must hold the lock"""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if {key: data.get(key) for key in ('subnet', 'subnet6')} == self._subnets():
+                return data['free']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return self._rebuild()
+
+    def _save(self, free: List[List[int]]):
+        write_json_atomic(self.path, {**self._subnets(), 'free': free})
+
+    def allocate(self, count: int = 1) -> List[int]:
+        """Take the lowest free slots"""
+        with self._lock():
+            return self._allocate(count)
+
+    def _allocate(self, count: int) -> List[int]:
+        free = self._load()
+        slots = []
+        while len(slots) < count:
+            if not free:
+                raise AddressPoolExhausted(f"No free addresses left in {self.network}")
+            first, last = free[0]
+            take = min(count - len(slots), last - first + 1)
+            slots.extend(range(first, first + take))
+            if first + take > last:
+                free.pop(0)
+            else:
+                free[0][0] = first + take
+        self._save(free)
+        return slots
+
+    def release(self, slots: Iterable[int]):
+        """Return slots to the pool"""
+        slots = list(slots)
+        with self._lock():
+            self._release(slots)
+
+    def _release(self, slots: List[int]):
+        free = self._load()
+        for slot in slots:
+            if slot is None or not self.FIRST_SLOT <= slot <= self._last_slot():
+                continue
+            i = bisect_right(free, [slot, float('inf')])
+            if i and free[i - 1][1] >= slot:
+                continue  # already free
+            merge_left = i > 0 and free[i - 1][1] == slot - 1
+            merge_right = i < len(free) and free[i][0] == slot + 1
+            if merge_left and merge_right:
+                free[i - 1][1] = free.pop(i)[1]
+            elif merge_left:
+                free[i - 1][1] = slot
+            elif merge_right:
+                free[i][0] = slot
+            else:
+                free.insert(i, [slot, slot])
+        self._save(free)
+
+    def release_clients(self, clients: Iterable[Dict]):
+        """Return the addresses of deleted clients to the pool"""
+        self.release(self.slot_of(client.get('ip_address', '')) for client in clients)
+
+    def stats(self) -> Dict:
+        """Pool size and free slot count"""
+        with self._lock():
+            free = self._load()
+        size = max(self._last_slot() - self.FIRST_SLOT + 1, 0)
+        available = sum(last - first + 1 for first, last in free)
+        return {'size': size, 'free': available, 'used': size - available, 'intervals': len(free)}
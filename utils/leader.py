@@ -0,0 +1,58 @@
+import fcntl
+import json
+import os
+import time
+from typing import Dict, Optional
+
+class LeaderLock:
+    """Non-blocking flock electing one process out of several
+
+    The kernel releases the lock when its holder exits or crashes, so any
+    process that retries acquire() takes over without a separate heartbeat.
+    The holder writes its pid into the file for diagnostics.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """Try to become leader, returns True if this process holds the lock"""
+        if self._fd is not None:
+            return True
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps({'pid': os.getpid(), 'since': time.time()}).encode(), 0)
+        self._fd = fd
+        return True
+
+    def release(self):
+        """Give up leadership"""
+        if self._fd is None:
+            return
+        try:
+            os.ftruncate(self._fd, 0)
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def holder(self) -> Optional[Dict]:
+        """pid and start time of the current leader, if any"""
+        try:
+            with open(self.path, 'r') as f:
+                return json.loads(f.read() or 'null')
+        except (FileNotFoundError, ValueError):
+            return None
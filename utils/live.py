@@ -0,0 +1,208 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+from config import Config
+from utils.storage import DataStore
+from utils.wireguard import WireGuardManager
+
+logger = logging.getLogger(__name__)
+
+# Peers with a handshake this recent count as connected
+CONNECTED_WINDOW = 180
+# Seconds between comments that keep an idle stream and its proxies open
+KEEPALIVE_INTERVAL = 15
+
+class StreamLimitReached(Exception):
+    """The worker already serves its maximum number of live streams"""
+
+class Subscription:
+    """Events of one stream, unsubscribing when closed or exhausted
+
+    The WSGI server calls close() when the client goes away, even if the
+    first event was never sent.
+    """
+
+    def __init__(self, broadcaster: 'StatsBroadcaster', events: Iterator[str]):
+        self._broadcaster = broadcaster
+        self._events = events
+        self._closed = False
+
+    def __iter__(self) -> 'Subscription':
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._events)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._events.close()
+            self._broadcaster._unsubscribe()
+
+class StatsBroadcaster:
+    """Live dashboard stats computed once per tick for every open dashboard
+
+    A thread reads the peer counters once per interval (through the shared
+    dump cache, so all workers together run one `wg show dump` per
+    WG_STATS_CACHE_TTL), serializes one payload and wakes every stream
+    waiting on it. The work per tick is the same for 1 or 100 subscribers.
+    The thread only runs while somebody is subscribed.
+
+    Every open stream holds a worker thread, so a worker serves at most
+    LIVE_STATS_MAX_STREAMS of them and refuses the rest. Refused dashboards
+    fall back to polling.
+
+    Throughput is the change of the rx/tx totals since the previous tick,
+    so it only covers peers that stayed up in between; totals that went
+    down because peers were removed count as zero.
+    """
+
+    def __init__(self, store: DataStore = None, wg: WireGuardManager = None, interval: float = None):
+        self.store = store or DataStore()
+        self.wg = wg or WireGuardManager()
+        self.interval = Config.LIVE_STATS_INTERVAL if interval is None else interval
+        self.max_streams = Config.LIVE_STATS_MAX_STREAMS
+        self.subscribers = 0
+        self.ticks = 0
+        self.refused = 0
+        self._payload = None
+        self._payload_at = 0.0
+        self._seq = 0
+        self._previous = None
+        self._thread = None
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._collect_lock = threading.Lock()
+
+    def collect(self) -> Dict:
+        """Compute one payload, with throughput against the previous one"""
+        with self._collect_lock:
+            columns = self.wg.get_peer_columns(('latest_handshake', 'transfer_rx', 'transfer_tx'))
+            now = time.time()
+            cutoff = now - CONNECTED_WINDOW
+            total_rx = sum(columns['transfer_rx'])
+            total_tx = sum(columns['transfer_tx'])
+
+            rx_rate = tx_rate = 0.0
+            if self._previous is not None and now > self._previous[0]:
+                elapsed = now - self._previous[0]
+                rx_rate = max(total_rx - self._previous[1], 0) / elapsed
+                tx_rate = max(total_tx - self._previous[2], 0) / elapsed
+            self._previous = (now, total_rx, total_tx)
+
+            return {
+                'timestamp': datetime.fromtimestamp(now).isoformat(),
+                'total_clients': self.store.count_clients(),
+                'connected_clients': sum(1 for handshake in columns['latest_handshake'] if handshake > cutoff),
+                'total_rx': total_rx,
+                'total_tx': total_tx,
+                'total_data': total_rx + total_tx,
+                'rx_rate': round(rx_rate, 1),
+                'tx_rate': round(tx_rate, 1),
+                'interval': self.interval
+            }
+
+    def latest(self) -> Dict:
+        """The current payload, computed now if no tick is recent enough"""
+        with self._cond:
+            if self._payload is not None and time.time() - self._payload_at < self.interval:
+                return json.loads(self._payload)
+        return self._publish(self.collect())
+
+    def _publish(self, payload: Dict) -> Dict:
+        with self._cond:
+            self._payload = json.dumps(payload, separators=(',', ':'))
+            self._payload_at = time.time()
+            self._seq += 1
+            self.ticks += 1
+            self._cond.notify_all()
+        return payload
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self.subscribers == 0:
+                    self._thread = None
+                    return
+            try:
+                self._publish(self.collect())
+            except Exception as e:
+                logger.warning(f"Could not collect live stats: {e}")
+            time.sleep(self.interval)
+
+    def _subscribe(self):
+        with self._cond:
+            if self._pid != os.getpid():
+                # Threads don't survive a fork into a new worker
+                self._pid = os.getpid()
+                self._thread = None
+                self.subscribers = 0
+            if self.subscribers >= self.max_streams:
+                self.refused += 1
+                raise StreamLimitReached(f'{self.subscribers} live streams open in this worker')
+            self.subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-stats', daemon=True)
+                self._thread.start()
+
+    def _unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def stream(self, duration: Optional[float] = None) -> Subscription:
+        """Server-sent events for one subscriber, ending after `duration` seconds
+
+        Raises StreamLimitReached when the worker has no stream left. Ending
+        streams now and then frees their worker thread; EventSource
+        reconnects on its own after the advertised retry delay.
+        """
+        duration = Config.LIVE_STATS_STREAM_SECONDS if duration is None else duration
+        self._subscribe()
+        return Subscription(self, self._events(time.monotonic() + duration))
+
+    def _events(self, deadline: float) -> Iterator[str]:
+        yield f'retry: {int(self.interval * 1000)}\n\n'
+        with self._cond:
+            # Start from the current payload unless it is stale
+            fresh = self._payload is not None and time.time() - self._payload_at < self.interval
+            seen = self._seq - 1 if fresh else self._seq
+        while time.monotonic() < deadline:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._seq != seen,
+                    timeout=min(KEEPALIVE_INTERVAL, max(deadline - time.monotonic(), 0))
+                )
+                payload, seq = self._payload, self._seq
+            if seq == seen:
+                yield ': keepalive\n\n'
+                continue
+            seen = seq
+            yield f'id: {seq}\ndata: {payload}\n\n'
+
+    def stats(self) -> Dict:
+        return {
+            'subscribers': self.subscribers,
+            'max_streams': self.max_streams,
+            'refused': self.refused,
+            'ticks': self.ticks,
+            'running': self._thread is not None
+        }
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+def get_stats_broadcaster() -> StatsBroadcaster:
+    """Get the process-wide live stats broadcaster"""
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = StatsBroadcaster()
+        return _broadcaster
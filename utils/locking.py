@@ -0,0 +1,15 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def file_lock(path: str, shared: bool = False):
+    """Hold an advisory flock on path, shared between worker processes"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield fd
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
@@ -0,0 +1,310 @@
+import functools
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+from config import Config
+from utils.cache import get_shared_cache, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket bounds in seconds, from a cached read to a slow backup job
+BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5, 10.0, 60.0, 300.0)
+# Peers with a handshake this recent count as connected
+CONNECTED_WINDOW = 180
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Server-Timing category of each histogram when it is timed inside a request
+SPAN_CATEGORIES = {
+    'wgm_datastore_duration_seconds': 'store',
+    'wgm_command_duration_seconds': 'wg',
+    'wgm_qr_duration_seconds': 'qr',
+    'wgm_template_duration_seconds': 'template'
+}
+
+def _timings_dir() -> str:
+    return os.path.join(Config.CACHE_DIR, 'metrics')
+
+class TimingRegistry:
+    """Duration histograms of this process, shared with the others through files
+
+    observe() only updates counters in memory. At most every
+    METRICS_FLUSH_INTERVAL seconds the process writes its histograms to
+    CACHE_DIR/metrics/<pid>.json, so whichever worker serves /metrics can
+    add up the timings of all web workers and the automation process.
+    Files of processes that exited are dropped, which Prometheus sees as a
+    counter reset.
+    """
+
+    def __init__(self):
+        self._series = {}  # (metric, labels) -> [count, sum, per-bucket counts]
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._flushed_at = time.monotonic()
+
+    def observe(self, metric: str, labels: Tuple[Tuple[str, str], ...], seconds: float):
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child starts counting from zero
+                self._pid = os.getpid()
+                self._series = {}
+            series = self._series.get((metric, labels))
+            if series is None:
+                series = self._series[(metric, labels)] = [0, 0.0, [0] * (len(BUCKETS) + 1)]
+            series[0] += 1
+            series[1] += seconds
+            series[2][bisect_left(BUCKETS, seconds)] += 1
+            due = time.monotonic() - self._flushed_at >= Config.METRICS_FLUSH_INTERVAL
+            if due:
+                self._flushed_at = time.monotonic()
+        if due:
+            self.flush()
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {'metric': metric, 'labels': dict(labels), 'count': count, 'sum': total, 'buckets': list(buckets)}
+                for (metric, labels), (count, total, buckets) in self._series.items()
+            ]
+
+    def flush(self):
+        """Publish this process's histograms for /metrics"""
+        try:
+            write_json_atomic(os.path.join(_timings_dir(), f'{os.getpid()}.json'), {'series': self.snapshot()})
+        except OSError as e:
+            logger.debug(f"Could not write timings: {e}")
+
+_registry = TimingRegistry()
+
+def get_timing_registry() -> TimingRegistry:
+    return _registry
+
+# Spans of the request handled by this thread, see start_spans()
+_spans = threading.local()
+
+def start_spans():
+    """Start adding up timed() blocks of this thread by SPAN_CATEGORIES"""
+    _spans.totals = {}
+    _spans.depth = {}
+
+def stop_spans() -> Dict[str, List]:
+    """Stop collecting, returns category -> [seconds, calls]
+
+    Only the outermost block of a category counts towards its seconds, so a
+    DataStore method calling another one isn't counted twice.
+    """
+    totals = getattr(_spans, 'totals', None) or {}
+    _spans.totals = None
+    return totals
+
+class timed:
+    """Record the duration of a block or function in a histogram
+
+        with timed('wgm_command_duration_seconds', command='wg set'):
+            ...
+
+        @timed('wgm_job_duration_seconds', job='sample_usage')
+        def sample_usage(self):
+            ...
+
+    Inside a request started with start_spans() the duration also counts
+    towards the request's SPAN_CATEGORIES breakdown.
+    """
+
+    def __init__(self, metric: str, **labels: str):
+        self.metric = metric
+        self.labels = tuple(sorted(labels.items()))
+        self.category = SPAN_CATEGORIES.get(metric)
+        self._started = threading.local()
+
+    def __enter__(self):
+        self._started.__dict__.setdefault('stack', []).append(time.perf_counter())
+        if self.category and getattr(_spans, 'totals', None) is not None:
+            _spans.depth[self.category] = _spans.depth.get(self.category, 0) + 1
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._started.stack.pop()
+        _registry.observe(self.metric, self.labels, elapsed)
+        if self.category and getattr(_spans, 'totals', None) is not None:
+            depth = _spans.depth.get(self.category, 0) - 1
+            _spans.depth[self.category] = max(depth, 0)
+            span = _spans.totals.setdefault(self.category, [0.0, 0])
+            span[1] += 1
+            if depth <= 0:
+                span[0] += elapsed
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+def read_process_files(directory: str) -> Iterable[Dict]:
+    """JSON files named <pid>.json of live processes, removing those of dead ones"""
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return
+
+    for filename in filenames:
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            pid = int(filename[:-len('.json')])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except ProcessLookupError:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        except PermissionError:
+            pass
+        try:
+            with open(path, 'r') as f:
+                yield json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+
+def collect_timings() -> List[Dict]:
+    """Histograms of every live process, merged by metric and labels"""
+    _registry.flush()
+    merged = {}
+    for data in read_process_files(_timings_dir()):
+        for entry in data.get('series', []):
+            key = (entry['metric'], tuple(sorted(entry['labels'].items())))
+            target = merged.setdefault(key, {**entry, 'count': 0, 'sum': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)})
+            target['count'] += entry['count']
+            target['sum'] += entry['sum']
+            target['buckets'] = [a + b for a, b in zip(target['buckets'], entry['buckets'])]
+    return list(merged.values())
+
+# Exposition
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(labels: Dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+def _number(value) -> str:
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Exposition:
+    """Text format writer keeping each metric family's samples together"""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict, float]]):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            self.lines.append(f'{name}{_labels(labels)} {_number(value)}')
+
+    def histograms(self, timings: List[Dict]):
+        by_metric = {}
+        for entry in timings:
+            by_metric.setdefault(entry['metric'], []).append(entry)
+        for name in sorted(by_metric):
+            self.lines.append(f'# HELP {name} Duration in seconds')
+            self.lines.append(f'# TYPE {name} histogram')
+            for entry in sorted(by_metric[name], key=lambda e: sorted(e['labels'].items())):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), entry['buckets']):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    self.lines.append(f'{name}_bucket{_labels({**entry["labels"], "le": le})} {cumulative}')
+                self.lines.append(f'{name}_sum{_labels(entry["labels"])} {entry["sum"]!r}')
+                self.lines.append(f'{name}_count{_labels(entry["labels"])} {entry["count"]}')
+
+    def text(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+def render_metrics(store=None, wg=None) -> str:
+    """Collect every metric once and render the Prometheus text format
+
+    Peer counters come from the shared `wg show dump`. With more than
+    METRICS_MAX_PEERS peers only the busiest ones get per-peer series, and
+    METRICS_PEER_DETAIL=False drops them entirely; the totals always cover
+    every peer.
+    """
+    from utils.storage import DataStore
+    from utils.wireguard import WireGuardManager
+    started = time.perf_counter()
+    store = store or DataStore()
+    wg = wg or WireGuardManager()
+    out = _Exposition()
+    now = time.time()
+
+    out.family('wgm_info', 'gauge', 'WireGuard Manager build information',
+               [({'version': '1.0.0', 'interface': wg.interface}, 1)])
+
+    # Clients
+    profiles = {profile['id']: profile.get('name', profile['id']) for profile in store.get_all_profiles()}
+    enabled = store.count_clients(enabled=True)
+    out.family('wgm_clients', 'gauge', 'Clients by state', [
+        ({'state': 'enabled'}, enabled),
+        ({'state': 'disabled'}, store.count_clients(enabled=False)),
+        ({'state': 'expired'}, store.count_expired_clients())
+    ])
+    out.family('wgm_profile_clients', 'gauge', 'Clients per profile', [
+        ({'profile': profiles.get(profile_id, profile_id)}, count)
+        for profile_id, count in sorted(store.count_clients_by_profile().items())
+    ])
+
+    # Peers
+    dump_ok = wg.get_dump() is not None
+    peers = wg.get_peer_stats(('latest_handshake', 'transfer_rx', 'transfer_tx')) if dump_ok else {}
+    out.family('wgm_interface_up', 'gauge', 'Whether the WireGuard interface could be read', [({}, int(dump_ok))])
+    connected = sum(1 for peer in peers.values() if peer['latest_handshake'] > now - CONNECTED_WINDOW)
+    out.family('wgm_peers', 'gauge', 'Peers on the interface by connection state', [
+        ({'state': 'connected'}, connected),
+        ({'state': 'idle'}, len(peers) - connected)
+    ])
+    out.family('wgm_receive_bytes_total', 'counter', 'Bytes received from all peers',
+               [({}, sum(peer['transfer_rx'] for peer in peers.values()))])
+    out.family('wgm_transmit_bytes_total', 'counter', 'Bytes sent to all peers',
+               [({}, sum(peer['transfer_tx'] for peer in peers.values()))])
+
+    if Config.METRICS_PEER_DETAIL and Config.METRICS_MAX_PEERS > 0 and peers:
+        clients = {client.get('public_key'): client for client in store.get_all_clients()}
+        busiest = heapq.nlargest(
+            Config.METRICS_MAX_PEERS,
+            ((public_key, peer) for public_key, peer in peers.items() if public_key in clients),
+            key=lambda item: item[1]['transfer_rx'] + item[1]['transfer_tx']
+        )
+        labelled = [
+            ({'client_id': clients[public_key]['id'], 'client': clients[public_key].get('name', '')}, peer)
+            for public_key, peer in busiest
+        ]
+        out.family('wgm_peer_receive_bytes_total', 'counter', 'Bytes received from a peer',
+                   [(labels, peer['transfer_rx']) for labels, peer in labelled])
+        out.family('wgm_peer_transmit_bytes_total', 'counter', 'Bytes sent to a peer',
+                   [(labels, peer['transfer_tx']) for labels, peer in labelled])
+        out.family('wgm_peer_handshake_age_seconds', 'gauge', 'Seconds since the last handshake of a peer',
+                   [(labels, round(now - peer['latest_handshake'], 3))
+                    for labels, peer in labelled if peer['latest_handshake'] > 0])
+
+    # Timings of this and every other live process
+    out.histograms(collect_timings())
+
+    out.family('wgm_metrics_render_seconds', 'gauge', 'Time taken to collect these metrics',
+               [({}, round(time.perf_counter() - started, 6))])
+    out.family('wgm_metrics_rendered_timestamp_seconds', 'gauge', 'When these metrics were collected',
+               [({}, round(now, 3))])
+    return out.text()
+
+def get_metrics_text() -> str:
+    """The exposition shared by all workers for METRICS_CACHE_TTL seconds"""
+    return get_shared_cache().get_or_compute('metrics', Config.METRICS_CACHE_TTL, render_metrics)
@@ -0,0 +1,303 @@
+"""WireGuard statistics over generic netlink
+
+Reads the same data as `wg show <interface> dump` straight from the kernel
+and renders it in the dump format, so WireGuardManager can parse it with
+its existing code. Talking to the WireGuard netlink family needs
+CAP_NET_ADMIN: either grant it to the service, or run `manage.py
+wg-helper` as root and point WG_STATS_BACKEND=helper at its socket.
+"""
+import base64
+import ipaddress
+import os
+import socket
+import struct
+from typing import Dict, List, Optional
+
+NETLINK_GENERIC = 16
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_MULTI = 0x2
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+NLA_F_NESTED = 0x8000
+NLA_TYPE_MASK = 0x3fff
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_NEWFAMILY = 1
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+WG_GENL_NAME = 'wireguard'
+WG_GENL_VERSION = 1
+WG_CMD_GET_DEVICE = 0
+
+WGDEVICE_A_IFNAME = 2
+WGDEVICE_A_PRIVATE_KEY = 3
+WGDEVICE_A_PUBLIC_KEY = 4
+WGDEVICE_A_LISTEN_PORT = 6
+WGDEVICE_A_FWMARK = 7
+WGDEVICE_A_PEERS = 8
+
+WGPEER_A_PUBLIC_KEY = 1
+WGPEER_A_PRESHARED_KEY = 2
+WGPEER_A_ENDPOINT = 4
+WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL = 5
+WGPEER_A_LAST_HANDSHAKE_TIME = 6
+WGPEER_A_RX_BYTES = 7
+WGPEER_A_TX_BYTES = 8
+WGPEER_A_ALLOWEDIPS = 9
+
+WGALLOWEDIP_A_FAMILY = 1
+WGALLOWEDIP_A_IPADDR = 2
+WGALLOWEDIP_A_CIDR_MASK = 3
+
+NLMSG_HDR = struct.Struct('=IHHII')
+GENL_HDR = struct.Struct('=BBH')
+NLA_HDR = struct.Struct('=HH')
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+def encode_attr(attr_type: int, payload: bytes) -> bytes:
+    """Encode one netlink attribute with padding"""
+    length = NLA_HDR.size + len(payload)
+    return NLA_HDR.pack(length, attr_type) + payload + b'\0' * (_align(length) - length)
+
+def encode_nested(attr_type: int, attrs: List[bytes]) -> bytes:
+    return encode_attr(attr_type | NLA_F_NESTED, b''.join(attrs))
+
+def encode_message(msg_type: int, flags: int, seq: int, cmd: int, version: int, attrs: List[bytes]) -> bytes:
+    """Encode a generic netlink message"""
+    payload = GENL_HDR.pack(cmd, version, 0) + b''.join(attrs)
+    return NLMSG_HDR.pack(NLMSG_HDR.size + len(payload), msg_type, flags, seq, 0) + payload
+
+def parse_attrs(data: bytes) -> List[tuple]:
+    """Split a buffer into (type, payload) attribute pairs"""
+    attrs = []
+    offset = 0
+    end = len(data)
+    unpack_from = NLA_HDR.unpack_from
+    while offset + 4 <= end:
+        length, attr_type = unpack_from(data, offset)
+        if length < 4:
+            break
+        attrs.append((attr_type & NLA_TYPE_MASK, data[offset + 4:offset + length]))
+        offset += (length + 3) & ~3
+    return attrs
+
+def parse_messages(data: bytes) -> List[tuple]:
+    """Split a receive buffer into (type, flags, seq, payload) messages"""
+    messages = []
+    offset = 0
+    while offset + NLMSG_HDR.size <= len(data):
+        length, msg_type, flags, seq, _ = NLMSG_HDR.unpack_from(data, offset)
+        if length < NLMSG_HDR.size:
+            break
+        messages.append((msg_type, flags, seq, data[offset + NLMSG_HDR.size:offset + length]))
+        offset += _align(length)
+    return messages
+
+def _b64(key: bytes) -> str:
+    return base64.b64encode(key).decode() if key and any(key) else '(none)'
+
+def encode_sockaddr(endpoint: str) -> bytes:
+    """Encode "ip:port" or "[ipv6]:port" as a sockaddr_in/sockaddr_in6"""
+    host, port = endpoint.rsplit(':', 1)
+    address = ipaddress.ip_address(host.strip('[]'))
+    if address.version == 4:
+        return struct.pack('=H', socket.AF_INET) + struct.pack('!H', int(port)) + address.packed + b'\0' * 8
+    return struct.pack('=H', socket.AF_INET6) + struct.pack('!HI', int(port), 0) + address.packed + struct.pack('=I', 0)
+
+def decode_sockaddr(data: bytes) -> str:
+    family = struct.unpack_from('=H', data)[0]
+    port = struct.unpack_from('!H', data, 2)[0]
+    if family == socket.AF_INET:
+        return f"{socket.inet_ntop(socket.AF_INET, data[4:8])}:{port}"
+    if family == socket.AF_INET6:
+        return f"[{socket.inet_ntop(socket.AF_INET6, data[8:24])}]:{port}"
+    return '(none)'
+
+def _decode_allowed_ip(data: bytes) -> Optional[str]:
+    raw = cidr = None
+    for attr_type, payload in parse_attrs(data):
+        if attr_type == WGALLOWEDIP_A_IPADDR:
+            raw = payload
+        elif attr_type == WGALLOWEDIP_A_CIDR_MASK:
+            cidr = payload[0]
+    if raw is None or cidr is None:
+        return None
+    family = socket.AF_INET if len(raw) == 4 else socket.AF_INET6
+    return f"{socket.inet_ntop(family, raw)}/{cidr}"
+
+def _decode_peer(data: bytes) -> Dict:
+    peer = {'allowed_ips': []}
+    for attr_type, payload in parse_attrs(data):
+        if attr_type == WGPEER_A_PUBLIC_KEY:
+            peer['public_key'] = payload
+        elif attr_type == WGPEER_A_PRESHARED_KEY:
+            peer['preshared_key'] = payload
+        elif attr_type == WGPEER_A_ENDPOINT:
+            peer['endpoint'] = decode_sockaddr(payload)
+        elif attr_type == WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL:
+            peer['persistent_keepalive'] = struct.unpack('=H', payload[:2])[0]
+        elif attr_type == WGPEER_A_LAST_HANDSHAKE_TIME:
+            peer['latest_handshake'] = struct.unpack('=q', payload[:8])[0]
+        elif attr_type == WGPEER_A_RX_BYTES:
+            peer['transfer_rx'] = struct.unpack('=Q', payload[:8])[0]
+        elif attr_type == WGPEER_A_TX_BYTES:
+            peer['transfer_tx'] = struct.unpack('=Q', payload[:8])[0]
+        elif attr_type == WGPEER_A_ALLOWEDIPS:
+            for _, allowed in parse_attrs(payload):
+                allowed_ip = _decode_allowed_ip(allowed)
+                if allowed_ip:
+                    peer['allowed_ips'].append(allowed_ip)
+    return peer
+
+def format_dump(device: Dict, peers: List[Dict]) -> str:
+    """Render decoded device attributes in `wg show dump` format"""
+    fwmark = device.get('fwmark', 0)
+    lines = ['\t'.join([
+        _b64(device.get('private_key', b'')),
+        _b64(device.get('public_key', b'')),
+        str(device.get('listen_port', 0)),
+        f"0x{fwmark:x}" if fwmark else 'off'
+    ])]
+    for peer in peers:
+        keepalive = peer.get('persistent_keepalive', 0)
+        lines.append('\t'.join([
+            _b64(peer.get('public_key', b'')),
+            _b64(peer.get('preshared_key', b'')),
+            peer.get('endpoint', '(none)'),
+            ','.join(peer['allowed_ips']) or '(none)',
+            str(peer.get('latest_handshake', 0)),
+            str(peer.get('transfer_rx', 0)),
+            str(peer.get('transfer_tx', 0)),
+            str(keepalive) if keepalive else 'off'
+        ]))
+    return '\n'.join(lines) + '\n'
+
+class NetlinkError(Exception):
+    """Kernel returned an error for a netlink request"""
+
+class WireGuardNetlink:
+    """Read WireGuard device state from the kernel over generic netlink"""
+
+    RECV_SIZE = 1 << 17
+    # Seconds to wait for a reply before giving up on the request
+    TIMEOUT = 5.0
+
+    def __init__(self, sock_factory=None):
+        self._sock_factory = sock_factory or self._open_socket
+        self._sock = None
+        self._family_id = None
+        self._seq = 0
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_GENERIC)
+        sock.settimeout(self.TIMEOUT)
+        sock.bind((0, 0))
+        return sock
+
+    def _request(self, msg_type: int, flags: int, cmd: int, version: int, attrs: List[bytes]) -> List[bytes]:
+        """Send a request and collect the payloads of all replies"""
+        if self._sock is None:
+            self._sock = self._sock_factory()
+        self._seq += 1
+        seq = self._seq
+        self._sock.send(encode_message(msg_type, flags | NLM_F_REQUEST | NLM_F_ACK, seq, cmd, version, attrs))
+
+        replies = []
+        while True:
+            try:
+                data = self._sock.recv(self.RECV_SIZE)
+            except OSError:
+                # Timed out; replies still in flight would confuse the next request
+                self.close()
+                raise
+            if not data:
+                self.close()
+                raise NetlinkError('netlink socket closed before the reply was complete')
+            for reply_type, _, reply_seq, payload in parse_messages(data):
+                if reply_seq != seq:
+                    continue
+                if reply_type == NLMSG_ERROR:
+                    error = struct.unpack_from('=i', payload)[0]
+                    if error:
+                        raise NetlinkError(os.strerror(-error))
+                    return replies
+                if reply_type == NLMSG_DONE:
+                    return replies
+                replies.append(payload[GENL_HDR.size:])
+
+    def family_id(self) -> int:
+        """Resolve the numeric id of the wireguard genl family"""
+        if self._family_id is None:
+            replies = self._request(
+                GENL_ID_CTRL, 0, CTRL_CMD_GETFAMILY, 1,
+                [encode_attr(CTRL_ATTR_FAMILY_NAME, WG_GENL_NAME.encode() + b'\0')]
+            )
+            for payload in replies:
+                attrs = dict(parse_attrs(payload))
+                if CTRL_ATTR_FAMILY_ID in attrs:
+                    self._family_id = struct.unpack('=H', attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+            if self._family_id is None:
+                raise NetlinkError('wireguard netlink family not available')
+        return self._family_id
+
+    def get_device(self, interface: str):
+        """Return (device attributes, peers) for an interface"""
+        replies = self._request(
+            self.family_id(), NLM_F_DUMP, WG_CMD_GET_DEVICE, WG_GENL_VERSION,
+            [encode_attr(WGDEVICE_A_IFNAME, interface.encode() + b'\0')]
+        )
+
+        device = {}
+        peers = []
+        for payload in replies:
+            for attr_type, data in parse_attrs(payload):
+                if attr_type == WGDEVICE_A_PRIVATE_KEY:
+                    device['private_key'] = data
+                elif attr_type == WGDEVICE_A_PUBLIC_KEY:
+                    device['public_key'] = data
+                elif attr_type == WGDEVICE_A_LISTEN_PORT:
+                    device['listen_port'] = struct.unpack('=H', data[:2])[0]
+                elif attr_type == WGDEVICE_A_FWMARK:
+                    device['fwmark'] = struct.unpack('=I', data[:4])[0]
+                elif attr_type == WGDEVICE_A_PEERS:
+                    for _, peer_data in parse_attrs(data):
+                        peer = _decode_peer(peer_data)
+                        # Peers with many allowed IPs continue in the next message
+                        if peers and peers[-1].get('public_key') == peer.get('public_key'):
+                            peers[-1]['allowed_ips'].extend(peer['allowed_ips'])
+                        else:
+                            peers.append(peer)
+        return device, peers
+
+    def dump(self, interface: str) -> str:
+        """Get interface state in `wg show <interface> dump` format"""
+        device, peers = self.get_device(interface)
+        return format_dump(device, peers)
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+def read_helper_dump(socket_path: str, interface: str, timeout: float = 5.0) -> str:
+    """Fetch a dump from the privileged `manage.py wg-helper` process"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(interface.encode() + b'\n')
+        chunks = []
+        while True:
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    data = b''.join(chunks).decode()
+    if data.startswith('ERROR'):
+        raise NetlinkError(data.strip())
+    return data
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+import logging
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from utils.expiry import notify_expiry_change
+from utils.ipam import AddressPool, AddressPoolExhausted
+from utils.storage import DataStore
+from utils.wireguard import WireGuardManager
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for one request, keeps a single import from monopolizing a worker
+MAX_BULK_CLIENTS = 5000
+# Threads generating keys; the wg backend spends its time waiting on forks
+KEYGEN_WORKERS = 8
+
+class ProvisioningError(Exception):
+    """Invalid bulk input, carries one message per offending row"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__('; '.join(errors[:5]) + (f' (+{len(errors) - 5} more)' if len(errors) > 5 else ''))
+        self.errors = errors
+
+def parse_rows(data: str, fmt: str = None) -> List[Dict]:
+    """Parse client rows from CSV (with a header line) or JSON
+
+    JSON may be a list of objects or {"clients": [...]}. Recognized fields
+    are name, profile (ID or name), expiry_days and notes.
+    """
+    data = data.lstrip('\ufeff').strip()
+    if fmt is None:
+        fmt = 'json' if data[:1] in ('[', '{') else 'csv'
+
+    if fmt == 'json':
+        try:
+            rows = json.loads(data or '[]')
+        except ValueError as e:
+            raise ProvisioningError([f"Invalid JSON: {e}"])
+        if isinstance(rows, dict):
+            rows = rows.get('clients', [])
+        if not isinstance(rows, list):
+            raise ProvisioningError(['JSON input must be a list of client objects'])
+    elif fmt == 'csv':
+        rows = [
+            {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+            for row in csv.DictReader(io.StringIO(data))
+        ]
+    else:
+        raise ProvisioningError([f"Unsupported format: {fmt}"])
+
+    return rows
+
+def _validate(rows: List[Dict], profiles: List[Dict]) -> List[Dict]:
+    """Normalize rows and resolve their profiles, collecting every error"""
+    by_key = {}
+    for profile in profiles:
+        by_key[profile['id']] = profile
+        by_key.setdefault(profile['name'].lower(), profile)
+
+    if not rows:
+        raise ProvisioningError(['No clients given'])
+    if len(rows) > MAX_BULK_CLIENTS:
+        raise ProvisioningError([f"At most {MAX_BULK_CLIENTS} clients per import, got {len(rows)}"])
+    if not profiles:
+        raise ProvisioningError(['No profiles available. Please create a profile first.'])
+
+    errors = []
+    requests = []
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            errors.append(f"Row {number}: must be a client object")
+            continue
+        name = str(row.get('name') or '').strip()
+        if not name:
+            errors.append(f"Row {number}: name is required")
+            continue
+
+        profile_key = str(row.get('profile') or row.get('profile_id') or '').strip()
+        profile = (by_key.get(profile_key) or by_key.get(profile_key.lower())) if profile_key else profiles[0]
+        if not profile:
+            errors.append(f"Row {number}: unknown profile {profile_key!r}")
+            continue
+
+        expiry_days = row.get('expiry_days')
+        if expiry_days in (None, ''):
+            expiry_days = None
+        else:
+            try:
+                expiry_days = int(expiry_days)
+            except (TypeError, ValueError):
+                errors.append(f"Row {number}: expiry_days must be a number")
+                continue
+
+        requests.append({
+            'name': name,
+            'profile': profile,
+            'expiry_days': expiry_days,
+            'notes': str(row.get('notes') or '').strip()
+        })
+
+    if errors:
+        raise ProvisioningError(errors)
+    return requests
+
+def _generate_keys(wg: WireGuardManager, count: int) -> List[tuple]:
+    """(private, public, preshared) key triples, generated in parallel"""
+    def keys(_):
+        private_key, public_key = wg.generate_keypair()
+        return private_key, public_key, wg.generate_preshared_key()
+
+    with ThreadPoolExecutor(max_workers=min(KEYGEN_WORKERS, count)) as pool:
+        return list(pool.map(keys, range(count)))
+
+def provision_clients(rows: List[Dict], store: DataStore = None, wg: WireGuardManager = None) -> List[Dict]:
+    """Create many clients at once and add all their peers with one WireGuard update"""
+    store = store or DataStore()
+    wg = wg or WireGuardManager()
+
+    requests = _validate(rows, store.get_all_profiles())
+    keys = _generate_keys(wg, len(requests))
+
+    # Allocate every address in one pass over the free list
+    pool = AddressPool(store)
+    try:
+        slots = pool.allocate(len(requests))
+    except AddressPoolExhausted as e:
+        raise ProvisioningError([str(e)])
+
+    now = datetime.now()
+    clients = []
+    for slot, request, (private_key, public_key, preshared_key) in zip(slots, requests, keys):
+        ip_address, ipv6_address = pool.addresses(slot)
+        expiry_date = None
+        if request['expiry_days'] and request['expiry_days'] > 0:
+            expiry_date = (now + timedelta(days=request['expiry_days'])).isoformat()
+
+        clients.append({
+            'id': str(uuid.uuid4()),
+            'name': request['name'],
+            'ip_address': ip_address,
+            'ipv6_address': ipv6_address,
+            'public_key': public_key,
+            'private_key': private_key,
+            'preshared_key': preshared_key,
+            'profile_id': request['profile']['id'],
+            'profile_name': request['profile']['name'],
+            'created_at': now.isoformat(),
+            'expiry_date': expiry_date,
+            'enabled': True,
+            'notes': request['notes']
+        })
+
+    try:
+        store.save_clients(clients)
+        with wg.batch() as batch:
+            for client in clients:
+                batch.add(client['public_key'], client['preshared_key'], wg.client_allowed_ips(client))
+    except Exception:
+        # Rollback
+        for client in clients:
+            store.delete_client(client['id'])
+        pool.release(slots)
+        raise
+
+    notify_expiry_change(client['id'] for client in clients if client['expiry_date'])
+    logger.info(f"Provisioned {len(clients)} client(s)")
+    return clients
+
+def build_config_archive(clients: List[Dict], store: DataStore = None, wg: WireGuardManager = None) -> io.BytesIO:
+    """Zip archive with one .conf file per client"""
+    store = store or DataStore()
+    wg = wg or WireGuardManager()
+
+    profiles = {}
+    used_names = set()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for client in clients:
+            profile_id = client.get('profile_id', '')
+            if profile_id not in profiles:
+                profiles[profile_id] = store.get_profile(profile_id) or {'name': 'Default', 'dns': '', 'allowed_ips': ''}
+
+            base = client['name'].replace(' ', '_').replace('/', '_')
+            filename = f"{base}.conf"
+            suffix = 2
+            while filename in used_names:
+                filename = f"{base}_{suffix}.conf"
+                suffix += 1
+            used_names.add(filename)
+
+            archive.writestr(filename, wg.generate_client_config(client, profiles[profile_id]))
+
+    buffer.seek(0)
+    return buffer
+
+def archive_name(prefix: str = 'clients', when: Optional[datetime] = None) -> str:
+    return f"{prefix}_{(when or datetime.now()).strftime('%Y%m%d_%H%M%S')}.zip"
@@ -0,0 +1,253 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from utils.expiry import notify_expiry_change
+from utils.storage import DataStore
+from utils.usage_store import UsageStore
+from utils.wireguard import WireGuardManager
+
+logger = logging.getLogger(__name__)
+
+QUOTA_PERIODS = ('monthly', 'rolling')
+DEFAULT_WINDOW_DAYS = 30
+MAX_WINDOW_DAYS = 366
+GB = 1024 ** 3
+
+class Quota(NamedTuple):
+    limit: int
+    period: str
+    window_days: int
+
+def quota_fields(values) -> Dict:
+    """quota_gb, quota_period and quota_window_days from a form or JSON body
+
+    An empty quota_gb means no quota of its own. Raises ValueError with a
+    message for the user when a value is invalid.
+    """
+    raw = str(values.get('quota_gb') or '').strip()
+    if not raw:
+        return {'quota_gb': None, 'quota_period': 'monthly', 'quota_window_days': DEFAULT_WINDOW_DAYS}
+    try:
+        quota_gb = float(raw)
+        window_days = int(values.get('quota_window_days') or DEFAULT_WINDOW_DAYS)
+    except (TypeError, ValueError):
+        raise ValueError('Quota and window must be numbers')
+    if not quota_gb > 0:
+        raise ValueError('Quota must be more than 0 GB')
+    period = values.get('quota_period') or 'monthly'
+    if period not in QUOTA_PERIODS:
+        raise ValueError(f'Quota period must be one of: {", ".join(QUOTA_PERIODS)}')
+    if not 1 <= window_days <= MAX_WINDOW_DAYS:
+        raise ValueError(f'Quota window must be between 1 and {MAX_WINDOW_DAYS} days')
+    return {'quota_gb': quota_gb, 'quota_period': period, 'quota_window_days': window_days}
+
+def effective_quota(client: Dict, profile: Optional[Dict]) -> Optional[Quota]:
+    """The client's own quota, else its profile's, None if neither has one"""
+    for source in (client, profile or {}):
+        if source.get('quota_gb'):
+            return Quota(
+                int(float(source['quota_gb']) * GB),
+                source.get('quota_period') or 'monthly',
+                int(source.get('quota_window_days') or DEFAULT_WINDOW_DAYS)
+            )
+    return None
+
+def period_start(quota: Quota, today: date) -> date:
+    """First day counted towards the quota on a given day"""
+    if quota.period == 'rolling':
+        return today - timedelta(days=quota.window_days - 1)
+    return today.replace(day=1)
+
+def period_key(quota: Quota, today: date) -> str:
+    """Names the quota period a day falls in; it changes when the period rolls over"""
+    return f'{quota.period}:{quota.window_days}:{period_start(quota, today).isoformat()}'
+
+def period_usage(series: UsageStore, client_id: str, quota: Quota, today: date) -> int:
+    """Bytes a client used in its current quota period, read from the usage rollups"""
+    if quota.period == 'rolling':
+        return sum(rx + tx for _, rx, tx in series.daily_series(period_start(quota, today), today, client_id))
+    return sum(rx + tx for _, rx, tx in series.monthly_series(today, today, client_id))
+
+def _expired(client: Dict, now: datetime) -> bool:
+    try:
+        return bool(client.get('expiry_date')) and datetime.fromisoformat(client['expiry_date']) <= now
+    except (TypeError, ValueError):
+        return False
+
+class QuotaEnforcer:
+    """Disable clients over their traffic quota, enable them again when a new period starts
+
+    Runs after every usage sample with that sample's deltas. Only the
+    clients in the sample are read. Each client with a quota has an
+    accumulator of its bytes in the current period, seeded once from the
+    day or month rollups and then only incremented, so a tick costs one
+    addition per client that had traffic. The seed is read again when the
+    period moves on: a new month for monthly quotas, every day for rolling
+    windows.
+
+    Clients disabled for their quota are kept in a set, built from the
+    store on the first check, and looked at again once a day for the ones
+    whose period has rolled over since they were disabled.
+
+    An admin enabling a client over its quota stores the current period
+    key as `quota_override`; the client is then left alone until its
+    period rolls over.
+
+    WireGuard has no rate limiting, so crossing a quota removes the peer
+    rather than throttling it.
+    """
+
+    def __init__(self, store: DataStore = None, wg: WireGuardManager = None, series: UsageStore = None):
+        self.store = store or DataStore()
+        self.wg = wg or WireGuardManager()
+        self.series = series or UsageStore()
+        # client id -> [bytes used, period key]
+        self._usage = {}
+        # client id disabled for its quota -> period key when it was disabled
+        self._disabled = None
+        # Clients with traffic since the day started, the others lose their accumulator
+        self._active = set()
+        self._day = None
+
+    def _used(self, client_id: str, quota: Quota, today: date, delta: int) -> int:
+        key = period_key(quota, today)
+        entry = self._usage.get(client_id)
+        if entry is None or entry[1] != key:
+            # The rollups already hold this sample's traffic
+            entry = self._usage[client_id] = [period_usage(self.series, client_id, quota, today), key]
+        else:
+            entry[0] += delta
+        return entry[0]
+
+    def _load_disabled(self):
+        self._disabled = {
+            client['id']: None for client in self.store.get_all_clients()
+            if not client.get('enabled', True) and client.get('disabled_reason') == 'quota'
+        }
+
+    def check(self, deltas: Dict[str, Tuple[int, int]], now: datetime = None) -> Dict:
+        """Apply one sample's deltas, returns the number of clients disabled and enabled"""
+        now = now or datetime.now()
+        today = now.date()
+        profiles = {profile['id']: profile for profile in self.store.get_all_profiles()}
+        if self._disabled is None:
+            self._load_disabled()
+
+        new_day = today != self._day
+        if new_day:
+            # Forget accumulators of deleted and idle clients
+            self._usage = {client_id: entry for client_id, entry in self._usage.items() if client_id in self._active}
+            self._active = set()
+            self._day = today
+
+        over = []
+        for client_id, (rx, tx) in deltas.items():
+            client = self.store.get_client(client_id)
+            if not client or not client.get('enabled', True):
+                self._usage.pop(client_id, None)
+                continue
+            quota = effective_quota(client, profiles.get(client.get('profile_id')))
+            if quota is None:
+                self._usage.pop(client_id, None)
+                continue
+            self._active.add(client_id)
+            used = self._used(client_id, quota, today, rx + tx)
+            if used >= quota.limit and client.get('quota_override') != period_key(quota, today):
+                over.append((client, used, quota))
+
+        release = self._releasable(profiles, now) if new_day else []
+
+        return {
+            'disabled': self._disable(over, today) if over else 0,
+            'enabled': self._enable(release) if release else 0
+        }
+
+    def _releasable(self, profiles: Dict[str, Dict], now: datetime) -> List[Tuple[Dict, int, Optional[Quota]]]:
+        """Quota-disabled clients whose new period leaves them under their quota"""
+        today = now.date()
+        release = []
+        for client_id, disabled_key in list(self._disabled.items()):
+            client = self.store.get_client(client_id)
+            if not client or client.get('enabled', True) or client.get('disabled_reason') != 'quota':
+                # Deleted, or enabled and disabled again by hand meanwhile
+                del self._disabled[client_id]
+                continue
+            quota = effective_quota(client, profiles.get(client.get('profile_id')))
+            if quota is not None and period_key(quota, today) == disabled_key:
+                continue
+            used = self._used(client_id, quota, today, 0) if quota else 0
+            if (quota is None or used < quota.limit) and not _expired(client, now):
+                release.append((client, used, quota))
+        return release
+
+    def _applied(self, batch, entries: List[Tuple[Dict, int, Optional[Quota]]], action: str) -> List:
+        """Entries whose peer change went through, logging the ones that failed"""
+        failed = batch.apply_each_on_failure()
+        if failed:
+            logger.error(f"Failed to {action} {len(failed)} client(s): "
+                         f"{', '.join(client['name'] for client, _, _ in entries if client['public_key'] in failed)}")
+        return [entry for entry in entries if entry[0]['public_key'] not in failed]
+
+    def _disable(self, over: List[Tuple[Dict, int, Quota]], today: date) -> int:
+        batch = self.wg.batch()
+        for client, _, _ in over:
+            batch.remove(client['public_key'])
+        over = self._applied(batch, over, 'disable over quota')
+        if not over:
+            return 0
+
+        for client, _, quota in over:
+            client['enabled'] = False
+            client['disabled_reason'] = 'quota'
+            client.pop('quota_override', None)
+            self._disabled[client['id']] = period_key(quota, today)
+            self._usage.pop(client['id'], None)
+        self.store.save_clients([client for client, _, _ in over])
+
+        for client, used, quota in over:
+            self.store.log_audit(
+                'CLIENT_AUTO_DISABLED',
+                'system',
+                {
+                    'client_id': client['id'],
+                    'name': client['name'],
+                    'reason': 'quota',
+                    'used_gb': round(used / GB, 3),
+                    'quota_gb': round(quota.limit / GB, 3)
+                }
+            )
+        logger.info(f"Disabled {len(over)} client(s) over quota")
+        return len(over)
+
+    def _enable(self, release: List[Tuple[Dict, int, Optional[Quota]]]) -> int:
+        batch = self.wg.batch()
+        for client, _, _ in release:
+            batch.add(client['public_key'], client['preshared_key'], self.wg.client_allowed_ips(client))
+        release = self._applied(batch, release, 're-enable after quota reset')
+        if not release:
+            return 0
+
+        for client, _, _ in release:
+            client['enabled'] = True
+            client.pop('disabled_reason', None)
+            del self._disabled[client['id']]
+        self.store.save_clients([client for client, _, _ in release])
+        notify_expiry_change(client['id'] for client, _, _ in release)
+
+        for client, used, quota in release:
+            self.store.log_audit(
+                'CLIENT_AUTO_ENABLED',
+                'system',
+                {
+                    'client_id': client['id'],
+                    'name': client['name'],
+                    'reason': 'quota_reset',
+                    'used_gb': round(used / GB, 3),
+                    'quota_gb': round(quota.limit / GB, 3) if quota else None
+                }
+            )
+        logger.info(f"Re-enabled {len(release)} client(s) after quota reset")
+        return len(release)
+
+    def stats(self) -> Dict:
+        return {'tracked': len(self._usage), 'disabled': len(self._disabled or ())}
@@ -0,0 +1,207 @@
+import cProfile
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List
+from flask import g, request, before_render_template, template_rendered
+from config import Config
+from utils.cache import write_json_atomic
+from utils.metrics import SPAN_CATEGORIES, get_timing_registry, read_process_files, start_spans, stop_spans, timed
+
+logger = logging.getLogger(__name__)
+
+# Column order of a recorded request: total seconds, then one per category
+CATEGORIES = tuple(SPAN_CATEGORIES.values())
+PERCENTILES = (50, 90, 99)
+CATEGORY_NAMES = {
+    'store': 'DataStore',
+    'wg': 'WireGuard commands',
+    'qr': 'QR codes',
+    'template': 'Templates'
+}
+
+def _timings_dir() -> str:
+    return os.path.join(Config.CACHE_DIR, 'requests')
+
+def percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[min(rank, len(ordered)) - 1]
+
+class RequestTimer:
+    """Per-request timing breakdown, rolling percentiles and sampled profiles
+
+    Every request collects the timed() blocks it runs into categories
+    (DataStore, wg commands, QR codes, templates) and answers with a
+    Server-Timing header, so the browser's network panel shows where a slow
+    page spent its time. The durations also go into a rolling window of the
+    last REQUEST_TIMING_WINDOW requests per endpoint, which each worker
+    writes to CACHE_DIR/requests/<pid>.json every METRICS_FLUSH_INTERVAL
+    seconds for the percentile table on /settings/performance.
+
+    With PROFILE_EVERY_N set, every Nth request of a worker runs under
+    cProfile and leaves a pstats file in PROFILE_DIR, for example for
+    `python -m pstats` or snakeviz. One request per worker is profiled at
+    a time.
+    """
+
+    def __init__(self, app=None):
+        self.window = Config.REQUEST_TIMING_WINDOW
+        self.profile_every = Config.PROFILE_EVERY_N
+        self.profile_dir = Config.PROFILE_DIR
+        self._windows = {}  # endpoint -> deque of (total, *categories)
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._profiling = threading.Lock()
+        self._pid = os.getpid()
+        self._flushed_at = time.monotonic()
+        self._templates = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not Config.REQUEST_TIMING_ENABLED:
+            return
+        app.before_request_funcs.setdefault(None, []).insert(0, self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        app.extensions['request_timer'] = self
+
+    # Templates are timed between Flask's render signals
+    def _template_started(self, sender, template, context, **extra):
+        span = timed('wgm_template_duration_seconds', template=template.name or 'string')
+        self._templates.__dict__.setdefault('stack', []).append(span.__enter__())
+
+    def _template_finished(self, sender, template, context, **extra):
+        stack = getattr(self._templates, 'stack', None)
+        if stack:
+            stack.pop().__exit__(None, None, None)
+
+    def _before(self):
+        g.request_started = time.perf_counter()
+        self._templates.stack = []
+        start_spans()
+        if self.profile_every > 0 and next(self._counter) % self.profile_every == 0:
+            if self._profiling.acquire(blocking=False):
+                try:
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+                    g.request_profiler = profiler
+                except ValueError as e:
+                    # Another profiler (a debugger, coverage) already owns the hook
+                    self._profiling.release()
+                    logger.debug(f"Could not profile request: {e}")
+
+    def _after(self, response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        spans = stop_spans()
+        endpoint = request.endpoint or 'unmatched'
+
+        timings = [
+            f'{category};dur={seconds * 1000:.1f};desc="{CATEGORY_NAMES[category]} ({calls})"'
+            for category, (seconds, calls) in spans.items()
+        ]
+        timings.append(f'total;dur={total * 1000:.1f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+
+        get_timing_registry().observe('wgm_request_duration_seconds', (('endpoint', endpoint),), total)
+        self.record(endpoint, total, spans)
+        return response
+
+    def _teardown(self, exc):
+        stop_spans()
+        profiler = g.pop('request_profiler', None)
+        if profiler is None:
+            return
+        try:
+            profiler.disable()
+            self._dump_profile(profiler)
+        finally:
+            self._profiling.release()
+
+    def _dump_profile(self, profiler: cProfile.Profile):
+        endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+        filename = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{endpoint}-{os.getpid()}.prof"
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, filename))
+            self._prune_profiles()
+        except OSError as e:
+            logger.warning(f"Could not write profile {filename}: {e}")
+
+    def _prune_profiles(self):
+        """Keep the newest PROFILE_MAX_FILES profiles"""
+        profiles = sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.prof'))
+        for name in profiles[:max(len(profiles) - Config.PROFILE_MAX_FILES, 0)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def record(self, endpoint: str, total: float, spans: Dict[str, List]):
+        row = (round(total, 6),) + tuple(round(spans.get(category, (0.0,))[0], 6) for category in CATEGORIES)
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child starts with empty windows
+                self._pid = os.getpid()
+                self._windows = {}
+            window = self._windows.get(endpoint)
+            if window is None:
+                window = self._windows[endpoint] = deque(maxlen=self.window)
+            window.append(row)
+            due = time.monotonic() - self._flushed_at >= Config.METRICS_FLUSH_INTERVAL
+            if due:
+                self._flushed_at = time.monotonic()
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Publish this worker's windows for the percentile table"""
+        with self._lock:
+            windows = {endpoint: list(rows) for endpoint, rows in self._windows.items()}
+        try:
+            write_json_atomic(os.path.join(_timings_dir(), f'{os.getpid()}.json'), {'windows': windows})
+        except OSError as e:
+            logger.debug(f"Could not write request timings: {e}")
+
+    def table(self) -> List[Dict]:
+        """Percentiles per endpoint over the windows of all live workers, slowest p90 first"""
+        self.flush()
+        merged = {}
+        for data in read_process_files(_timings_dir()):
+            for endpoint, rows in data.get('windows', {}).items():
+                merged.setdefault(endpoint, []).extend(rows)
+
+        table = []
+        for endpoint, rows in merged.items():
+            totals = sorted(row[0] for row in rows)
+            entry = {
+                'endpoint': endpoint,
+                'requests': len(rows),
+                'max': totals[-1] * 1000,
+                'mean': {
+                    category: sum(row[index + 1] for row in rows) / len(rows) * 1000
+                    for index, category in enumerate(CATEGORIES)
+                }
+            }
+            for pct in PERCENTILES:
+                entry[f'p{pct}'] = percentile(totals, pct) * 1000
+            table.append(entry)
+        table.sort(key=lambda entry: entry['p90'], reverse=True)
+        return table
+
+def get_request_timer(app) -> RequestTimer:
+    """The RequestTimer registered on an app, None when timing is disabled"""
+    return app.extensions.get('request_timer')
@@ -1,8 +1,14 @@
 import json
 import os
+from collections import deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 from config import Config
+from utils.cache import get_directory_cache, write_json_atomic
+from utils.client_store import get_client_store
+from utils.locking import file_lock
+from utils.metrics import timed
 
 class DataStore:
     """File-based data storage for clients, profiles, and settings"""
@@ -13,6 +19,8 @@ class DataStore:
         self.profiles_dir = os.path.join(self.data_dir, 'profiles')
         self.usage_dir = os.path.join(self.data_dir, 'usage')
         self.audit_dir = os.path.join(self.data_dir, 'audit')
+        self.clients = get_client_store(self.clients_dir)
+        self.profile_cache = get_directory_cache(self.profiles_dir) if Config.STORAGE_CACHE_ENABLED else None
         
     def _read_json(self, filepath: str) -> dict:
         """Read JSON file"""
@@ -23,48 +31,69 @@ class DataStore:
     
     def _write_json(self, filepath: str, data: dict):
         """Write JSON file"""
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
+        write_json_atomic(filepath, data)
     
     # Client Management
+    @timed('wgm_datastore_duration_seconds', op='get_client')
     def get_client(self, client_id: str) -> Optional[Dict]:
         """Get client by ID"""
-        filepath = os.path.join(self.clients_dir, f'{client_id}.json')
-        return self._read_json(filepath) if os.path.exists(filepath) else None
+        return self.clients.get(client_id)
+    
+    @timed('wgm_datastore_duration_seconds', op='get_client_by_public_key')
+    def get_client_by_public_key(self, public_key: str) -> Optional[Dict]:
+        """Get client by WireGuard public key"""
+        return self.clients.get_by_public_key(public_key)
     
+    @timed('wgm_datastore_duration_seconds', op='get_all_clients')
     def get_all_clients(self) -> List[Dict]:
         """Get all clients"""
-        clients = []
-        if not os.path.exists(self.clients_dir):
-            return clients
-        
-        for filename in os.listdir(self.clients_dir):
-            if filename.endswith('.json'):
-                filepath = os.path.join(self.clients_dir, filename)
-                clients.append(self._read_json(filepath))
-        
-        return sorted(clients, key=lambda x: x.get('created_at', ''), reverse=True)
+        return self.clients.list()
+    
+    @timed('wgm_datastore_duration_seconds', op='count_clients')
+    def count_clients(self, profile_id: str = None, enabled: bool = None) -> int:
+        """Count clients, optionally filtered by profile and enabled state"""
+        return self.clients.count(profile_id=profile_id, enabled=enabled)
     
+    @timed('wgm_datastore_duration_seconds', op='count_clients_by_profile')
+    def count_clients_by_profile(self) -> Dict[str, int]:
+        """Count clients per profile ID"""
+        return self.clients.count_by_profile()
+    
+    @timed('wgm_datastore_duration_seconds', op='count_expired_clients')
+    def count_expired_clients(self) -> int:
+        """Count clients past their expiry date"""
+        return self.clients.count_expired(datetime.now().isoformat())
+    
+    @timed('wgm_datastore_duration_seconds', op='save_client')
     def save_client(self, client: Dict):
         """Save client data"""
-        filepath = os.path.join(self.clients_dir, f"{client['id']}.json")
-        self._write_json(filepath, client)
+        self.clients.save(client)
+    
+    @timed('wgm_datastore_duration_seconds', op='save_clients')
+    def save_clients(self, clients: List[Dict]):
+        """Save several clients at once"""
+        self.clients.save_many(clients)
     
+    @timed('wgm_datastore_duration_seconds', op='delete_client')
     def delete_client(self, client_id: str):
         """Delete client"""
-        filepath = os.path.join(self.clients_dir, f'{client_id}.json')
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        self.clients.delete(client_id)
     
     # Profile Management
+    @timed('wgm_datastore_duration_seconds', op='get_profile')
     def get_profile(self, profile_id: str) -> Optional[Dict]:
         """Get profile by ID"""
+        if self.profile_cache:
+            return self.profile_cache.get(f'{profile_id}.json')
         filepath = os.path.join(self.profiles_dir, f'{profile_id}.json')
         return self._read_json(filepath) if os.path.exists(filepath) else None
     
+    @timed('wgm_datastore_duration_seconds', op='get_all_profiles')
     def get_all_profiles(self) -> List[Dict]:
         """Get all profiles"""
+        if self.profile_cache:
+            return sorted(self.profile_cache.list(), key=lambda x: x.get('name', ''))
+        
         profiles = []
         if not os.path.exists(self.profiles_dir):
             return profiles
@@ -78,15 +107,31 @@ class DataStore:
     
     def save_profile(self, profile: Dict):
         """Save profile data"""
+        if self.profile_cache:
+            self.profile_cache.put(f"{profile['id']}.json", profile)
+            return
         filepath = os.path.join(self.profiles_dir, f"{profile['id']}.json")
         self._write_json(filepath, profile)
     
     def delete_profile(self, profile_id: str):
         """Delete profile"""
+        if self.profile_cache:
+            self.profile_cache.remove(f'{profile_id}.json')
+            return
         filepath = os.path.join(self.profiles_dir, f'{profile_id}.json')
         if os.path.exists(filepath):
             os.remove(filepath)
     
+    def cache_stats(self) -> Dict:
+        """Hit/miss counters of the in-process record caches"""
+        stats = {}
+        client_cache = getattr(self.clients, 'cache', None)
+        if client_cache:
+            stats['clients'] = client_cache.stats()
+        if self.profile_cache:
+            stats['profiles'] = self.profile_cache.stats()
+        return stats
+    
     # Usage Tracking
     def save_usage_snapshot(self, date: str, data: Dict):
         """Save daily usage snapshot"""
@@ -114,46 +159,130 @@ class DataStore:
         return sorted(snapshots, key=lambda x: x.get('date', ''))
     
     # Audit Logging
-    def log_audit(self, action: str, user: str, details: Dict = None):
-        """Log audit entry"""
-        today = datetime.now().strftime('%Y-%m-%d')
-        filepath = os.path.join(self.audit_dir, f'{today}.json')
-        
-        logs = self._read_json(filepath) if os.path.exists(filepath) else {'date': today, 'entries': []}
-        
-        entry = {
+    def _audit_path(self, date: str) -> str:
+        return os.path.join(self.audit_dir, f'{date}.jsonl')
+    
+    def _audit_lock(self, shared: bool = False):
+        """Lock of the day files; appenders share it, rewriting a file takes it exclusively"""
+        return file_lock(os.path.join(self.audit_dir, '.audit.lock'), shared=shared)
+    
+    def append_audit_lines(self, date: str, lines: List[str], fsync: bool = False):
+        """Append JSON-encoded entries of one day in a single O_APPEND write
+
+        Used by the batching audit writer; fsync makes the batch durable
+        before returning.
+        """
+        os.makedirs(self.audit_dir, exist_ok=True)
+        with self._audit_lock(shared=True):
+            fd = os.open(self._audit_path(date), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+            try:
+                os.write(fd, ''.join(lines).encode('utf-8'))
+                if fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+    
+    def build_audit_entry(self, action: str, user: str, details: Dict = None) -> Dict:
+        """Build an audit entry stamped with the current time"""
+        return {
             'timestamp': datetime.now().isoformat(),
             'action': action,
             'user': user,
             'details': details or {}
         }
-        
-        logs['entries'].append(entry)
-        self._write_json(filepath, logs)
     
-    def get_audit_logs(self, start_date: str, end_date: str) -> List[Dict]:
-        """Get audit logs for a date range"""
-        logs = []
+    def log_audit(self, action: str, user: str, details: Dict = None):
+        """Log audit entry"""
+        entry = self.build_audit_entry(action, user, details)
+        self.append_audit_lines(entry['timestamp'][:10], [json.dumps(entry, default=str) + '\n'])
+    
+    def _audit_dates(self, start_date: str, end_date: str) -> List[str]:
+        """Dates within the range that have an audit file, newest first"""
+        dates = set()
         if not os.path.exists(self.audit_dir):
-            return logs
+            return []
         
         for filename in os.listdir(self.audit_dir):
-            if filename.endswith('.json'):
-                date = filename.replace('.json', '')
-                if start_date <= date <= end_date:
-                    filepath = os.path.join(self.audit_dir, filename)
-                    logs.append(self._read_json(filepath))
+            date, ext = os.path.splitext(filename)
+            if ext in ('.json', '.jsonl') and start_date <= date <= end_date:
+                dates.add(date)
+        
+        return sorted(dates, reverse=True)
+    
+    def _iter_audit_file(self, date: str):
+        """Stream entries of one day in the order they were written"""
+        # Day files written before the JSONL format
+        legacy_path = os.path.join(self.audit_dir, f'{date}.json')
+        if os.path.exists(legacy_path):
+            for entry in self._read_json(legacy_path).get('entries', []):
+                yield entry
+        
+        filepath = self._audit_path(date)
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # Partially written trailing line
+                        continue
+    
+    def iter_audit_entries(self, start_date: str, end_date: str):
+        """Stream audit entries for a date range, newest day first"""
+        for date in self._audit_dates(start_date, end_date):
+            for entry in self._iter_audit_file(date):
+                entry['date'] = date
+                yield entry
+    
+    def get_recent_audit_entries(self, limit: int = 10, days: int = 2) -> List[Dict]:
+        """Get the latest audit entries without keeping whole days in memory"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days - 1)
+        recent = []
+        for date in self._audit_dates(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')):
+            recent.extend(deque(self._iter_audit_file(date), maxlen=limit))
+            if len(recent) >= limit:
+                break
         
-        return sorted(logs, key=lambda x: x.get('date', ''), reverse=True)
+        recent.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        return recent[:limit]
+    
+    def get_audit_logs(self, start_date: str, end_date: str) -> List[Dict]:
+        """Get audit logs for a date range"""
+        return [
+            {'date': date, 'entries': list(self._iter_audit_file(date))}
+            for date in self._audit_dates(start_date, end_date)
+        ]
+    
+    def convert_audit_file(self, date: str) -> int:
+        """Convert a legacy <date>.json audit file to JSONL, returns entries moved"""
+        legacy_path = os.path.join(self.audit_dir, f'{date}.json')
+        if not os.path.exists(legacy_path):
+            return 0
+        
+        # Entries appended between the read and the replace would be lost
+        with self._audit_lock():
+            entries = list(self._iter_audit_file(date))
+            lines = [json.dumps(entry, default=str) + '\n' for entry in entries]
+            
+            tmp_path = self._audit_path(date) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self._audit_path(date))
+            os.remove(legacy_path)
+        return len(entries)
     
     # Settings
+    @timed('wgm_datastore_duration_seconds', op='get_settings')
     def get_settings(self) -> Dict:
         """Get application settings"""
         filepath = os.path.join(self.data_dir, 'settings.json')
         default_settings = {
             'admin_2fa_secret': '',
             'admin_password_hash': '',
-            'last_client_ip': 2,  # Start from 10.0.0.2
             'initialized': False
         }
         
@@ -161,13 +290,37 @@ class DataStore:
             return {**default_settings, **self._read_json(filepath)}
         return default_settings
     
+    def _settings_lock(self):
+        """Exclusive lock serializing settings writers across worker processes"""
+        return file_lock(os.path.join(self.data_dir, '.settings.lock'))
+    
     def save_settings(self, settings: Dict):
         """Save application settings"""
         filepath = os.path.join(self.data_dir, 'settings.json')
-        self._write_json(filepath, settings)
+        with self._settings_lock():
+            self._write_json(filepath, settings)
+    
+    @contextmanager
+    def modify_settings(self):
+        """Read, change and save settings atomically
+        
+            with store.modify_settings() as settings:
+                settings['counter'] += 1
+        
+        Other processes modifying settings wait until the block is done,
+        so no update is lost between the read and the write.
+        """
+        filepath = os.path.join(self.data_dir, 'settings.json')
+        with self._settings_lock():
+            settings = self.get_settings()
+            yield settings
+            self._write_json(filepath, settings)
+    
+    def update_settings(self, values: Dict):
+        """Update several settings atomically"""
+        with self.modify_settings() as settings:
+            settings.update(values)
     
     def update_setting(self, key: str, value):
         """Update a single setting"""
-        settings = self.get_settings()
-        settings[key] = value
-        self.save_settings(settings)
+        self.update_settings({key: value})
@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import Config
+from utils.cache import write_json_atomic
+from utils.storage import DataStore
+from utils.usage_store import UsageStore
+from utils.wgdump import parse_peer_stats
+from utils.wireguard import WireGuardManager
+
+logger = logging.getLogger(__name__)
+
+def counter_delta(current: int, last: Optional[int]) -> int:
+    """Traffic since the last sample of a cumulative wg counter
+
+    Counters restart from zero when the interface comes back up or a peer
+    is removed and re-added, so a value below the last one means everything
+    counted so far is new traffic.
+    """
+    if last is None or current < last:
+        return current
+    return current - last
+
+class UsageCollector:
+    """Turn cumulative peer counters into per-client traffic deltas
+
+    Every sample() reads the counters once, computes each client's delta
+    against the last counters (kept in usage/state/collector.json so
+    restarts don't double count) and records it at three resolutions:
+
+    - usage/minutes/<date>.jsonl: one line per sample with non-zero deltas
+    - the columnar UsageStore: hour and day buckets, per client and overall
+    - usage/<date>.json: the daily snapshot in its original format,
+      refreshed from the day buckets whenever an hour completes
+    """
+
+    def __init__(self, store: DataStore = None, wg: WireGuardManager = None, series: UsageStore = None):
+        self.store = store or DataStore()
+        self.wg = wg or WireGuardManager()
+        self.usage_dir = self.store.usage_dir
+        self.minutes_dir = os.path.join(self.usage_dir, 'minutes')
+        self.state_path = os.path.join(self.usage_dir, 'state', 'collector.json')
+        self._series = series
+        # The sample and midnight jobs may fire at the same moment
+        self._lock = threading.Lock()
+
+    @property
+    def series(self) -> UsageStore:
+        """Writable usage store, only opened by the process that samples"""
+        if self._series is None:
+            self._series = UsageStore(writable=True)
+        return self._series
+
+    # State
+    def _load_state(self) -> Optional[Dict]:
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_state(self, state: Dict):
+        write_json_atomic(self.state_path, state)
+
+    # Sampling
+    def sample(self, now: datetime = None) -> Dict[str, Tuple[int, int]]:
+        """Read counters once and record the deltas, returns them by client id"""
+        with self._lock:
+            return self._sample(now or datetime.now())
+
+    def _sample(self, now: datetime) -> Dict[str, Tuple[int, int]]:
+        dump = self.wg.get_dump()
+        if dump is None:
+            # A failed read must not look like every peer disappeared
+            logger.warning("Skipping usage sample, WireGuard stats unavailable")
+            return {}
+        peers = parse_peer_stats(dump, ('transfer_rx', 'transfer_tx'))
+
+        state = self._load_state()
+        first_run = state is None
+        state = state or {'counters': {}, 'hour': None}
+        last_counters = state['counters']
+
+        clients = {client.get('public_key'): client for client in self.store.get_all_clients()}
+        deltas = {}
+        for public_key, peer in peers.items():
+            last = last_counters.get(public_key)
+            last_counters[public_key] = [peer.transfer_rx, peer.transfer_tx]
+            client = clients.get(public_key)
+            if first_run or client is None:
+                # Nothing to compare the first counters against
+                continue
+            rx = counter_delta(peer.transfer_rx, last[0] if last else None)
+            tx = counter_delta(peer.transfer_tx, last[1] if last else None)
+            if rx or tx:
+                deltas[client['id']] = (rx, tx)
+
+        # Forget counters of deleted clients; removed but existing peers keep theirs
+        for public_key in [key for key in last_counters if key not in clients]:
+            del last_counters[public_key]
+
+        if deltas:
+            self.series.record(now, deltas)
+            self._append_minute(now, deltas)
+
+        hour = now.strftime('%Y-%m-%d %H')
+        if state['hour'] and state['hour'] != hour:
+            # An hour completed, refresh its day's snapshot
+            self.series.flush()
+            self.write_day_snapshot(datetime.strptime(state['hour'][:10], '%Y-%m-%d').date())
+        state['hour'] = hour
+        state['sampled_at'] = now.isoformat()
+        self._save_state(state)
+        return deltas
+
+    def flush(self):
+        """Write the buckets to disk and refresh today's snapshot"""
+        with self._lock:
+            self.series.flush()
+            self.write_day_snapshot(datetime.now().date())
+
+    def _append_minute(self, now: datetime, deltas: Dict[str, Tuple[int, int]]):
+        os.makedirs(self.minutes_dir, exist_ok=True)
+        line = json.dumps({'t': int(now.timestamp()), 'c': deltas}, separators=(',', ':')) + '\n'
+        path = os.path.join(self.minutes_dir, f"{now.strftime('%Y-%m-%d')}.jsonl")
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def write_day_snapshot(self, day: date):
+        """Daily snapshot in the original format, built from the day buckets"""
+        snapshot = {
+            'date': day.strftime('%Y-%m-%d'),
+            'timestamp': datetime.now().isoformat(),
+            'mode': 'delta',
+            'total_rx': 0,
+            'total_tx': 0,
+            'clients': []
+        }
+        for client_id, (rx, tx) in self.series.day_values(day).items():
+            client = self.store.get_client(client_id) or {}
+            snapshot['clients'].append({
+                'id': client_id,
+                'name': client.get('name', client_id),
+                'transfer_rx': rx,
+                'transfer_tx': tx,
+                'transfer_total': rx + tx
+            })
+            snapshot['total_rx'] += rx
+            snapshot['total_tx'] += tx
+
+        self.store.save_usage_snapshot(snapshot['date'], snapshot)
+
+    # Queries
+    def minute_totals(self, minutes: int, now: datetime = None) -> List[Dict]:
+        """Overall rx/tx per sample for the last `minutes` minutes, oldest first"""
+        now = now or datetime.now()
+        since = (now - timedelta(minutes=minutes)).timestamp()
+        dates = sorted({(now - timedelta(minutes=minutes)).strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d')})
+        series = []
+        for date in dates:
+            path = os.path.join(self.minutes_dir, f'{date}.jsonl')
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry['t'] < since:
+                        continue
+                    series.append({
+                        'label': datetime.fromtimestamp(entry['t']).strftime('%H:%M'),
+                        'rx': sum(v[0] for v in entry['c'].values()),
+                        'tx': sum(v[1] for v in entry['c'].values())
+                    })
+        return series
+
+    def prune_minutes(self, retention_days: int = None, now: datetime = None):
+        """Delete minute files older than the retention period"""
+        retention_days = Config.USAGE_MINUTE_RETENTION_DAYS if retention_days is None else retention_days
+        cutoff = ((now or datetime.now()) - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+        if not os.path.isdir(self.minutes_dir):
+            return
+        for filename in os.listdir(self.minutes_dir):
+            if filename.endswith('.jsonl') and filename[:-len('.jsonl')] < cutoff:
+                os.remove(os.path.join(self.minutes_dir, filename))
+
+def import_legacy_snapshots(store: DataStore = None, series: UsageStore = None) -> Iterable[Tuple[str, int]]:
+    """Load the daily usage/<date>.json snapshots into the columnar store
+
+    Snapshots written by the old midnight job hold cumulative counters, so
+    each day becomes the delta to the previous snapshot (a counter below
+    the previous value counts as a reset, as in the collector, and the
+    first snapshot counts in full). Snapshots
+    written by UsageCollector already hold deltas and are copied as is.
+    Yields (date, clients) for every imported day.
+    """
+    store = store or DataStore()
+    series = series or UsageStore(writable=True)
+    if not os.path.isdir(store.usage_dir):
+        return
+
+    dates = sorted(f[:-len('.json')] for f in os.listdir(store.usage_dir) if f.endswith('.json'))
+    previous = {}
+    for day in dates:
+        snapshot = store.get_usage_snapshot(day)
+        try:
+            moment = datetime.strptime(day, '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        if not snapshot:
+            continue
+
+        values = {}
+        counters = {}
+        for entry in snapshot.get('clients', []):
+            rx, tx = entry.get('transfer_rx', 0), entry.get('transfer_tx', 0)
+            if snapshot.get('mode') == 'delta':
+                values[entry['id']] = (rx, tx)
+                continue
+            last = previous.get(entry['id'])
+            counters[entry['id']] = (rx, tx)
+            values[entry['id']] = (
+                counter_delta(rx, last[0] if last else None),
+                counter_delta(tx, last[1] if last else None)
+            )
+        previous = counters if snapshot.get('mode') != 'delta' else {}
+
+        series.set_day(moment, {client_id: v for client_id, v in values.items() if v[0] or v[1]})
+        yield day, len(values)
+    series.flush()
@@ -0,0 +1,471 @@
+import heapq
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+from config import Config
+from utils.cache import write_json_atomic
+
+# Slot 0 holds the totals over all clients
+TOTAL_SLOT = 0
+DAY_BUCKETS = 366
+HOUR_BUCKETS = 24
+WEEK_BUCKETS = 53
+MONTH_BUCKETS = 12
+WORD = 8
+# Slots added at a time when a file runs out of room
+GROWTH = 256
+# Memory maps kept open per store
+MAX_OPEN_FILES = 64
+
+class SeriesFile:
+    """A memory-mapped matrix of uint64 counters: slot x (rx, tx) x bucket
+
+    Each slot is one contiguous block, its rx buckets followed by its tx
+    buckets, so one client's series is a single slice of the file that is
+    read without parsing. The file only ever grows; readers remap when they
+    see a larger size.
+
+    Not thread-safe: a remap releases the previous map, so UsageStore holds
+    its lock for every call.
+    """
+
+    def __init__(self, path: str, buckets: int, writable: bool = False):
+        self.path = path
+        self.buckets = buckets
+        self.writable = writable
+        self.slot_words = 2 * buckets
+        self._fd = None
+        self._mmap = None
+        self._view = None
+        self._size = 0
+
+    def _remap(self, min_slots: int = 0) -> bool:
+        """Map the file, growing it to min_slots when writable, False if it doesn't exist"""
+        if self._fd is None:
+            if self.writable:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o640)
+            else:
+                try:
+                    self._fd = os.open(self.path, os.O_RDONLY)
+                except FileNotFoundError:
+                    return False
+
+        size = os.fstat(self._fd).st_size
+        wanted = min_slots * self.slot_words * WORD
+        if self.writable and size < wanted:
+            slots = -(-min_slots // GROWTH) * GROWTH
+            size = slots * self.slot_words * WORD
+            os.ftruncate(self._fd, size)
+
+        if size != self._size:
+            self._unmap()
+            if size:
+                access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+                self._mmap = mmap.mmap(self._fd, size, access=access)
+                self._view = memoryview(self._mmap).cast('Q')
+            self._size = size
+        return True
+
+    def _unmap(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a slice; the map goes away with it
+                pass
+            self._mmap = None
+        self._size = 0
+
+    @property
+    def slots(self) -> int:
+        self._remap()
+        return self._size // (self.slot_words * WORD)
+
+    def series(self, slot: int, start: int = 0, stop: int = None) -> Tuple[memoryview, memoryview]:
+        """rx and tx buckets [start, stop) of a slot, as read-only views"""
+        stop = self.buckets if stop is None else stop
+        if not self._remap() or slot >= self.slots:
+            empty = memoryview(bytes((stop - start) * WORD)).cast('Q')
+            return empty, empty
+        base = slot * self.slot_words
+        rx = self._view[base + start:base + stop]
+        tx = self._view[base + self.buckets + start:base + self.buckets + stop]
+        return rx.toreadonly(), tx.toreadonly()
+
+    def add(self, slot: int, bucket: int, rx: int, tx: int):
+        """Add traffic to one bucket of a slot"""
+        self._remap(slot + 1)
+        base = slot * self.slot_words
+        self._view[base + bucket] += rx
+        self._view[base + self.buckets + bucket] += tx
+
+    def get(self, slot: int, bucket: int) -> Tuple[int, int]:
+        """(rx, tx) of one bucket of a slot"""
+        if not self._remap() or slot >= self.slots:
+            return 0, 0
+        base = slot * self.slot_words
+        return self._view[base + bucket], self._view[base + self.buckets + bucket]
+
+    def set(self, slot: int, bucket: int, rx: int, tx: int):
+        """Overwrite one bucket of a slot"""
+        self._remap(slot + 1)
+        base = slot * self.slot_words
+        self._view[base + bucket] = rx
+        self._view[base + self.buckets + bucket] = tx
+
+    def bucket_column(self, bucket: int) -> List[Tuple[int, int]]:
+        """(rx, tx) of one bucket for every slot"""
+        if not self._remap():
+            return []
+        view = self._view
+        return [
+            (view[base + bucket], view[base + self.buckets + bucket])
+            for base in range(0, self.slots * self.slot_words, self.slot_words)
+        ]
+
+    def flush(self):
+        if self._mmap is not None and self.writable:
+            self._mmap.flush()
+
+    def close(self):
+        self.flush()
+        self._unmap()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class UsageStore:
+    """Columnar usage history under DATA_DIR/usage/series
+
+    - days-<year>.bin: one bucket per day of the year (366)
+    - hours-<date>.bin: one bucket per hour of the day (24)
+    - weeks-<iso year>.bin: one bucket per ISO week (53)
+    - months-<year>.bin: one bucket per month (12)
+    - active-<year>.bin: clients with traffic per day of the year, in the rx
+      buckets of slot 0
+    - clients.json: client id -> slot, slot 0 being the overall totals
+
+    Week and month buckets are rollups of the day buckets kept up to date
+    by the same writes, so a range of years reads a few dozen buckets
+    instead of one per day.
+
+    Only the usage collector writes; web workers open the files read-only.
+    Every read and write holds the store's lock, so request threads never
+    see a file remapped or closed under them.
+    """
+
+    def __init__(self, directory: str = None, writable: bool = False):
+        self.directory = directory or os.path.join(Config.DATA_DIR, 'usage', 'series')
+        self.writable = writable
+        self._slots = {}
+        self._slots_key = None
+        self._files = OrderedDict()
+        self._lock = threading.RLock()
+
+    # Slots
+    def _slots_path(self) -> str:
+        return os.path.join(self.directory, 'clients.json')
+
+    def client_slots(self) -> Dict[str, int]:
+        """client id -> slot, reloaded when another process assigned new slots"""
+        with self._lock:
+            path = self._slots_path()
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return self._slots
+            key = (st.st_ino, st.st_mtime_ns)
+            if key != self._slots_key:
+                with open(path, 'r') as f:
+                    self._slots = json.load(f).get('slots', {})
+                self._slots_key = key
+            return self._slots
+
+    def slot_for(self, client_id: str, create: bool = False) -> Optional[int]:
+        """Slot of a client, assigning the next free one when create is set"""
+        with self._lock:
+            slots = self.client_slots()
+            slot = slots.get(client_id)
+            if slot is None and create:
+                slot = max(slots.values(), default=TOTAL_SLOT) + 1
+                self._slots = {**slots, client_id: slot}
+                write_json_atomic(self._slots_path(), {'slots': self._slots})
+                st = os.stat(self._slots_path())
+                self._slots_key = (st.st_ino, st.st_mtime_ns)
+            return slot
+
+    # Files
+    def _file(self, name: str, buckets: int) -> SeriesFile:
+        with self._lock:
+            series = self._files.get(name)
+            if series is None:
+                series = SeriesFile(os.path.join(self.directory, name), buckets, self.writable)
+                self._files[name] = series
+                if len(self._files) > MAX_OPEN_FILES:
+                    self._files.popitem(last=False)[1].close()
+            else:
+                self._files.move_to_end(name)
+            return series
+
+    def day_file(self, year: int) -> SeriesFile:
+        return self._file(f'days-{year}.bin', DAY_BUCKETS)
+
+    def hour_file(self, day: date) -> SeriesFile:
+        return self._file(f"hours-{day.strftime('%Y-%m-%d')}.bin", HOUR_BUCKETS)
+
+    def week_file(self, iso_year: int) -> SeriesFile:
+        return self._file(f'weeks-{iso_year}.bin', WEEK_BUCKETS)
+
+    def month_file(self, year: int) -> SeriesFile:
+        return self._file(f'months-{year}.bin', MONTH_BUCKETS)
+
+    def active_file(self, year: int) -> SeriesFile:
+        return self._file(f'active-{year}.bin', DAY_BUCKETS)
+
+    @staticmethod
+    def day_bucket(day: date) -> int:
+        return day.timetuple().tm_yday - 1
+
+    def _rollups(self, day: date) -> List[Tuple[SeriesFile, int]]:
+        """(file, bucket) of the day, week and month a day counts towards"""
+        iso_year, week, _ = day.isocalendar()
+        return [
+            (self.day_file(day.year), self.day_bucket(day)),
+            (self.week_file(iso_year), week - 1),
+            (self.month_file(day.year), day.month - 1)
+        ]
+
+    # Writes
+    def record(self, moment: datetime, deltas: Dict[str, Tuple[int, int]]):
+        """Add per-client traffic to the hour, day, week and month buckets of a moment"""
+        with self._lock:
+            targets = [(self.hour_file(moment.date()), moment.hour)] + self._rollups(moment.date())
+            days, day_bucket = targets[1]
+            total_rx = total_tx = 0
+            active = 0
+            for client_id, (rx, tx) in deltas.items():
+                slot = self.slot_for(client_id, create=True)
+                # First traffic of the day makes the client active
+                if (rx or tx) and days.get(slot, day_bucket) == (0, 0):
+                    active += 1
+                for series, bucket in targets:
+                    series.add(slot, bucket, rx, tx)
+                total_rx += rx
+                total_tx += tx
+            for series, bucket in targets:
+                series.add(TOTAL_SLOT, bucket, total_rx, total_tx)
+            if active:
+                self.active_file(moment.year).add(TOTAL_SLOT, day_bucket, active, 0)
+
+    def set_day(self, day: date, values: Dict[str, Tuple[int, int]]):
+        """Overwrite a day's values for some clients, used when importing legacy snapshots
+
+        The week and month buckets move by the difference to the old values.
+        """
+        with self._lock:
+            targets = self._rollups(day)
+            days, bucket = targets[0]
+            changes = []
+            active = 0
+            for client_id, (rx, tx) in values.items():
+                slot = self.slot_for(client_id, create=True)
+                old_rx, old_tx = days.get(slot, bucket)
+                changes.append((slot, rx - old_rx, tx - old_tx))
+                active += bool(rx or tx) - bool(old_rx or old_tx)
+            changes.append((TOTAL_SLOT, sum(c[1] for c in changes), sum(c[2] for c in changes)))
+
+            for slot, rx, tx in changes:
+                for series, target in targets:
+                    old_rx, old_tx = series.get(slot, target)
+                    series.set(slot, target, old_rx + rx, old_tx + tx)
+            if active:
+                actives = self.active_file(day.year)
+                count, _ = actives.get(TOTAL_SLOT, bucket)
+                actives.set(TOTAL_SLOT, bucket, count + active, 0)
+
+    def rebuild_rollups(self, years: List[int] = None) -> List[int]:
+        """Recompute the week and month buckets and the active counts from the day buckets
+
+        Needed once for day files written before the rollups existed.
+        Defaults to every year with a day file, returns the years rebuilt.
+        """
+        if years is None:
+            names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+            years = sorted(
+                int(name[len('days-'):-len('.bin')])
+                for name in names if name.startswith('days-') and name.endswith('.bin')
+            )
+
+        with self._lock:
+            for year in years:
+                days = self.day_file(year)
+                slots = days.slots
+                actives = self.active_file(year)
+                for bucket in range(DAY_BUCKETS):
+                    active = sum(1 for rx, tx in days.bucket_column(bucket)[TOTAL_SLOT + 1:] if rx or tx)
+                    actives.set(TOTAL_SLOT, bucket, active, 0)
+
+                months = self.month_file(year)
+                for month in range(MONTH_BUCKETS):
+                    first = date(year, month + 1, 1)
+                    last = (date(year + 1, 1, 1) if month == 11 else date(year, month + 2, 1)) - timedelta(days=1)
+                    for slot in range(slots):
+                        months.set(slot, month, *self._sum_days(slot, first, last))
+
+                # Weeks at the turn of the year also hold days of the neighbouring years
+                monday = date(year, 1, 1) - timedelta(days=date(year, 1, 1).weekday())
+                while monday.year <= year:
+                    iso_year, week, _ = monday.isocalendar()
+                    weeks = self.week_file(iso_year)
+                    for slot in range(slots):
+                        weeks.set(slot, week - 1, *self._sum_days(slot, monday, monday + timedelta(days=6)))
+                    monday += timedelta(weeks=1)
+            self.flush()
+        return years
+
+    def _sum_days(self, slot: int, start: date, end: date) -> Tuple[int, int]:
+        total_rx = total_tx = 0
+        for _, rx, tx in self._slot_days(slot, start, end):
+            total_rx += rx
+            total_tx += tx
+        return total_rx, total_tx
+
+    def flush(self):
+        with self._lock:
+            for series in self._files.values():
+                series.flush()
+
+    def prune_hours(self, retention_days: int = None, today: date = None) -> int:
+        """Delete hour files older than the retention period, returns how many
+
+        Day, week and month rollups already hold their traffic, and the
+        charts only read MAX_CHART_HOURS of hourly history.
+        """
+        retention_days = Config.USAGE_HOUR_RETENTION_DAYS if retention_days is None else retention_days
+        cutoff = f"hours-{((today or date.today()) - timedelta(days=retention_days)).strftime('%Y-%m-%d')}.bin"
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        with self._lock:
+            for filename in os.listdir(self.directory):
+                if filename.startswith('hours-') and filename.endswith('.bin') and filename < cutoff:
+                    series = self._files.pop(filename, None)
+                    if series is not None:
+                        series.close()
+                    os.remove(os.path.join(self.directory, filename))
+                    removed += 1
+        return removed
+
+    # Reads
+    def daily_series(self, start: date, end: date, client_id: str = None) -> List[Tuple[date, int, int]]:
+        """(day, rx, tx) for every day in [start, end], overall or for one client"""
+        with self._lock:
+            slot = TOTAL_SLOT if client_id is None else self.slot_for(client_id)
+            if slot is None:
+                return [(start + timedelta(days=i), 0, 0) for i in range((end - start).days + 1)]
+            return list(self._slot_days(slot, start, end))
+
+    def hourly_series(self, start: datetime, hours: int, client_id: str = None) -> List[Tuple[datetime, int, int]]:
+        """(hour, rx, tx) for `hours` hours from start, overall or for one client"""
+        with self._lock:
+            slot = TOTAL_SLOT if client_id is None else self.slot_for(client_id)
+            start = start.replace(minute=0, second=0, microsecond=0)
+            result = []
+            current = None
+            for i in range(hours):
+                moment = start + timedelta(hours=i)
+                if current != moment.date():
+                    current = moment.date()
+                    if slot is None:
+                        rx = tx = [0] * HOUR_BUCKETS
+                    else:
+                        rx, tx = self.hour_file(current).series(slot)
+                result.append((moment, rx[moment.hour], tx[moment.hour]))
+            return result
+
+    def weekly_series(self, start: date, end: date, client_id: str = None) -> List[Tuple[date, int, int]]:
+        """(monday, rx, tx) for every ISO week overlapping [start, end], overall or for one client"""
+        with self._lock:
+            slot = TOTAL_SLOT if client_id is None else self.slot_for(client_id)
+            monday = start - timedelta(days=start.weekday())
+            result = []
+            while monday <= end:
+                iso_year, week, _ = monday.isocalendar()
+                rx, tx = (0, 0) if slot is None else self.week_file(iso_year).get(slot, week - 1)
+                result.append((monday, rx, tx))
+                monday += timedelta(weeks=1)
+            return result
+
+    def monthly_series(self, start: date, end: date, client_id: str = None) -> List[Tuple[date, int, int]]:
+        """(first of the month, rx, tx) for every month overlapping [start, end]"""
+        with self._lock:
+            slot = TOTAL_SLOT if client_id is None else self.slot_for(client_id)
+            result = []
+            for year in range(start.year, end.year + 1):
+                first = start.month - 1 if year == start.year else 0
+                last = end.month if year == end.year else MONTH_BUCKETS
+                if slot is None:
+                    rx = tx = [0] * MONTH_BUCKETS
+                else:
+                    rx, tx = self.month_file(year).series(slot, first, last)
+                for offset in range(last - first):
+                    result.append((date(year, first + offset + 1, 1), rx[offset], tx[offset]))
+            return result
+
+    def top_clients(self, n: int, period: str = 'month', day: date = None) -> List[Tuple[str, int, int]]:
+        """(client id, rx, tx) of the n clients with the most traffic in the day, week or month of `day`
+
+        Reads one bucket per client and keeps a heap of n entries, so the
+        cost grows with the client count but never sorts all of them.
+        """
+        with self._lock:
+            day = day or date.today()
+            series, bucket = self._rollups(day)[('day', 'week', 'month').index(period)]
+            column = series.bucket_column(bucket)
+            slots = self.client_slots()
+            top = heapq.nlargest(
+                n,
+                ((client_id, *column[slot]) for client_id, slot in slots.items() if slot < len(column)),
+                key=lambda entry: entry[1] + entry[2]
+            )
+            return [entry for entry in top if entry[1] or entry[2]]
+
+    def day_values(self, day: date) -> Dict[str, Tuple[int, int]]:
+        """client id -> (rx, tx) of every client with traffic on a day"""
+        with self._lock:
+            column = self.day_file(day.year).bucket_column(self.day_bucket(day))
+            values = {}
+            for client_id, slot in self.client_slots().items():
+                if slot < len(column) and (column[slot][0] or column[slot][1]):
+                    values[client_id] = column[slot]
+            return values
+
+    def active_counts(self, start: date, end: date) -> List[int]:
+        """Number of clients with traffic on each day in [start, end]"""
+        with self._lock:
+            return [count for _, count, _ in self._slot_days(TOTAL_SLOT, start, end, self.active_file)]
+
+    def _slot_days(self, slot: int, start: date, end: date, source: Callable[[int], SeriesFile] = None):
+        source = source or self.day_file
+        year = start.year
+        while year <= end.year:
+            first = max(start, date(year, 1, 1))
+            last = min(end, date(year, 12, 31))
+            rx, tx = source(year).series(slot, self.day_bucket(first), self.day_bucket(last) + 1)
+            for offset in range((last - first).days + 1):
+                yield first + timedelta(days=offset), rx[offset], tx[offset]
+            year += 1
+
+    def close(self):
+        with self._lock:
+            for series in self._files.values():
+                series.close()
+            self._files.clear()
@@ -0,0 +1,153 @@
+from array import array
+from typing import Dict, Iterator, Sequence
+
+# Peer line columns of `wg show <interface> dump`, in order
+PEER_COLUMNS = (
+    'public_key',
+    'preshared_key',
+    'endpoint',
+    'allowed_ips',
+    'latest_handshake',
+    'transfer_rx',
+    'transfer_tx',
+    'persistent_keepalive'
+)
+INT_COLUMNS = ('latest_handshake', 'transfer_rx', 'transfer_tx')
+COLUMN_INDEX = {name: index for index, name in enumerate(PEER_COLUMNS)}
+
+class PeerRecord:
+    """Compact peer record, readable like the peer dicts it replaces"""
+
+    __slots__ = PEER_COLUMNS
+
+    def __getitem__(self, name: str):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def get(self, name: str, default=None):
+        return getattr(self, name, default)
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in PEER_COLUMNS if hasattr(self, name)}
+
+def _optional(value: str):
+    return None if value == '(none)' else value
+
+def _keepalive(value: str):
+    return None if value == 'off' else value
+
+def _converter(name: str):
+    """Function turning a raw dump field into its record value"""
+    if name in INT_COLUMNS:
+        return int
+    if name == 'persistent_keepalive':
+        return _keepalive
+    if name in ('preshared_key', 'endpoint'):
+        return _optional
+    return str
+
+def _iter_peer_lines(dump: str) -> Iterator[str]:
+    """Yield peer lines one at a time, skipping the interface line"""
+    find = dump.find
+    start = find('\n') + 1
+    if start == 0:
+        return
+    end = len(dump)
+    while start < end:
+        stop = find('\n', start)
+        if stop == -1:
+            stop = end
+        yield dump[start:stop]
+        start = stop + 1
+
+def _resolve_columns(columns: Sequence[str] = None) -> tuple:
+    names = PEER_COLUMNS if columns is None else tuple(columns)
+    unknown = [name for name in names if name not in COLUMN_INDEX]
+    if unknown:
+        raise ValueError(f"Unknown peer columns: {', '.join(unknown)}")
+    return names
+
+def iter_peers(dump: str, columns: Sequence[str] = None) -> Iterator[PeerRecord]:
+    """Stream peer records from dump output, parsing only the requested columns
+
+    The public key is always set; other slots are only filled when
+    requested, so e.g. columns=('transfer_rx', 'transfer_tx') skips the
+    endpoint and allowed IP strings entirely.
+    """
+    names = _resolve_columns(columns)
+    # Slot descriptors are cheaper to call than setattr() in the hot loop
+    wanted = [
+        (getattr(PeerRecord, name).__set__, COLUMN_INDEX[name], int if name in INT_COLUMNS else _converter(name))
+        for name in names if name != 'public_key'
+    ]
+    max_split = max([index for _, index, _ in wanted], default=0) + 1
+    min_parts = max(max_split, 2)
+    set_public_key = PeerRecord.public_key.__set__
+
+    for line in _iter_peer_lines(dump):
+        parts = line.split('\t', max_split)
+        if len(parts) < min_parts:
+            continue
+        record = PeerRecord()
+        set_public_key(record, parts[0])
+        for setter, index, convert in wanted:
+            setter(record, convert(parts[index]))
+        yield record
+
+def redact_dump(dump: str) -> str:
+    """Dump output without the interface private key and the peers' preshared keys
+
+    Both are replaced with '(none)'. Stats readers never use them, and the
+    output is cached in files outside /etc/wireguard.
+    """
+    lines = dump.split('\n')
+    if lines[0]:
+        interface = lines[0].split('\t', 1)
+        lines[0] = '\t'.join(['(none)'] + interface[1:])
+    for index in range(1, len(lines)):
+        parts = lines[index].split('\t', 2)
+        if len(parts) == 3:
+            lines[index] = f'{parts[0]}\t(none)\t{parts[2]}'
+    return '\n'.join(lines)
+
+def iter_peer_dicts(dump: str) -> Iterator[Dict]:
+    """Stream full peer dicts in the get_interface_stats format"""
+    for line in _iter_peer_lines(dump):
+        parts = line.split('\t')
+        if len(parts) >= 8:
+            yield {
+                'public_key': parts[0],
+                'preshared_key': parts[1] if parts[1] != '(none)' else None,
+                'endpoint': parts[2] if parts[2] != '(none)' else None,
+                'allowed_ips': parts[3],
+                'latest_handshake': int(parts[4]),
+                'transfer_rx': int(parts[5]),
+                'transfer_tx': int(parts[6]),
+                'persistent_keepalive': parts[7] if parts[7] != 'off' else None
+            }
+
+def parse_peer_stats(dump: str, columns: Sequence[str] = None) -> Dict[str, PeerRecord]:
+    """Peer records keyed by public key"""
+    return {record.public_key: record for record in iter_peers(dump, columns)}
+
+def parse_peer_columns(dump: str, columns: Sequence[str]) -> Dict[str, Sequence]:
+    """Parse dump output into column arrays
+
+    Integer columns become array('q') so totals can be taken with sum()
+    without building a record per peer; 'public_key' gives the key order.
+    """
+    names = _resolve_columns(columns)
+    result = {name: array('q') if name in INT_COLUMNS else [] for name in names}
+    targets = [(result[name].append, COLUMN_INDEX[name], _converter(name)) for name in names]
+    max_split = max([index for _, index, _ in targets], default=0) + 1
+    min_parts = max(max_split, 2)
+
+    for line in _iter_peer_lines(dump):
+        parts = line.split('\t', max_split)
+        if len(parts) < min_parts:
+            continue
+        for append, index, convert in targets:
+            append(convert(parts[index]))
+    return result
@@ -0,0 +1,41 @@
+import base64
+import os
+from typing import Tuple
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+KEY_SIZE = 32
+
+def _encode(key: bytes) -> str:
+    return base64.b64encode(key).decode()
+
+def _decode(key: str) -> bytes:
+    raw = base64.b64decode(key.strip(), validate=True)
+    if len(raw) != KEY_SIZE:
+        raise ValueError(f"WireGuard keys are {KEY_SIZE} bytes, got {len(raw)}")
+    return raw
+
+def clamp(key: bytes) -> bytes:
+    """Clamp a Curve25519 scalar exactly like `wg genkey` does"""
+    clamped = bytearray(key)
+    clamped[0] &= 248
+    clamped[31] = (clamped[31] & 127) | 64
+    return bytes(clamped)
+
+def generate_private_key() -> str:
+    """Same as `wg genkey`"""
+    return _encode(clamp(os.urandom(KEY_SIZE)))
+
+def public_key(private_key: str) -> str:
+    """Same as `echo <private key> | wg pubkey`"""
+    key = X25519PrivateKey.from_private_bytes(_decode(private_key))
+    return _encode(key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw))
+
+def generate_keypair() -> Tuple[str, str]:
+    """Private and public key, base64 encoded"""
+    private_key = generate_private_key()
+    return private_key, public_key(private_key)
+
+def generate_preshared_key() -> str:
+    """Same as `wg genpsk`"""
+    return _encode(os.urandom(KEY_SIZE))
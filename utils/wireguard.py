@@ -1,31 +1,53 @@
+import atexit
 import subprocess
 import os
 import ipaddress
-from typing import Dict, Optional, Tuple
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 from config import Config
+from utils import wgkeys
+from utils.cache import get_shared_cache
+from utils.metrics import timed
+from utils.netlink import NetlinkError, WireGuardNetlink, read_helper_dump
+from utils.wgdump import PeerRecord, iter_peer_dicts, parse_peer_columns, parse_peer_stats, redact_dump
+
+logger = logging.getLogger(__name__)
 
 class WireGuardManager:
     """Manage WireGuard interface and configurations"""
     
+    # Netlink socket shared by all instances in this process
+    _netlink = None
+    # Last (dump, columns, peers) parsed by get_peer_stats
+    _parsed = None
+    # Peers per `wg set` invocation, keeps argv well below ARG_MAX
+    SET_CHUNK_SIZE = 1000
+    
     def __init__(self):
         self.interface = Config.WG_INTERFACE
         self.config_path = f'/etc/wireguard/{self.interface}.conf'
     
     def generate_keypair(self) -> Tuple[str, str]:
         """Generate WireGuard private and public key pair"""
+        if Config.WG_KEYGEN_BACKEND == 'native':
+            return wgkeys.generate_keypair()
+        
         try:
-            # Generate private key (use full sudo path)
-            private_key = subprocess.check_output(
-                ['/usr/bin/sudo', '/usr/bin/wg', 'genkey'],
-                stderr=subprocess.PIPE
-            ).decode().strip()
+            with timed('wgm_command_duration_seconds', command='wg genkey'):
+                # Generate private key (use full sudo path)
+                private_key = subprocess.check_output(
+                    ['/usr/bin/sudo', '/usr/bin/wg', 'genkey'],
+                    stderr=subprocess.PIPE
+                ).decode().strip()
             
-            # Generate public key from private key
-            public_key = subprocess.check_output(
-                ['/usr/bin/sudo', '/usr/bin/wg', 'pubkey'],
-                input=private_key.encode(),
-                stderr=subprocess.PIPE
-            ).decode().strip()
+                # Generate public key from private key
+                public_key = subprocess.check_output(
+                    ['/usr/bin/sudo', '/usr/bin/wg', 'pubkey'],
+                    input=private_key.encode(),
+                    stderr=subprocess.PIPE
+                ).decode().strip()
             
             return private_key, public_key
         except subprocess.CalledProcessError as e:
@@ -33,11 +55,15 @@ class WireGuardManager:
     
     def generate_preshared_key(self) -> str:
         """Generate WireGuard preshared key"""
+        if Config.WG_KEYGEN_BACKEND == 'native':
+            return wgkeys.generate_preshared_key()
+        
         try:
-            psk = subprocess.check_output(
-                ['/usr/bin/sudo', '/usr/bin/wg', 'genpsk'],
-                stderr=subprocess.PIPE
-            ).decode().strip()
+            with timed('wgm_command_duration_seconds', command='wg genpsk'):
+                psk = subprocess.check_output(
+                    ['/usr/bin/sudo', '/usr/bin/wg', 'genpsk'],
+                    stderr=subprocess.PIPE
+                ).decode().strip()
             return psk
         except subprocess.CalledProcessError as e:
             raise Exception(f"Failed to generate preshared key: {e}")
@@ -62,94 +88,179 @@ class WireGuardManager:
         
         return next_ip
     
+    @staticmethod
+    def client_allowed_ips(client: Dict) -> str:
+        """AllowedIPs value for a client's peer entry"""
+        allowed_ips = f"{client['ip_address']}/32"
+        if client.get('ipv6_address'):
+            allowed_ips += f",{client['ipv6_address']}/128"
+        return allowed_ips
+    
+    def batch(self) -> 'PeerBatch':
+        """Start a batch of peer changes applied together"""
+        return PeerBatch(self)
+    
     def add_peer(self, public_key: str, preshared_key: str, allowed_ips: str):
         """Add peer to WireGuard interface"""
-        try:
-            cmd = [
-                'sudo', 'wg', 'set', self.interface,
-                'peer', public_key,
-                'preshared-key', '/dev/stdin',
-                'allowed-ips', allowed_ips
-            ]
-            
-            subprocess.run(
-                cmd,
-                input=preshared_key.encode(),
-                check=True,
-                capture_output=True
-            )
-            
-            # Save configuration
-            self.save_config()
-            return True
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Failed to add peer: {e}")
+        with self.batch() as batch:
+            batch.add(public_key, preshared_key, allowed_ips)
+        return True
     
     def remove_peer(self, public_key: str):
         """Remove peer from WireGuard interface"""
+        with self.batch() as batch:
+            batch.remove(public_key)
+        return True
+    
+    def apply_peer_changes(self, adds: List[Tuple[str, str, str]], removes: List[str]):
+        """Apply peer adds (public key, preshared key, allowed IPs) and removes, then save once"""
+        if not adds and not removes:
+            return
+        
         try:
-            subprocess.run(
-                ['sudo', 'wg', 'set', self.interface, 'peer', public_key, 'remove'],
-                check=True,
-                capture_output=True
-            )
+            # Any number of removals fit in one `wg set`
+            for i in range(0, len(removes), self.SET_CHUNK_SIZE):
+                cmd = ['sudo', 'wg', 'set', self.interface]
+                for public_key in removes[i:i + self.SET_CHUNK_SIZE]:
+                    cmd += ['peer', public_key, 'remove']
+                with timed('wgm_command_duration_seconds', command='wg set'):
+                    subprocess.run(cmd, check=True, capture_output=True)
             
-            # Save configuration
-            self.save_config()
-            return True
+            if len(adds) == 1:
+                public_key, preshared_key, allowed_ips = adds[0]
+                with timed('wgm_command_duration_seconds', command='wg set'):
+                    subprocess.run(
+                        [
+                            'sudo', 'wg', 'set', self.interface,
+                            'peer', public_key,
+                            'preshared-key', '/dev/stdin',
+                            'allowed-ips', allowed_ips
+                        ],
+                        input=preshared_key.encode(),
+                        check=True,
+                        capture_output=True
+                    )
+            elif adds:
+                # Preshared keys can't go on the command line, so several
+                # peers are passed as a config fragment on stdin instead
+                stanzas = [
+                    f"[Peer]\nPublicKey = {public_key}\nPresharedKey = {preshared_key}\nAllowedIPs = {allowed_ips}\n"
+                    for public_key, preshared_key, allowed_ips in adds
+                ]
+                with timed('wgm_command_duration_seconds', command='wg addconf'):
+                    subprocess.run(
+                        ['sudo', 'wg', 'addconf', self.interface, '/dev/stdin'],
+                        input='\n'.join(stanzas).encode(),
+                        check=True,
+                        capture_output=True
+                    )
         except subprocess.CalledProcessError as e:
-            raise Exception(f"Failed to remove peer: {e}")
+            self.invalidate_stats()
+            raise Exception(f"Failed to apply peer changes: {e}")
+        
+        # Save configuration
+        self.save_config()
+        self.invalidate_stats()
     
     def save_config(self):
-        """Save current WireGuard configuration"""
+        """Schedule saving the current WireGuard configuration
+        
+        Writes are coalesced and happen at most once per
+        WG_CONFIG_SAVE_INTERVAL; use flush_config() when the file has to
+        be current right away.
+        """
+        get_config_persister(self.interface, self.config_path).mark_dirty()
+        return True
+    
+    def flush_config(self):
+        """Write any pending configuration change now"""
+        return get_config_persister(self.interface, self.config_path).flush()
+    
+    def _read_dump(self) -> Optional[str]:
+        """Read `wg show <interface> dump` output, returns None if the interface is unavailable"""
+        backend = Config.WG_STATS_BACKEND.lower()
+        if backend == 'netlink':
+            return self._read_dump_netlink()
+        if backend == 'helper':
+            return self._read_dump_helper()
+        
         try:
-            # Get current config from wg command
-            result = subprocess.run(
-                ['sudo', 'wg', 'showconf', self.interface],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            # Write configuration
-            with open(self.config_path, 'w') as f:
-                f.write(result.stdout)
-            
-            return True
-        except Exception as e:
-            # If interface doesn't exist yet, that's okay
-            pass
+            with timed('wgm_command_duration_seconds', command='wg show dump'):
+                result = subprocess.run(
+                    ['sudo', 'wg', 'show', self.interface, 'dump'],
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
+            return result.stdout
+        except (subprocess.CalledProcessError, OSError):
+            return None
+    
+    @timed('wgm_command_duration_seconds', command='netlink dump')
+    def _read_dump_netlink(self) -> Optional[str]:
+        """Read the dump from the kernel directly (needs CAP_NET_ADMIN)"""
+        try:
+            if WireGuardManager._netlink is None:
+                WireGuardManager._netlink = WireGuardNetlink()
+            return WireGuardManager._netlink.dump(self.interface)
+        except (NetlinkError, OSError):
+            WireGuardManager._netlink = None
+            return None
+    
+    @timed('wgm_command_duration_seconds', command='helper dump')
+    def _read_dump_helper(self) -> Optional[str]:
+        """Read the dump through the privileged `manage.py wg-helper` socket"""
+        try:
+            return read_helper_dump(Config.WG_HELPER_SOCKET, self.interface)
+        except (NetlinkError, OSError):
+            return None
+    
+    def get_dump(self) -> Optional[str]:
+        """Get `wg show dump` output, shared by all workers for WG_STATS_CACHE_TTL seconds
+        
+        The private and preshared keys are redacted before the output is cached.
+        """
+        return get_shared_cache().get_or_compute(
+            f'{self.interface}-dump', Config.WG_STATS_CACHE_TTL, self._read_redacted_dump
+        )
+    
+    def _read_redacted_dump(self) -> Optional[str]:
+        dump = self._read_dump()
+        return redact_dump(dump) if dump is not None else None
+    
+    def invalidate_stats(self):
+        """Drop cached stats after changing peers"""
+        cache = get_shared_cache()
+        cache.invalidate(f'{self.interface}-dump')
+        cache.invalidate(f'{self.interface}-status')
     
     def get_interface_stats(self) -> Dict:
         """Get WireGuard interface statistics"""
-        try:
-            result = subprocess.run(
-                ['sudo', 'wg', 'show', self.interface, 'dump'],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            lines = result.stdout.strip().split('\n')
-            peers = []
-            
-            for line in lines[1:]:  # Skip header
-                parts = line.split('\t')
-                if len(parts) >= 8:
-                    peers.append({
-                        'public_key': parts[0],
-                        'preshared_key': parts[1] if parts[1] != '(none)' else None,
-                        'endpoint': parts[2] if parts[2] != '(none)' else None,
-                        'allowed_ips': parts[3],
-                        'latest_handshake': int(parts[4]),
-                        'transfer_rx': int(parts[5]),
-                        'transfer_tx': int(parts[6]),
-                        'persistent_keepalive': parts[7] if parts[7] != 'off' else None
-                    })
-            
-            return {'peers': peers}
-        except subprocess.CalledProcessError:
+        dump = self.get_dump()
+        if dump is None:
             return {'peers': []}
+        
+        return {'peers': list(iter_peer_dicts(dump))}
+    
+    def get_peer_stats(self, columns: Sequence[str] = None) -> Dict[str, PeerRecord]:
+        """Get peer records keyed by public key, parsing only the requested columns"""
+        dump = self.get_dump()
+        if dump is None:
+            return {}
+        
+        # Reuse the parse while the shared dump has not been refreshed
+        key = tuple(columns) if columns is not None else None
+        cached = WireGuardManager._parsed
+        if cached and cached[0] is dump and cached[1] == key:
+            return cached[2]
+        
+        peers = parse_peer_stats(dump, columns)
+        WireGuardManager._parsed = (dump, key, peers)
+        return peers
+    
+    def get_peer_columns(self, columns: Sequence[str]) -> Dict[str, Sequence]:
+        """Get selected peer columns as arrays, for totals over all peers"""
+        return parse_peer_columns(self.get_dump() or '', columns)
     
     def generate_client_config(self, client: Dict, profile: Dict) -> str:
         """Generate client configuration file content"""
@@ -190,25 +301,24 @@ PersistentKeepalive = {keepalive}
     
     def is_interface_up(self) -> bool:
         """Check if WireGuard interface is up"""
-        try:
-            result = subprocess.run(
-                ['wg', 'show', self.interface],
-                capture_output=True,
-                check=True
-            )
-            return True
-        except subprocess.CalledProcessError:
-            return False
+        return self.get_dump() is not None
     
     def get_service_status(self) -> Dict:
         """Get WireGuard service status and health information"""
+        return get_shared_cache().get_or_compute(
+            f'{self.interface}-status', Config.WG_STATUS_CACHE_TTL, self._read_service_status
+        )
+    
+    def _read_service_status(self) -> Dict:
+        """Query systemd and the interface for get_service_status"""
         try:
             # Check if service is active
-            service_result = subprocess.run(
-                ['/usr/bin/systemctl', 'is-active', f'wg-quick@{self.interface}'],
-                capture_output=True,
-                text=True
-            )
+            with timed('wgm_command_duration_seconds', command='systemctl'):
+                service_result = subprocess.run(
+                    ['/usr/bin/systemctl', 'is-active', f'wg-quick@{self.interface}'],
+                    capture_output=True,
+                    text=True
+                )
             is_active = service_result.stdout.strip() == 'active'
             
             # Check if interface is up
@@ -218,19 +328,19 @@ PersistentKeepalive = {keepalive}
             peer_count = 0
             if interface_up:
                 try:
-                    stats = self.get_stats()
-                    peer_count = len(stats.get('peers', []))
+                    peer_count = len(self.get_peer_stats(()))
                 except:
                     pass
             
             # Get uptime
             uptime = 'Unknown'
             try:
-                uptime_result = subprocess.run(
-                    ['/usr/bin/systemctl', 'show', f'wg-quick@{self.interface}', '-p', 'ActiveEnterTimestamp'],
-                    capture_output=True,
-                    text=True
-                )
+                with timed('wgm_command_duration_seconds', command='systemctl'):
+                    uptime_result = subprocess.run(
+                        ['/usr/bin/systemctl', 'show', f'wg-quick@{self.interface}', '-p', 'ActiveEnterTimestamp'],
+                        capture_output=True,
+                        text=True
+                    )
                 if uptime_result.returncode == 0:
                     timestamp_line = uptime_result.stdout.strip()
                     if '=' in timestamp_line:
@@ -257,9 +367,198 @@ PersistentKeepalive = {keepalive}
     
     def reload_interface(self):
         """Reload WireGuard interface"""
+        # wg-quick reads the config file, so pending peer changes must be on disk
+        self.flush_config()
         try:
-            subprocess.run(['wg-quick', 'down', self.interface], check=False)
-            subprocess.run(['wg-quick', 'up', self.interface], check=True)
+            with timed('wgm_command_duration_seconds', command='wg-quick'):
+                subprocess.run(['wg-quick', 'down', self.interface], check=False)
+                subprocess.run(['wg-quick', 'up', self.interface], check=True)
+            self.invalidate_stats()
             return True
         except subprocess.CalledProcessError as e:
             raise Exception(f"Failed to reload interface: {e}")
+
+class PeerBatch:
+    """Collect peer changes and apply them with a single WireGuard update
+
+        with wg.batch() as batch:
+            for client in expired:
+                batch.remove(client['public_key'])
+
+    The last change queued for a public key wins. Changes are applied when
+    the block exits without an exception, or explicitly with apply().
+    """
+    
+    def __init__(self, wg: WireGuardManager):
+        self.wg = wg
+        self._changes = {}  # public key -> (preshared key, allowed IPs) or None to remove
+    
+    def add(self, public_key: str, preshared_key: str, allowed_ips: str):
+        """Queue adding or updating a peer"""
+        self._changes[public_key] = (preshared_key, allowed_ips)
+    
+    def remove(self, public_key: str):
+        """Queue removing a peer"""
+        self._changes[public_key] = None
+    
+    def __len__(self) -> int:
+        return len(self._changes)
+    
+    def apply(self):
+        """Apply all queued changes"""
+        changes, self._changes = self._changes, {}
+        adds = [(key, change[0], change[1]) for key, change in changes.items() if change is not None]
+        removes = [key for key, change in changes.items() if change is None]
+        self.wg.apply_peer_changes(adds, removes)
+    
+    def apply_each_on_failure(self) -> Set[str]:
+        """Apply all queued changes, one peer at a time if the batch fails
+        
+        A single malformed or stale key makes the whole `wg set` fail, so
+        after a failed batch every change is retried on its own. Returns
+        the public keys whose change could not be applied.
+        """
+        changes = dict(self._changes)
+        try:
+            self.apply()
+            return set()
+        except Exception as e:
+            logger.warning(f"Batch of {len(changes)} peer change(s) failed, applying them one by one: {e}")
+        
+        failed = set()
+        for public_key, change in changes.items():
+            try:
+                if change is None:
+                    self.wg.apply_peer_changes([], [public_key])
+                else:
+                    self.wg.apply_peer_changes([(public_key, change[0], change[1])], [])
+            except Exception as e:
+                logger.error(f"Failed to apply change for peer {public_key}: {e}")
+                failed.add(public_key)
+        return failed
+    
+    def __enter__(self) -> 'PeerBatch':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.apply()
+        return False
+
+class ConfigPersister:
+    """Coalesce interface config saves into at most one write per interval
+    
+    mark_dirty() only records that the running configuration changed; a
+    timer then runs `wg showconf` once and replaces the config file through
+    a temp file and rename, so a crash can never leave it truncated. A
+    failed write stays pending and is retried with the next change or flush.
+    """
+    
+    def __init__(self, interface: str, config_path: str, interval: float = None):
+        self.interface = interface
+        self.config_path = config_path
+        self.interval = Config.WG_CONFIG_SAVE_INTERVAL if interval is None else interval
+        self.writes = 0
+        self.coalesced = 0
+        self._dirty = False
+        self._timer = None
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+    
+    def mark_dirty(self):
+        """Note a configuration change, writing it within one interval"""
+        if self.interval <= 0:
+            self._dirty = True
+            self.flush()
+            return
+        
+        with self._lock:
+            if self._pid != os.getpid():
+                # Timer threads don't survive a fork into a new worker
+                self._pid = os.getpid()
+                self._timer = None
+            if self._dirty:
+                self.coalesced += 1
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+    
+    def flush(self) -> bool:
+        """Write the configuration now if it changed since the last write"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return True
+            self._dirty = False
+        
+        with self._write_lock:
+            try:
+                self._write()
+                self.writes += 1
+                return True
+            except Exception as e:
+                # Keep the change pending for the next mark_dirty() or flush()
+                with self._lock:
+                    self._dirty = True
+                if isinstance(e, subprocess.CalledProcessError) and 'No such device' in (e.stderr or ''):
+                    # If interface doesn't exist yet, that's okay
+                    logger.debug(f"Could not save {self.config_path}: {e}")
+                else:
+                    logger.warning(f"Could not save {self.config_path}: {e}")
+                return False
+    
+    def _write(self):
+        # Get current config from wg command
+        with timed('wgm_command_duration_seconds', command='wg showconf'):
+            result = subprocess.run(
+                ['sudo', 'wg', 'showconf', self.interface],
+                capture_output=True,
+                text=True,
+                check=True
+            )
+        
+        directory = os.path.dirname(self.config_path)
+        try:
+            mode = os.stat(self.config_path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o600
+        
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{self.interface}.', suffix='.tmp')
+        try:
+            os.fchmod(fd, mode)
+            with os.fdopen(fd, 'w') as f:
+                f.write(result.stdout)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.config_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+_persisters = {}
+_persisters_lock = threading.Lock()
+
+def get_config_persister(interface: str, config_path: str) -> ConfigPersister:
+    """Get the process-wide persister for an interface config file"""
+    with _persisters_lock:
+        if config_path not in _persisters:
+            _persisters[config_path] = ConfigPersister(interface, config_path)
+        return _persisters[config_path]
+
+@atexit.register
+def flush_all_configs():
+    """Write pending config changes, called at shutdown
+
+    Registered with atexit, so scripts and CLI commands that exit before
+    the save timer fires still write their changes.
+    """
+    with _persisters_lock:
+        persisters = list(_persisters.values())
+    for persister in persisters:
+        persister.flush()